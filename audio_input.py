@@ -0,0 +1,187 @@
+"""
+录音输入模块
+按需模式每次按键打开输入流；常开模式在进程生命周期内只打开一次输入流，
+持续写入环形缓冲，按键时连同按键前的预录音频一起开始录音
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from audio_processing import AudioData, CaptureBuffer, PrerollRing
+from structured_logging import get_logger
+
+log = get_logger("audio_input")
+
+
+class AudioInput:
+    """录音输入
+
+    常开模式下音频回调始终写入环形缓冲；开始录音时在同一把锁内取出最后 AUDIO_PREROLL_MS 的音频
+    写入新的录音缓冲，之后的音频块直接追加，因此按键前后的音频不会丢失也不会重复。
+    每段录音使用自己的 CaptureBuffer，停止时取出零拷贝视图，排队等待转录的录音不会被常开流覆盖。
+    """
+
+    def __init__(self, sample_rate: int, channels: int = 1, dtype=np.int16, always_on: bool = None,
+                 preroll_ms: float = None, ring_seconds: float = None, cpu_budget: float = None):
+        """初始化录音输入
+
+        Args:
+            sample_rate: 采样率
+            channels: 声道数
+            dtype: 采样数据类型
+            always_on: 是否常开输入流，默认读取 AUDIO_ALWAYS_ON
+            preroll_ms: 常开模式下每段录音包含的按键前音频（毫秒），默认读取 AUDIO_PREROLL_MS
+            ring_seconds: 环形缓冲时长（秒），默认读取 AUDIO_RING_SECONDS，不小于预录时长
+            cpu_budget: 常开模式音频回调的 CPU 占用预算（百分比），默认读取 AUDIO_CPU_BUDGET
+        """
+        if always_on is None:
+            always_on = os.getenv("AUDIO_ALWAYS_ON", "false").lower() in ("1", "true", "yes")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.always_on = always_on
+        preroll_ms = preroll_ms if preroll_ms is not None else float(os.getenv("AUDIO_PREROLL_MS", "300"))
+        self.preroll_frames = int(preroll_ms / 1000 * sample_rate)
+        ring_seconds = ring_seconds or float(os.getenv("AUDIO_RING_SECONDS", "2"))
+        ring_seconds = max(ring_seconds, preroll_ms / 1000)
+        self.cpu_budget = cpu_budget or float(os.getenv("AUDIO_CPU_BUDGET", "1.0"))
+
+        self._ring = PrerollRing(sample_rate, ring_seconds, channels, self.dtype) if always_on else None
+        self._lock = threading.Lock()
+        self._stream = None
+        self._buffer: Optional[CaptureBuffer] = None
+        self._on_block: Optional[Callable[[np.ndarray], None]] = None
+        self._start_time = 0.0
+
+        self._opened_at = None
+        self._cpu_at_open = 0.0
+        self._callbacks = 0
+        self._callback_time = 0.0
+        self._max_callback_time = 0.0
+        self._overflows = 0
+
+    def _open_stream(self):
+        import sounddevice as sd
+        stream = sd.InputStream(
+            samplerate=self.sample_rate,
+            channels=self.channels,
+            dtype=self.dtype.name,
+            callback=self._callback
+        )
+        stream.start()
+        return stream
+
+    def open(self):
+        """常开模式下打开输入流（幂等）；按需模式不做任何事"""
+        with self._lock:
+            if not self.always_on or self._stream is not None:
+                return
+            self._stream = self._open_stream()
+            self._opened_at = time.time()
+            self._cpu_at_open = time.process_time()
+        log.info(f"🎙️ 常开输入流已打开：环形缓冲 {self._ring.capacity / self.sample_rate:.1f}s "
+                 f"({self._ring.nbytes / 1024:.0f}KB)，预录 {self.preroll_frames / self.sample_rate * 1000:.0f}ms")
+
+    def _callback(self, indata, frames, time_info, status):
+        start = time.perf_counter()
+        if status and status.input_overflow:
+            self._overflows += 1
+        block = None
+        with self._lock:
+            if self._ring is not None:
+                self._ring.write(indata)
+            if self._buffer is not None:
+                block = self._buffer.write(indata)
+                on_block = self._on_block
+        if block is not None and on_block is not None:
+            on_block(block)
+        elapsed = time.perf_counter() - start
+        self._callbacks += 1
+        self._callback_time += elapsed
+        self._max_callback_time = max(self._max_callback_time, elapsed)
+
+    @property
+    def recording(self) -> bool:
+        return self._buffer is not None
+
+    def start(self, on_block: Callable[[np.ndarray], None] = None):
+        """开始录音
+
+        Args:
+            on_block: 每个新音频块（录音缓冲中的视图）的回调，流式转录用它接收音频
+        """
+        buffer = CaptureBuffer(self.sample_rate, self.channels, self.dtype)
+        preroll = None
+        if self.always_on:
+            self.open()
+        with self._lock:
+            if self._ring is not None and self.preroll_frames:
+                preroll = buffer.write(self._ring.latest(self.preroll_frames))
+            self._buffer = buffer
+            self._on_block = on_block
+            self._start_time = time.time()
+        if preroll is not None and len(preroll) and on_block is not None:
+            on_block(preroll)
+        if not self.always_on:
+            self._stream = self._open_stream()
+
+    def stop(self) -> Tuple[Optional[AudioData], float]:
+        """停止录音
+
+        Returns:
+            tuple: (录音数据，没有录到音频时为 None, 录音时长)
+        """
+        if not self.always_on and self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        with self._lock:
+            buffer, self._buffer, self._on_block = self._buffer, None, None
+        record_time = time.time() - self._start_time
+        if buffer is None or buffer.num_frames == 0:
+            return None, record_time
+        data = buffer.view()
+        buffer.close()
+        return AudioData(data, self.sample_rate), record_time
+
+    def get_stats(self) -> Dict[str, Any]:
+        """常开模式的 CPU / 内存占用"""
+        uptime = time.time() - self._opened_at if self._opened_at else 0.0
+        stats = {
+            "always_on": self.always_on,
+            "uptime": uptime,
+            "ring_bytes": self._ring.nbytes if self._ring is not None else 0,
+            "callbacks": self._callbacks,
+            "avg_callback_us": self._callback_time / self._callbacks * 1e6 if self._callbacks else 0.0,
+            "max_callback_us": self._max_callback_time * 1e6,
+            "overflows": self._overflows,
+        }
+        stats["callback_cpu_percent"] = self._callback_time / uptime * 100 if uptime > 0 else 0.0
+        stats["process_cpu_percent"] = (time.process_time() - self._cpu_at_open) / uptime * 100 if uptime > 0 else 0.0
+        return stats
+
+    def print_budget_report(self):
+        """打印常开模式的资源占用，并与 CPU 预算比较"""
+        if not self.always_on or not self._opened_at:
+            return
+        stats = self.get_stats()
+        print(f"🎙️ 常开输入流: 运行 {stats['uptime']:.0f}s | 回调 {stats['callbacks']} 次，"
+              f"平均 {stats['avg_callback_us']:.0f}µs，最大 {stats['max_callback_us']:.0f}µs | "
+              f"回调 CPU {stats['callback_cpu_percent']:.2f}%（预算 {self.cpu_budget:.2f}%）| "
+              f"进程 CPU {stats['process_cpu_percent']:.2f}% | 环形缓冲 {stats['ring_bytes'] / 1024:.0f}KB")
+        if stats["callback_cpu_percent"] > self.cpu_budget:
+            print("⚠️ 常开输入流的回调 CPU 占用超出预算，可减小 AUDIO_RING_SECONDS 或关闭 AUDIO_ALWAYS_ON")
+        if stats["overflows"]:
+            print(f"⚠️ 输入溢出 {stats['overflows']} 次，音频回调处理不及时")
+
+    def close(self):
+        """关闭常开输入流"""
+        with self._lock:
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.stop()
+            stream.close()
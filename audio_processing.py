@@ -0,0 +1,459 @@
+"""
+音频处理模块
+录音缓冲、内存音频对象、WAV 封装与上传前的压缩编码，录音数据无需落盘即可直接上传
+"""
+
+import io
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Union, Iterable, Optional
+
+import numpy as np
+from structured_logging import get_logger
+
+log = get_logger("audio")
+
+
+# WAV 格式标签：整数 PCM 与 IEEE 浮点
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+class AudioData:
+    """内存中的音频：原始 PCM 缓冲 + 采样率 + 数据类型"""
+
+    def __init__(self, pcm: Union[np.ndarray, bytes, bytearray, memoryview], sample_rate: int,
+                 dtype=np.int16, channels: int = 1):
+        """初始化音频对象
+
+        Args:
+            pcm: PCM 数据，NumPy 数组或原始字节缓冲（按 dtype 解释，不复制）
+            sample_rate: 采样率
+            dtype: 采样数据类型，pcm 为数组时以数组自身类型为准
+            channels: 声道数
+        """
+        if isinstance(pcm, np.ndarray):
+            samples = pcm
+        else:
+            samples = np.frombuffer(pcm, dtype=dtype)
+        if samples.ndim == 1 and channels > 1:
+            samples = samples.reshape(-1, channels)
+        if samples.ndim == 2:
+            channels = samples.shape[1]
+
+        self.samples = samples
+        self.sample_rate = int(sample_rate)
+        self.dtype = samples.dtype
+        self.channels = channels
+
+    @classmethod
+    def from_file(cls, audio_path: str) -> 'AudioData':
+        """从音频文件读取（WAV 使用 scipy，其他格式需要 soundfile）"""
+        if audio_path.lower().endswith(".wav"):
+            from scipy.io.wavfile import read as read_wav
+            sample_rate, samples = read_wav(audio_path)
+        else:
+            import soundfile
+            samples, sample_rate = soundfile.read(audio_path, dtype="int16")
+        return cls(samples, sample_rate)
+
+    @property
+    def num_frames(self) -> int:
+        return self.samples.shape[0]
+
+    @property
+    def duration(self) -> float:
+        """音频时长（秒）"""
+        return self.num_frames / self.sample_rate if self.sample_rate else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return self.samples.nbytes
+
+    def to_wav_bytes(self) -> bytes:
+        """直接从 NumPy 缓冲构建 WAV 文件内容，只在拼接时复制一次数据"""
+        samples = np.ascontiguousarray(self.samples)
+        if self.dtype.kind == "f":
+            format_tag = WAVE_FORMAT_IEEE_FLOAT
+        elif self.dtype.kind in ("i", "u"):
+            format_tag = WAVE_FORMAT_PCM
+        else:
+            raise ValueError(f"不支持的采样类型: {self.dtype}")
+
+        if self.dtype.byteorder == ">":
+            samples = samples.astype(self.dtype.newbyteorder("<"))
+
+        sample_width = self.dtype.itemsize
+        data_size = samples.nbytes
+        header = struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + data_size, b"WAVE",
+            b"fmt ", 16, format_tag, self.channels, self.sample_rate,
+            self.sample_rate * self.channels * sample_width,
+            self.channels * sample_width, sample_width * 8,
+            b"data", data_size,
+        )
+        return header + memoryview(samples).cast("B")
+
+    def to_upload(self):
+        """生成 multipart 上传所需的 (文件名, 内容, MIME 类型)"""
+        return "audio.wav", self.to_wav_bytes(), "audio/wav"
+
+
+class CaptureBuffer:
+    """预分配的录音缓冲
+
+    音频回调只把数据拷贝进已分配好的空间；剩余空间低于水位线时唤醒后台线程按大块扩容，
+    超过溢出阈值后由后台线程转存到内存映射的临时文件，长时间录音的内存占用可控，
+    分配内存、创建文件和大块拷贝都不在音频回调中进行。
+    停止录音时 view() 直接返回连续数据的视图，不再 concatenate。
+    """
+
+    def __init__(self, sample_rate: int, channels: int = 1, dtype=np.int16,
+                 chunk_seconds: float = None, spill_mb: float = None):
+        """初始化录音缓冲
+
+        Args:
+            sample_rate: 采样率
+            channels: 声道数
+            dtype: 采样数据类型
+            chunk_seconds: 每次扩容的时长（秒），剩余空间不足一半时开始扩容，默认读取 CAPTURE_CHUNK_SECONDS
+            spill_mb: 超过该大小（MB）后转存到内存映射文件，默认读取 CAPTURE_SPILL_MB
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        chunk_seconds = chunk_seconds or float(os.getenv("CAPTURE_CHUNK_SECONDS", "60"))
+        spill_mb = spill_mb or float(os.getenv("CAPTURE_SPILL_MB", "64"))
+        self.chunk_frames = max(1, int(chunk_seconds * sample_rate))
+        self.spill_bytes = int(spill_mb * 1024 * 1024)
+        self.high_water = self.chunk_frames // 2
+
+        self._data = np.empty((self.chunk_frames, channels), dtype=self.dtype)
+        self._length = 0
+        self._file = None
+        self._closed = False
+        # 保护 _data / _length / _file 的切换；回调持有的时间只有一次块拷贝
+        self._lock = threading.RLock()
+        self._grow_event = threading.Event()
+        self._grow_thread = threading.Thread(target=self._grow_loop, name="capture-grow", daemon=True)
+        self._grow_thread.start()
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.dtype.itemsize
+
+    @property
+    def num_frames(self) -> int:
+        return self._length
+
+    @property
+    def duration(self) -> float:
+        return self._length / self.sample_rate
+
+    @property
+    def spilled(self) -> bool:
+        """是否已转存到内存映射文件"""
+        return self._file is not None
+
+    def write(self, indata: np.ndarray) -> np.ndarray:
+        """追加一个音频块，返回缓冲中该块的视图"""
+        frames = len(indata)
+        with self._lock:
+            end = self._length + frames
+            if end > len(self._data):
+                # 后台扩容没跟上（单个块超过水位线或磁盘很慢）：只能在回调中同步扩容，不能丢音频
+                self._grow(end)
+            self._data[self._length:end] = indata
+            block = self._data[self._length:end]
+            self._length = end
+            free = len(self._data) - end
+        if free < self.high_water and not self._grow_event.is_set():
+            self._grow_event.set()
+        return block
+
+    def _grow_loop(self):
+        """后台扩容线程：剩余空间低于水位线时扩容，直到缓冲关闭"""
+        while True:
+            self._grow_event.wait()
+            self._grow_event.clear()
+            if self._closed:
+                return
+            if len(self._data) - self._length < self.high_water:
+                try:
+                    self._grow()
+                except Exception as e:
+                    log.error(f"❌ 录音缓冲扩容失败: {e}")
+
+    def _grow(self, min_frames: int = 0):
+        """扩容：内存阶段按块倍增，超过阈值后转存 mmap，mmap 阶段直接扩展文件
+
+        新空间的分配和已有数据的拷贝在锁外进行，只有拷贝期间新写入的尾部和切换在锁内完成。
+        """
+        with self._lock:
+            old, length, current_file = self._data, self._length, self._file
+        new_file = None
+        copy = True
+        capacity = max(min_frames, len(old) + max(self.chunk_frames, len(old)))
+        if current_file is None and capacity * self.frame_bytes <= self.spill_bytes:
+            data = np.empty((capacity, self.channels), dtype=self.dtype)
+        else:
+            capacity = max(min_frames, len(old) + self.chunk_frames)
+            if current_file is None:
+                # 匿名临时文件，关闭或进程退出后自动删除
+                new_file = tempfile.TemporaryFile(prefix="capture_", suffix=".pcm")
+                new_file.truncate(capacity * self.frame_bytes)
+                data = np.memmap(new_file, dtype=self.dtype, mode="r+", shape=(capacity, self.channels))
+            else:
+                # 已写入的数据留在文件中（旧映射与新映射共享同一文件页），扩大文件后重新映射即可，无需拷贝
+                current_file.truncate(capacity * self.frame_bytes)
+                data = np.memmap(current_file, dtype=self.dtype, mode="r+", shape=(capacity, self.channels))
+                copy = False
+        if copy:
+            data[:length] = old[:length]
+
+        with self._lock:
+            if self._closed or self._data is not old:
+                # 缓冲已关闭，或回调中已同步扩容过
+                if new_file is not None:
+                    new_file.close()
+                return
+            if copy:
+                data[length:self._length] = old[length:self._length]
+            self._data = data
+            if new_file is not None:
+                self._file = new_file
+        if new_file is not None:
+            log.info(f"💾 录音超过 {self.spill_bytes / 1024 / 1024:.0f}MB，转存到内存映射文件")
+
+    def view(self) -> np.ndarray:
+        """已录制数据的连续视图（零拷贝）"""
+        return self._data[:self._length]
+
+    def close(self):
+        """停止后台扩容并释放临时文件句柄；已取出的视图在被回收前仍然有效"""
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self._grow_event.set()
+
+
+class PrerollRing:
+    """固定容量的环形缓冲
+
+    常开输入流持续写入，只保留最近几秒音频；按下快捷键时取出其中最后一段作为预录音频。
+    """
+
+    def __init__(self, sample_rate: int, seconds: float, channels: int = 1, dtype=np.int16):
+        self.sample_rate = sample_rate
+        self.capacity = max(1, int(seconds * sample_rate))
+        self._data = np.zeros((self.capacity, channels), dtype=np.dtype(dtype))
+        self._pos = 0
+        self._filled = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def write(self, indata: np.ndarray):
+        """写入一个音频块，超出容量的旧数据被覆盖"""
+        frames = len(indata)
+        if frames >= self.capacity:
+            self._data[:] = indata[-self.capacity:]
+            self._pos = 0
+            self._filled = self.capacity
+            return
+        end = self._pos + frames
+        if end <= self.capacity:
+            self._data[self._pos:end] = indata
+        else:
+            first = self.capacity - self._pos
+            self._data[self._pos:] = indata[:first]
+            self._data[:frames - first] = indata[first:]
+        self._pos = end % self.capacity
+        self._filled = min(self.capacity, self._filled + frames)
+
+    def latest(self, frames: int) -> np.ndarray:
+        """最近 frames 帧音频；未跨越缓冲末尾时返回视图，否则拼接出副本"""
+        frames = min(frames, self._filled)
+        start = (self._pos - frames) % self.capacity
+        if start + frames <= self.capacity:
+            return self._data[start:start + frames]
+        return np.concatenate((self._data[start:], self._data[:self._pos]))
+
+
+# 上传格式：(文件名, MIME 类型, soundfile 格式, soundfile 子类型)
+UPLOAD_FORMATS = {
+    "wav": ("audio.wav", "audio/wav", None, None),
+    "flac": ("audio.flac", "audio/flac", "FLAC", "PCM_16"),
+    "opus": ("audio.ogg", "audio/ogg", "OGG", "OPUS"),
+}
+
+# 按典型压缩后体积从小到大排列：Opus(有损) < FLAC(无损) < WAV
+FORMAT_SIZE_ORDER = ("opus", "flac", "wav")
+
+# 尚未实测时的初始估计：每秒音频的编码耗时（秒），以及压缩后的体积
+# （FLAC 为相对 WAV 的比例；Opus 为每秒字节数，与采样率无关）
+INITIAL_ENCODE_COST = {"flac": 0.002, "opus": 0.05}
+INITIAL_FLAC_RATIO = 0.6
+INITIAL_OPUS_BYTES_PER_SECOND = 3300
+
+
+class EncodedAudio:
+    """编码后的待上传音频"""
+
+    def __init__(self, data: bytes, format: str, source: AudioData, encode_time: float = 0.0):
+        self.data = data
+        self.format = format
+        self.source = source
+        self.encode_time = encode_time
+
+    @property
+    def duration(self) -> float:
+        return self.source.duration
+
+    @property
+    def sample_rate(self) -> int:
+        return self.source.sample_rate
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    def to_upload(self):
+        """生成 multipart 上传所需的 (文件名, 内容, MIME 类型)"""
+        filename, mime_type, _, _ = UPLOAD_FORMATS[self.format]
+        return filename, self.data, mime_type
+
+
+class AudioEncoder:
+    """上传前的编码阶段：在提供商接受的格式中选择预计「编码耗时 + 上传耗时」最短的一种
+
+    编码耗时与压缩后体积按每秒音频实测（指数滑动平均），上传耗时按实测上传吞吐估算：
+    Opus 体积最小但编码慢，只有在网络足够慢、省下的上传时间超过多出的编码时间时才使用，其余情况使用 FLAC。
+    """
+
+    def __init__(self, formats: Iterable[str] = None, upload_throughput: Callable[[], float] = None,
+                 minimize: str = "latency"):
+        """初始化编码器
+
+        Args:
+            formats: 允许使用的格式，默认读取 UPLOAD_FORMATS（逗号分隔，如 "opus,flac,wav"）
+            upload_throughput: 返回当前上传吞吐估计（字节/秒）的函数，默认按 UPLOAD_THROUGHPUT_KBPS 固定估计
+            minimize: latency 为选择编码 + 上传总耗时最短的格式；size 为选择体积最小的格式（如本地存档）
+        """
+        if formats is None:
+            formats = os.getenv("UPLOAD_FORMATS", "opus,flac,wav").split(",")
+        self.formats = [fmt.strip().lower() for fmt in formats if fmt.strip().lower() in UPLOAD_FORMATS]
+        if "wav" not in self.formats:
+            self.formats.append("wav")
+        self._soundfile = None
+        self._soundfile_checked = False
+        self._soundfile_lock = threading.Lock()
+        if upload_throughput is None:
+            fixed = float(os.getenv("UPLOAD_THROUGHPUT_KBPS", "1000")) * 1024
+            upload_throughput = lambda: fixed
+        self.upload_throughput = upload_throughput
+        self.minimize = minimize
+        # 实测的每秒音频编码耗时与压缩后体积（相对 WAV 的比例）
+        self._encode_cost: Dict[str, float] = {}
+        self._size_ratio: Dict[str, float] = {}
+        self._estimate_lock = threading.Lock()
+
+    def _get_soundfile(self):
+        """按需加载 soundfile（可选依赖，提供 FLAC/Opus 编码）"""
+        if not self._soundfile_checked:
+            # 加锁：并发编码时其他线程不能在导入完成前读到 None 而退回 WAV
+            with self._soundfile_lock:
+                if not self._soundfile_checked:
+                    try:
+                        import soundfile
+                        self._soundfile = soundfile
+                    except (ImportError, OSError):
+                        log.warning("⚠️ 未安装 soundfile，上传使用未压缩 WAV")
+                    self._soundfile_checked = True
+        return self._soundfile
+
+    def _estimate(self, fmt: str, audio: AudioData) -> float:
+        """预计该压缩格式的编码 + 上传耗时（秒）；minimize 为 size 时返回预计体积"""
+        raw_bytes_per_second = audio.sample_rate * audio.channels * audio.dtype.itemsize
+        with self._estimate_lock:
+            cost = self._encode_cost.get(fmt, INITIAL_ENCODE_COST[fmt])
+            ratio = self._size_ratio.get(fmt)
+        if ratio is None:
+            ratio = INITIAL_FLAC_RATIO if fmt == "flac" else INITIAL_OPUS_BYTES_PER_SECOND / raw_bytes_per_second
+        size = ratio * raw_bytes_per_second * audio.duration
+        if self.minimize == "size":
+            return size
+        return cost * audio.duration + size / max(1.0, self.upload_throughput())
+
+    def _observe(self, encoded: EncodedAudio):
+        """更新编码耗时与压缩比的滑动平均（过短的音频计时不准，跳过）"""
+        source = encoded.source
+        if encoded.format == "wav" or source.duration < 0.5:
+            return
+        cost = encoded.encode_time / source.duration
+        ratio = encoded.nbytes / max(1, source.nbytes)
+        with self._estimate_lock:
+            previous_cost = self._encode_cost.get(encoded.format)
+            previous_ratio = self._size_ratio.get(encoded.format)
+            self._encode_cost[encoded.format] = cost if previous_cost is None else 0.8 * previous_cost + 0.2 * cost
+            self._size_ratio[encoded.format] = ratio if previous_ratio is None else 0.8 * previous_ratio + 0.2 * ratio
+
+    def select_formats(self, accepted_formats: Iterable[str], audio: AudioData = None) -> list:
+        """按预计耗时从短到长列出可用压缩格式（未给出音频时按体积从小到大），WAV 总在最后作为兜底"""
+        accepted = set(accepted_formats)
+        candidates = [fmt for fmt in FORMAT_SIZE_ORDER if fmt in accepted and fmt in self.formats and fmt != "wav"]
+        if audio is not None:
+            candidates.sort(key=lambda fmt: self._estimate(fmt, audio))
+        candidates.append("wav")
+        return candidates
+
+    def encode(self, audio: AudioData, accepted_formats: Iterable[str] = ("wav",)) -> EncodedAudio:
+        """编码音频，编码失败时依次回退到下一个格式，最终回退到 WAV"""
+        for fmt in self.select_formats(accepted_formats, audio):
+            encoded = self._encode_as(audio, fmt)
+            if encoded is not None:
+                self._observe(encoded)
+                self._log(encoded)
+                return encoded
+        # select_formats 总是包含 wav，这里不会到达
+        raise RuntimeError("音频编码失败")
+
+    def _encode_as(self, audio: AudioData, fmt: str) -> Optional[EncodedAudio]:
+        start_time = time.time()
+        if fmt == "wav":
+            return EncodedAudio(audio.to_wav_bytes(), "wav", audio, time.time() - start_time)
+
+        soundfile = self._get_soundfile()
+        if soundfile is None:
+            return None
+
+        _, _, sf_format, sf_subtype = UPLOAD_FORMATS[fmt]
+        try:
+            buffer = io.BytesIO()
+            soundfile.write(buffer, audio.samples, audio.sample_rate, format=sf_format, subtype=sf_subtype)
+        except Exception as e:
+            log.warning(f"⚠️ {fmt} 编码失败，尝试其他格式: {e}")
+            return None
+
+        data = buffer.getvalue()
+        encode_time = time.time() - start_time
+        # 极短的音频压缩后可能反而更大，此时直接用 WAV
+        if len(data) >= audio.nbytes + 44:
+            return None
+        return EncodedAudio(data, fmt, audio, encode_time)
+
+    @staticmethod
+    def _log(encoded: EncodedAudio):
+        raw_kb = (encoded.source.nbytes + 44) / 1024
+        encoded_kb = encoded.nbytes / 1024
+        ratio = encoded_kb / raw_kb if raw_kb else 1.0
+        log.info(f"🗜️ 上传编码 {encoded.format}: {raw_kb:.1f}KB → {encoded_kb:.1f}KB "
+                 f"({ratio:.0%}) | 编码 {encoded.encode_time * 1000:.1f}ms",
+                 format=encoded.format, bytes=len(encoded.data), duration=round(encoded.encode_time, 4))
@@ -0,0 +1,196 @@
+"""
+批量转录模块
+遍历目录或清单中的录音文件，并发转录并把结果流式写入 JSONL，支持断点续跑
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Set, Dict, Any, Optional
+
+from audio_processing import AudioData
+from tracing import get_tracer, activate, span
+from structured_logging import get_logger, flush_logs
+
+log = get_logger("batch")
+
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg")
+
+
+def collect_inputs(directory: str = None, manifest: str = None) -> List[str]:
+    """收集待转录文件
+
+    Args:
+        directory: 递归遍历的目录
+        manifest: 清单文件，每行一个路径，或 JSONL（每行含 "path" 字段）；相对路径按清单所在目录解析
+
+    Returns:
+        list: 排序后的文件路径
+    """
+    paths = []
+    if directory:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                path = json.loads(line)["path"] if line.startswith("{") else line
+                paths.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return sorted(dict.fromkeys(paths))
+
+
+def load_checkpoint(checkpoint_path: str) -> Set[str]:
+    """读取已完成的文件列表"""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+class BatchTranscriber:
+    """批量转录器
+
+    结果逐条追加到 JSONL，成功的文件同时追加到检查点文件；
+    中断后重新运行会跳过检查点中已完成的文件。
+    """
+
+    def __init__(self, manager, output_path: str, checkpoint_path: str = None, concurrency: int = None):
+        """初始化批量转录器
+
+        Args:
+            manager: TranscriptionManager 实例
+            output_path: 结果 JSONL 路径（追加写入）
+            checkpoint_path: 检查点路径，默认为 output_path + ".checkpoint"
+            concurrency: 并发请求数，默认读取 BATCH_CONCURRENCY
+        """
+        self.manager = manager
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        self.concurrency = concurrency or int(os.getenv("BATCH_CONCURRENCY", "4"))
+        self._write_lock = threading.Lock()
+
+    def _transcribe_file(self, path: str) -> Dict[str, Any]:
+        start_time = time.time()
+        record = {"path": path, "text": "", "duration": 0.0, "inference_time": 0.0, "error": None, "empty": False}
+        trace = get_tracer().start_trace(path=path)
+        try:
+            with activate(trace):
+                with span("load"):
+                    audio = AudioData.from_file(path)
+                record["duration"] = audio.duration
+                with span("transcribe"):
+                    text, inference_time = self.manager.transcribe_audio(audio)
+            record["text"] = text
+            record["inference_time"] = inference_time
+            if not text:
+                # 请求失败的文件不写检查点，下次重新转录；录音中确实没有内容的文件记为已完成
+                if self.manager.last_failed():
+                    record["error"] = "转录失败"
+                else:
+                    record["empty"] = True
+        except Exception as e:
+            record["error"] = str(e)
+        record["wall_time"] = time.time() - start_time
+        if trace is not None:
+            trace.attrs.update(duration=record["duration"], error=record["error"] is not None)
+            trace.finish()
+        return record
+
+    def _write(self, output, checkpoint, record: Dict[str, Any]):
+        with self._write_lock:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            if record["error"] is None:
+                checkpoint.write(record["path"] + "\n")
+                checkpoint.flush()
+
+    def run(self, paths: List[str]) -> Dict[str, Any]:
+        """执行批量转录并返回吞吐汇总"""
+        completed = load_checkpoint(self.checkpoint_path)
+        todo = [path for path in paths if path not in completed]
+        skipped = len(paths) - len(todo)
+        if skipped:
+            log.info(f"⏭️  检查点中已完成 {skipped} 个文件，跳过")
+        log.info(f"📦 待转录 {len(todo)} 个文件，并发 {self.concurrency}")
+
+        summary = {"files": 0, "failed": 0, "empty": 0, "skipped": skipped, "audio_seconds": 0.0,
+                   "interrupted": False}
+        start_time = time.time()
+        # 在途任务数限制为并发数的两倍，避免一次性把成千上万个文件读进内存
+        max_in_flight = self.concurrency * 2
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        pending = set()
+        try:
+            with open(self.output_path, "a", encoding="utf-8") as output, \
+                    open(self.checkpoint_path, "a", encoding="utf-8") as checkpoint:
+                iterator = iter(todo)
+                while True:
+                    for path in iterator:
+                        pending.add(executor.submit(self._transcribe_file, path))
+                        if len(pending) >= max_in_flight:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record = future.result()
+                        self._write(output, checkpoint, record)
+                        summary["files"] += 1
+                        summary["audio_seconds"] += record["duration"]
+                        if record["error"] is not None:
+                            summary["failed"] += 1
+                            log.error(f"❌ {record['path']}: {record['error']}", path=record["path"])
+                        else:
+                            summary["empty"] += int(record["empty"])
+                            note = "（无内容）" if record["empty"] else ""
+                            log.info(f"✅ [{summary['files']}/{len(todo)}] {record['path']}{note}", path=record["path"],
+                                     duration=record["duration"])
+        except KeyboardInterrupt:
+            summary["interrupted"] = True
+            log.warning("⏸️  已中断，重新运行相同命令即可从检查点继续")
+            for future in pending:
+                future.cancel()
+        finally:
+            executor.shutdown(wait=not summary["interrupted"])
+
+        wall_time = time.time() - start_time
+        summary["wall_time"] = wall_time
+        summary["files_per_second"] = summary["files"] / wall_time if wall_time > 0 else 0.0
+        summary["audio_seconds_per_second"] = summary["audio_seconds"] / wall_time if wall_time > 0 else 0.0
+        summary["rtf"] = wall_time / summary["audio_seconds"] if summary["audio_seconds"] > 0 else 0.0
+        return summary
+
+
+def print_summary(summary: Dict[str, Any]):
+    """打印吞吐汇总"""
+    print("=" * 50)
+    print(f"📊 完成 {summary['files']} 个文件（失败 {summary['failed']}，无内容 {summary['empty']}，"
+          f"跳过 {summary['skipped']}）")
+    print(f"⏱️  总耗时 {summary['wall_time']:.2f}s | 音频总时长 {summary['audio_seconds']:.2f}s")
+    print(f"🚀 {summary['files_per_second']:.2f} 文件/s | {summary['audio_seconds_per_second']:.2f} 音频秒/s | "
+          f"整体 RTF {summary['rtf']:.3f}x")
+
+
+def run_batch(manager, directory: str = None, manifest: str = None, output: str = "transcriptions.jsonl",
+              checkpoint: str = None, concurrency: int = None) -> Optional[Dict[str, Any]]:
+    """批量转录入口"""
+    paths = collect_inputs(directory, manifest)
+    if not paths:
+        print("❌ 没有找到可转录的音频文件")
+        return None
+    summary = BatchTranscriber(manager, output, checkpoint, concurrency).run(paths)
+    flush_logs()
+    print_summary(summary)
+    tracer = get_tracer()
+    tracer.print_summary()
+    tracer.close()
+    return summary
@@ -0,0 +1,696 @@
+"""
+性能基准模块
+启动本地模拟转录服务（兼容 SiliconFlow / Groq 的 /audio/transcriptions multipart 协议），
+把录音语料回放到 TranscriptionManager 或完整的 process_audio 流程，
+统计延迟分位数、并发吞吐、上传字节数与内存峰值，并保存结果用于对比和发现性能回退
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+import wave
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from audio_processing import AudioData
+from batch_transcribe import collect_inputs
+from tracing import Tracer, activate
+from structured_logging import flush_logs
+
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+# 对比时检查的指标：(指标路径, 数值越大越好)
+REGRESSION_METRICS = [
+    (("latency", "p50"), False),
+    (("latency", "p90"), False),
+    (("latency", "p99"), False),
+    (("throughput", "requests_per_second"), True),
+    (("bytes_uploaded",), False),
+    (("memory_peak_mb",), False),
+]
+
+
+class MockServerConfig:
+    """模拟服务的延迟与错误注入配置"""
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, distribution: str = "lognormal",
+                 per_second: float = 0.0, error_rate: float = 0.0, error_status: int = 500,
+                 seed: int = None):
+        """初始化配置
+
+        Args:
+            latency: 基础延迟（秒），即分布的均值
+            jitter: 延迟抖动（秒），uniform 为半宽，normal / lognormal 为标准差
+            distribution: 延迟分布，fixed / uniform / normal / lognormal
+            per_second: 每秒音频额外增加的处理时间（秒），模拟服务端按时长计费的推理耗时
+            error_rate: 注入错误的概率
+            error_status: 注入错误时返回的状态码，429 会附带 Retry-After
+            seed: 随机种子，便于复现
+        """
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布: {distribution}。支持: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.per_second = per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self, audio_seconds: float) -> float:
+        """按配置的分布抽取一次请求的服务端耗时"""
+        with self._lock:
+            if self.distribution == "fixed" or self.jitter <= 0:
+                base = self.latency
+            elif self.distribution == "uniform":
+                base = self._random.uniform(self.latency - self.jitter, self.latency + self.jitter)
+            elif self.distribution == "normal":
+                base = self._random.gauss(self.latency, self.jitter)
+            else:
+                # 由均值与标准差换算对数正态分布的参数，长尾更接近真实服务
+                sigma2 = np.log(1 + (self.jitter / self.latency) ** 2) if self.latency > 0 else 0.0
+                mu = np.log(self.latency) - sigma2 / 2 if self.latency > 0 else 0.0
+                base = self._random.lognormvariate(mu, float(np.sqrt(sigma2)))
+        return max(0.0, base) + self.per_second * audio_seconds
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"latency": self.latency, "jitter": self.jitter, "distribution": self.distribution,
+                "per_second": self.per_second, "error_rate": self.error_rate, "error_status": self.error_status}
+
+
+def _audio_seconds(data: bytes, filename: str) -> float:
+    """估算上传音频的时长：WAV 读文件头，其他格式无法廉价解析时返回 0"""
+    if not filename.endswith(".wav"):
+        return 0.0
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError):
+        return 0.0
+
+
+def _voiced_regions(data: bytes, min_silence: float = 0.6) -> List[Tuple[float, float]]:
+    """解码上传的音频，在不短于 min_silence 的静音处切分出有声区间（模拟的词只落在有声区间内）；
+    无法解码时返回空列表"""
+    try:
+        import soundfile
+        samples, sample_rate = soundfile.read(io.BytesIO(data), dtype="float32")
+    except Exception:
+        return []
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+    frame_len = max(1, sample_rate // 50)
+    n_frames = len(samples) // frame_len
+    if not n_frames:
+        return []
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    voiced = np.sqrt(np.mean(np.square(frames), axis=1)) > 0.003
+    regions, start, silent = [], None, 0
+    min_frames = int(min_silence * 50)
+    for index, is_voiced in enumerate(voiced):
+        if is_voiced:
+            if start is None:
+                start = index
+            silent = 0
+        elif start is not None:
+            silent += 1
+            if silent >= min_frames:
+                regions.append((start / 50, (index - silent + 1) / 50))
+                start, silent = None, 0
+    if start is not None:
+        regions.append((start / 50, (n_frames - silent) / 50))
+    return regions
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """模拟 /audio/transcriptions 接口"""
+
+    protocol_version = "HTTP/1.1"
+    server: "MockTranscriptionServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        # 传输层预热与保活使用 HEAD
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _reply(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length)
+        if not self.path.rstrip("/").endswith("/audio/transcriptions"):
+            self._reply(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        fields, file_data, filename = self._parse_multipart(body)
+        if file_data is None:
+            self._reply(400, {"error": {"message": "missing file field"}})
+            return
+
+        mock = self.server
+        audio_seconds = _audio_seconds(file_data, filename)
+        mock.record_request(len(body), len(file_data), filename)
+        time.sleep(mock.config.sample_latency(audio_seconds))
+
+        if mock.config.should_fail():
+            mock.record_error()
+            status = mock.config.error_status
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._reply(status, {"error": {"message": "injected error"}}, headers)
+            return
+
+        text = mock.transcript()
+        payload: Dict[str, Any] = {"text": text}
+        if fields.get("response_format") == "verbose_json":
+            regions = _voiced_regions(file_data)
+            if len(regions) > 1:
+                # 多段话（如合并上传的多段录音）：每段有声区间各说一句，词落在有声区间内
+                texts = [text] + [mock.transcript() for _ in regions[1:]]
+                words = [word for region, sentence in zip(regions, texts)
+                         for word in self._word_times(sentence, *region)]
+                text = " ".join(texts)
+            else:
+                words = self._word_times(text, 0.0, audio_seconds or float(len(text.split())))
+            payload = self._verbose(text, words, audio_seconds or (words[-1]["end"] if words else 0.0),
+                                    "word" in fields.get("timestamp_granularities[]", []))
+        self._reply(200, payload)
+
+    def _parse_multipart(self, body: bytes) -> Tuple[Dict[str, Any], Optional[bytes], str]:
+        content_type = self.headers.get("Content-Type", "")
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        fields, file_data, filename = {}, None, ""
+        if not message.is_multipart():
+            return fields, file_data, filename
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                file_data = part.get_payload(decode=True)
+                filename = part.get_filename() or ""
+            elif name and name.endswith("[]"):
+                # 数组字段（如 timestamp_granularities[]）重复出现，收集为列表
+                fields.setdefault(name, []).append(part.get_content().strip())
+            elif name:
+                fields[name] = part.get_content().strip()
+        return fields, file_data, filename
+
+    @staticmethod
+    def _word_times(text: str, start: float, end: float) -> List[Dict[str, Any]]:
+        """把一句话的时长均分给各个词"""
+        words = text.split()
+        step = (end - start) / max(1, len(words))
+        return [{"word": word, "start": round(start + index * step, 3), "end": round(start + (index + 1) * step, 3)}
+                for index, word in enumerate(words)]
+
+    @staticmethod
+    def _verbose(text: str, words: List[Dict[str, Any]], duration: float, with_words: bool) -> Dict[str, Any]:
+        """verbose_json：按词累积分段，满 5 秒或遇到超过 2 秒的停顿才断开。
+        与 Whisper 一样，分段不会在短暂停顿（如合并请求的静音间隔）处断开，因此可能跨越两段录音"""
+        segments, current = [], []
+        for index, word in enumerate(words):
+            current.append(word)
+            following = words[index + 1] if index + 1 < len(words) else None
+            if (following is None or word["end"] - current[0]["start"] >= 5.0
+                    or following["start"] - word["end"] > 2.0):
+                segments.append({"id": len(segments), "start": current[0]["start"], "end": word["end"],
+                                 "text": " ".join(item["word"] for item in current)})
+                current = []
+        payload = {"text": text, "duration": duration, "segments": segments}
+        if with_words:
+            payload["words"] = words
+        return payload
+
+
+class MockTranscriptionServer(ThreadingHTTPServer):
+    """本地模拟转录服务
+
+    SiliconFlow 与 Groq 都使用 OpenAI 风格的 multipart 上传，任何以 /audio/transcriptions 结尾的路径都会响应；
+    请求 response_format=verbose_json 时按 Groq 的格式返回分段时间戳。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: MockServerConfig = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _MockHandler)
+        self.config = config or MockServerConfig()
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, provider: str) -> str:
+        """各提供商在模拟服务上的接口地址"""
+        if provider == "groq":
+            return f"{self.base_url}/groq/openai/v1/audio/transcriptions"
+        return f"{self.base_url}/siliconflow/v1/audio/transcriptions"
+
+    def start(self) -> "MockTranscriptionServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def transcript(self) -> str:
+        with self._lock:
+            self._counter += 1
+            return f"mock transcription number {self._counter} for benchmark"
+
+    def record_request(self, request_bytes: int, file_bytes: int, filename: str):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["request_bytes"] += request_bytes
+            self._stats["file_bytes"] += file_bytes
+            fmt = os.path.splitext(filename)[1].lstrip(".") or "unknown"
+            self._stats["formats"][fmt] = self._stats["formats"].get(fmt, 0) + 1
+
+    def record_error(self):
+        with self._lock:
+            self._stats["errors"] += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"requests": 0, "errors": 0, "request_bytes": 0, "file_bytes": 0, "formats": {}}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["formats"] = dict(self._stats["formats"])
+        return stats
+
+
+def configure_environment(server: MockTranscriptionServer, providers: List[str]):
+    """把提供商指向模拟服务，并关闭会影响测量的功能
+
+    必须在导入 main（导入时即创建转录管理器）之前调用；已设置的环境变量优先于 .env，
+    因此基准测试不会请求真实的付费接口。
+    """
+    os.environ.update({
+        "TRANSCRIPTION_PROVIDER": providers[0],
+        "TRANSCRIPTION_PROVIDERS": ",".join(providers[1:]),
+        "HEDGE_PROVIDER": "",
+        "SILICONFLOW_API_URL": server.url_for("siliconflow"),
+        "SILICONFLOW_API_KEY": "mock",
+        "GROQ_API_URL": server.url_for("groq"),
+        "GROQ_API_KEY": "mock",
+        "TRANSCRIPTION_CACHE": "false",
+        "STREAMING_MODE": "false",
+        "OUTPUT_SINK": "memory",
+        "HISTORY_ENABLED": "false",
+        "TRACE_FILE": "",
+        "TRACE_PROMETHEUS_FILE": "",
+    })
+    # 模拟服务没有账户额度，默认不限速；需要测量限速下的表现时在环境变量中显式设置
+    for name in ("SILICONFLOW_RPM", "GROQ_RPM"):
+        os.environ.setdefault(name, "0")
+
+
+def synthetic_corpus(durations: List[float], sample_rate: int = 16000, seed: int = 0) -> List[AudioData]:
+    """生成合成语料：带停顿的调幅噪声，能通过 VAD 且可被正常编码"""
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for duration in durations:
+        frames = int(duration * sample_rate)
+        t = np.arange(frames) / sample_rate
+        # 约每 2 秒一次 0.3 秒的停顿
+        envelope = (np.sin(2 * np.pi * 3 * t) ** 2) * ((t % 2.0) > 0.3)
+        samples = rng.normal(0, 3000, frames) * envelope
+        corpus.append(AudioData(np.clip(samples, -32768, 32767).astype(np.int16), sample_rate))
+    return corpus
+
+
+def load_corpus(directory: str = None, manifest: str = None) -> List[AudioData]:
+    """从目录或清单加载语料"""
+    return [AudioData.from_file(path) for path in collect_inputs(directory, manifest)]
+
+
+class _MemorySampler:
+    """后台采样常驻内存，得到一次运行期间的峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = self.current()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="memory-sampler", daemon=True)
+
+    @staticmethod
+    def current() -> int:
+        """当前常驻内存（字节）：Linux 读 /proc，其他平台尝试 psutil，再退回进程历史峰值"""
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            pass
+        try:
+            import resource
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == "darwin" else maxrss * 1024
+        except ImportError:
+            return 0
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99),
+            "mean": float(np.mean(values)), "max": float(np.max(values))}
+
+
+class BenchmarkRunner:
+    """把语料回放到转录流程并汇总指标
+
+    mode 为 manager 时直接调用 TranscriptionManager.transcribe_audio；
+    为 pipeline 时调用 main.process_audio，包含 VAD、编码、后处理与（进程内）粘贴。
+    """
+
+    def __init__(self, server: MockTranscriptionServer, providers: List[str], mode: str = "manager"):
+        self.server = server
+        self.providers = providers
+        self.mode = mode
+        configure_environment(server, providers)
+        if mode == "pipeline":
+            import main
+            self._main = main
+            self.manager = main.get_transcription_manager()
+        else:
+            from speech_transcription import create_transcription_manager
+            self._main = None
+            self.manager = create_transcription_manager(providers[0], routing_providers=providers[1:])
+        self.manager.warm_up()
+
+    def _process(self, audio: AudioData, tracer: Tracer) -> bool:
+        if self._main is not None:
+            return bool(self._main.process_audio(audio, audio.duration).text)
+        trace = tracer.start_trace()
+        with activate(trace):
+            text, _ = self.manager.transcribe_audio(audio, bypass_cache=True)
+        trace.attrs["error"] = not text
+        trace.finish()
+        return bool(text)
+
+    def run(self, corpus: List[AudioData], users: int = 1, iterations: int = 1) -> Dict[str, Any]:
+        """N 个并发用户以闭环方式回放语料 iterations 遍"""
+        jobs = queue.Queue()
+        for _ in range(iterations):
+            for audio in corpus:
+                jobs.put(audio)
+        total_jobs = jobs.qsize()
+
+        tracer = Tracer(enabled=True, trace_file="", prometheus_file="")
+        if self._main is not None:
+            self._main.tracer = tracer
+        self.server.reset_stats()
+        latencies, errors, audio_seconds = [], 0, 0.0
+        lock = threading.Lock()
+
+        def user():
+            nonlocal errors, audio_seconds
+            while True:
+                try:
+                    audio = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                start_time = time.perf_counter()
+                try:
+                    ok = self._process(audio, tracer)
+                except Exception as e:
+                    print(f"❌ 基准请求异常: {e}")
+                    ok = False
+                elapsed = time.perf_counter() - start_time
+                with lock:
+                    latencies.append(elapsed)
+                    audio_seconds += audio.duration
+                    errors += int(not ok)
+
+        with _MemorySampler() as memory:
+            start_time = time.perf_counter()
+            threads = [threading.Thread(target=user, name=f"bench-user-{n}") for n in range(users)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall_time = time.perf_counter() - start_time
+
+        server_stats = self.server.get_stats()
+        raw_bytes = sum(audio.nbytes + 44 for audio in corpus) * iterations
+        return {
+            "requests": total_jobs,
+            "errors": errors,
+            "wall_time": wall_time,
+            "latency": _percentiles(latencies),
+            "throughput": {
+                "requests_per_second": total_jobs / wall_time if wall_time > 0 else 0.0,
+                "audio_seconds_per_second": audio_seconds / wall_time if wall_time > 0 else 0.0,
+            },
+            "server_requests": server_stats["requests"],
+            "server_errors": server_stats["errors"],
+            "upload_formats": server_stats["formats"],
+            "bytes_uploaded": server_stats["request_bytes"],
+            "raw_wav_bytes": raw_bytes,
+            "upload_ratio": server_stats["request_bytes"] / raw_bytes if raw_bytes else 0.0,
+            "memory_peak_mb": memory.peak / (1024 * 1024),
+            "spans": tracer.get_summary(),
+            "scheduler": self.manager.get_scheduler_stats(),
+            "coalescing": self.manager.get_coalescing_stats(),
+        }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        process = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                 timeout=5, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return process.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _comparison_key(record: Dict[str, Any]) -> str:
+    """只有配置相同的运行才能互相比较"""
+    return json.dumps([record["mode"], record["users"], record["iterations"], record["providers"],
+                       record["server"], record["corpus"]], sort_keys=True)
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_result(path: str, record: Dict[str, Any]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def find_baseline(history: List[Dict[str, Any]], record: Dict[str, Any],
+                  label: str = None) -> Optional[Dict[str, Any]]:
+    """找到配置相同的最近一次运行；指定 label 时只在该标签的运行中查找"""
+    key = _comparison_key(record)
+    for previous in reversed(history):
+        if _comparison_key(previous) == key and (label is None or previous.get("label") == label):
+            return previous
+    return None
+
+
+def _metric(record: Dict[str, Any], path: Tuple[str, ...]) -> float:
+    value = record["metrics"]
+    for name in path:
+        value = value[name]
+    return float(value)
+
+
+def compare(baseline: Dict[str, Any], record: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """逐项对比指标，变差超过 threshold（相对比例）的标记为回退"""
+    changes = []
+    for path, higher_is_better in REGRESSION_METRICS:
+        before, after = _metric(baseline, path), _metric(record, path)
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        changes.append({"metric": ".".join(path), "before": before, "after": after,
+                        "change": change, "regression": worse > threshold})
+    return changes
+
+
+def print_result(record: Dict[str, Any]):
+    metrics = record["metrics"]
+    latency = metrics["latency"]
+    print(f"👥 并发用户 {record['users']} | 请求 {metrics['requests']} | 失败 {metrics['errors']} | "
+          f"耗时 {metrics['wall_time']:.2f}s")
+    print(f"⏱️  延迟 p50 {latency['p50'] * 1000:.0f}ms | p90 {latency['p90'] * 1000:.0f}ms | "
+          f"p99 {latency['p99'] * 1000:.0f}ms | 最大 {latency['max'] * 1000:.0f}ms")
+    print(f"🚀 吞吐 {metrics['throughput']['requests_per_second']:.2f} 请求/s | "
+          f"{metrics['throughput']['audio_seconds_per_second']:.1f} 音频秒/s")
+    print(f"📤 上传 {metrics['bytes_uploaded'] / 1024:.1f}KB（WAV 的 {metrics['upload_ratio']:.0%}）| "
+          f"格式 {metrics['upload_formats']} | 内存峰值 {metrics['memory_peak_mb']:.1f}MB")
+    for name, stats in (metrics.get("scheduler") or {}).items():
+        print(f"🚦 {name}: 重试 {stats['retries']} 次 | 限流 {stats['throttled']} 次 | 放弃 {stats['gave_up']} 次 | "
+              f"平均排队 {stats['avg_queue_wait'] * 1000:.0f}ms | 最长排队 {stats['max_queue_wait'] * 1000:.0f}ms | "
+              f"并发上限 {stats['concurrency_limit']}")
+    coalescing = metrics.get("coalescing")
+    if coalescing and coalescing["clips"]:
+        print(f"📦 请求合并: {coalescing['clips']} 段录音 | 合并请求 {coalescing['batches']} 次 | "
+              f"节省请求 {coalescing['requests_saved']} 次 | 退回单独请求 {coalescing['fallbacks']} 次 | "
+              f"平均等待 {coalescing['avg_wait'] * 1000:.0f}ms")
+
+
+def print_comparison(baseline: Dict[str, Any], changes: List[Dict[str, Any]]):
+    print(f"📊 对比基线 {baseline.get('label') or ''} ({baseline.get('commit') or '?'}, "
+          f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(baseline['timestamp']))}):")
+    for change in changes:
+        mark = "🔺 回退" if change["regression"] else "  "
+        print(f"   {change['metric']:<36} {change['before']:>12.4f} → {change['after']:>12.4f} "
+              f"({change['change']:+.1%}) {mark}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="whisper-pasts 性能基准（本地模拟转录服务）")
+    parser.add_argument("--corpus", help="WAV/FLAC/OGG 语料目录，默认使用合成语料")
+    parser.add_argument("--manifest", help="语料清单文件")
+    parser.add_argument("--durations", default="2,5,10,30", help="合成语料各段时长（秒，逗号分隔）")
+    parser.add_argument("--mode", choices=("manager", "pipeline"), default="manager",
+                        help="manager: 直接调用转录管理器；pipeline: 完整的 process_audio 流程")
+    parser.add_argument("--providers", default="siliconflow", help="参与路由的提供商（逗号分隔，第一个为主提供商）")
+    parser.add_argument("--users", default="1,4", help="并发用户数（逗号分隔，逐个运行）")
+    parser.add_argument("--iterations", type=int, default=3, help="每次运行回放语料的遍数")
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟服务的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延迟抖动（秒）")
+    parser.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--per-second", type=float, default=0.0, help="每秒音频增加的服务端耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的状态码")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--results", default=os.getenv("BENCHMARK_RESULTS", "benchmarks/results.jsonl"),
+                        help="结果文件（JSONL，逐次追加）")
+    parser.add_argument("--label", help="本次运行的标签")
+    parser.add_argument("--baseline", help="与指定标签的运行对比，默认与配置相同的上一次运行对比")
+    parser.add_argument("--threshold", type=float,
+                        default=float(os.getenv("BENCHMARK_REGRESSION_THRESHOLD", "0.1")),
+                        help="指标变差超过该比例视为回退")
+    parser.add_argument("--no-save", action="store_true", help="不保存本次结果")
+    parser.add_argument("--fail-on-regression", action="store_true", help="发现回退时以非零状态退出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    providers = [name.strip().lower() for name in args.providers.split(",") if name.strip()]
+    config = MockServerConfig(latency=args.latency, jitter=args.jitter, distribution=args.distribution,
+                              per_second=args.per_second, error_rate=args.error_rate,
+                              error_status=args.error_status, seed=args.seed)
+    server = MockTranscriptionServer(config).start()
+    print(f"🧪 模拟转录服务: {server.base_url}")
+
+    if args.corpus or args.manifest:
+        corpus = load_corpus(args.corpus, args.manifest)
+        corpus_info = {"source": os.path.abspath(args.corpus or args.manifest)}
+    else:
+        durations = [float(value) for value in args.durations.split(",") if value.strip()]
+        corpus = synthetic_corpus(durations, seed=args.seed)
+        corpus_info = {"source": "synthetic", "durations": durations}
+    if not corpus:
+        print("❌ 语料为空")
+        return 1
+    corpus_info.update(files=len(corpus), audio_seconds=round(sum(audio.duration for audio in corpus), 3))
+    print(f"🎧 语料 {corpus_info['files']} 段，共 {corpus_info['audio_seconds']:.1f}s")
+
+    regressions = 0
+    try:
+        runner = BenchmarkRunner(server, providers, args.mode)
+        history = load_results(args.results)
+        for users in [int(value) for value in args.users.split(",") if value.strip()]:
+            print("=" * 50)
+            record = {
+                "label": args.label,
+                "timestamp": time.time(),
+                "commit": _git_commit(),
+                "mode": args.mode,
+                "users": users,
+                "iterations": args.iterations,
+                "providers": providers,
+                "server": config.to_dict(),
+                "corpus": corpus_info,
+            }
+            record["metrics"] = runner.run(corpus, users=users, iterations=args.iterations)
+            flush_logs()
+            print_result(record)
+
+            baseline = find_baseline(history, record, args.baseline)
+            if baseline is not None:
+                changes = compare(baseline, record, args.threshold)
+                print_comparison(baseline, changes)
+                regressions += sum(change["regression"] for change in changes)
+            if not args.no_save:
+                save_result(args.results, record)
+                history.append(record)
+    finally:
+        server.stop()
+
+    if args.results and not args.no_save:
+        print(f"💾 结果已追加到 {args.results}")
+    if regressions:
+        print(f"🔺 发现 {regressions} 项指标回退（阈值 {args.threshold:.0%}）")
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+长录音分块转录模块
+在静音处把长录音切分为带重叠的分块并发转录，再按分段时间戳去重拼接
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+from audio_processing import AudioData
+from streaming import join_texts
+from tracing import bind
+from deadline import DeadlineError, bind_deadline
+from structured_logging import get_logger
+
+log = get_logger("chunking")
+
+
+def merge_overlap(previous: str, current: str, min_overlap: int = 4, max_overlap: int = 64) -> str:
+    """去掉 current 开头与 previous 结尾重复的文本（没有时间戳时的兜底去重）"""
+    previous, current = previous.rstrip(), current.lstrip()
+    limit = min(len(previous), len(current), max_overlap)
+    for size in range(limit, min_overlap - 1, -1):
+        if previous.endswith(current[:size]):
+            return current[size:]
+    return current
+
+
+class ChunkedTranscriber:
+    """长录音分块并发转录
+
+    切分点取每个目标分块边界附近最安静的位置；若所有提供商都返回分段时间戳，
+    每个分块向前多取一段重叠音频，拼接时每个分段只保留中点落在本分块负责区间内的那一份。
+    """
+
+    def __init__(self, manager, threshold: float = None, chunk_seconds: float = None,
+                 overlap: float = None, search: float = None, max_workers: int = None):
+        """初始化分块转录器
+
+        Args:
+            manager: TranscriptionManager 实例
+            threshold: 超过该时长（秒）的录音才分块，默认读取 CHUNK_THRESHOLD
+            chunk_seconds: 目标分块时长（秒），默认读取 CHUNK_SECONDS
+            overlap: 相邻分块的重叠时长（秒），默认读取 CHUNK_OVERLAP
+            search: 在目标边界前后多大范围内寻找静音切分点（秒），默认读取 CHUNK_SEARCH
+            max_workers: 并发转录的分块数，默认读取 CHUNK_CONCURRENCY
+        """
+        self.manager = manager
+        self.threshold = threshold or float(os.getenv("CHUNK_THRESHOLD", "60"))
+        self.chunk_seconds = chunk_seconds or float(os.getenv("CHUNK_SECONDS", "30"))
+        self.overlap = overlap if overlap is not None else float(os.getenv("CHUNK_OVERLAP", "1.5"))
+        self.search = search if search is not None else float(os.getenv("CHUNK_SEARCH", "5"))
+        self.max_workers = max_workers or int(os.getenv("CHUNK_CONCURRENCY", "4"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chunk")
+
+    def should_chunk(self, audio) -> bool:
+        return audio.duration > self.threshold
+
+    def _uses_timestamps(self) -> bool:
+        """所有候选提供商都能返回分段时间戳时才使用重叠分块"""
+        return all(getattr(provider, "supports_segments", False) for provider in self.manager.providers)
+
+    def plan_cuts(self, audio: AudioData) -> List[int]:
+        """计算切分点（采样帧下标），包含首尾"""
+        sample_rate = audio.sample_rate
+        frame_len = max(1, sample_rate // 50)
+        mono = audio.samples.reshape(audio.num_frames, -1)[:, 0]
+        n_frames = len(mono) // frame_len
+        frames = mono[:n_frames * frame_len].reshape(n_frames, frame_len).astype(np.float32)
+        energy = np.sqrt(np.mean(np.square(frames), axis=1))
+        # 300ms 滑动平均，找的是一段停顿而不是一个偶然的安静帧
+        window = min(15, max(1, n_frames))
+        smoothed = np.convolve(energy, np.ones(window) / window, mode="same")
+
+        frames_per_second = sample_rate / frame_len
+        cuts = [0]
+        target = self.chunk_seconds
+        while audio.duration - cuts[-1] / sample_rate > self.chunk_seconds * 1.5:
+            low = int(max(cuts[-1] / frame_len + frames_per_second, (target - self.search) * frames_per_second))
+            high = int(min(n_frames, (target + self.search) * frames_per_second))
+            if high <= low:
+                break
+            quietest = low + int(np.argmin(smoothed[low:high]))
+            cuts.append(quietest * frame_len)
+            target = quietest / frames_per_second + self.chunk_seconds
+        cuts.append(audio.num_frames)
+        return cuts
+
+    def _transcribe_chunk(self, audio: AudioData, start: int, end: int) -> Tuple[str, List[Dict[str, Any]]]:
+        chunk = AudioData(audio.samples[start:end], audio.sample_rate)
+        text, _, segments = self.manager.transcribe_verbose(chunk)
+        if not text and self.manager.last_failed():
+            raise RuntimeError("分块请求失败")
+        return text, segments
+
+    def transcribe(self, audio: AudioData) -> Tuple[str, float]:
+        """分块并发转录并拼接
+
+        Returns:
+            tuple: (拼接后的文本, 总耗时)
+        """
+        start_time = time.time()
+        cuts = self.plan_cuts(audio)
+        overlap = int(self.overlap * audio.sample_rate) if self._uses_timestamps() else 0
+        chunks = [(max(0, cuts[i] - overlap), cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1)]
+        log.info(f"🧩 长录音 {audio.duration:.1f}s 切分为 {len(chunks)} 块并发转录")
+
+        transcribe_chunk = bind_deadline(bind(self._transcribe_chunk))
+        futures = [self._executor.submit(transcribe_chunk, audio, start, end) for start, _, end in chunks]
+        parts = []
+        merged = ""
+        failed = 0
+        for (start, owned_start, end), future in zip(chunks, futures):
+            try:
+                text, segments = future.result()
+            except DeadlineError:
+                # 录音已到期或被取消：尚未开始的分块不再发出
+                for other in futures:
+                    other.cancel()
+                raise
+            except Exception as e:
+                log.error(f"❌ 分块转录异常: {e}")
+                failed += 1
+                continue
+            offset = start / audio.sample_rate
+            owned_from = owned_start / audio.sample_rate
+            owned_to = end / audio.sample_rate
+            if segments:
+                # 重叠区的分段只保留中点落在本分块负责区间内的那一份
+                kept = [segment["text"] for segment in segments
+                        if owned_from <= offset + (segment["start"] + segment["end"]) / 2 < owned_to]
+                part = join_texts(kept)
+            elif overlap and merged:
+                part = merge_overlap(merged, text)
+            else:
+                part = text
+            parts.append(part)
+            merged = join_texts(parts)
+
+        if failed and not merged:
+            self.manager.mark_failed()
+        return merged, time.time() - start_time
@@ -0,0 +1,569 @@
+"""
+转录守护进程模块
+在本机常驻一个 TranscriptionManager，通过 Unix socket 或本地 HTTP 端口提供转录接口：
+快捷键客户端、批量任务等共享同一个已预热的连接池、转录缓存与限速状态；
+客户端在守护进程不可用时自动退回进程内转录
+"""
+
+import asyncio
+import http.client
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
+
+import numpy as np
+
+from audio_processing import AudioData, EncodedAudio
+from tracing import span
+from deadline import Deadline, DeadlineExceeded, Cancelled, current_deadline, deadline_scope
+from structured_logging import get_logger
+
+log = get_logger("daemon")
+
+# 请求头最大长度，超过时断开连接
+MAX_HEADER_BYTES = 64 * 1024
+
+
+def default_address() -> str:
+    """默认监听地址：支持 Unix socket 的平台使用用户缓存目录下的 socket 文件，否则使用本地端口"""
+    address = os.getenv("DAEMON_ADDRESS", "")
+    if address:
+        return address
+    if hasattr(socket, "AF_UNIX"):
+        return "unix:~/.cache/whisper-pasts/daemon.sock"
+    return "127.0.0.1:8765"
+
+
+def parse_address(address: str) -> Tuple[str, Union[str, Tuple[str, int]]]:
+    """解析地址：unix:/path 或 /path 为 Unix socket，host:port 为 TCP"""
+    if address.startswith("unix:"):
+        return "unix", os.path.expanduser(address[len("unix:"):])
+    if address.startswith(("/", "~")):
+        return "unix", os.path.expanduser(address)
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def _json_default(value):
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    return str(value)
+
+
+class TranscriptionDaemon:
+    """转录守护进程
+
+    asyncio 负责连接与 HTTP 解析（支持 keep-alive），转录调用放到线程池执行，
+    因此少量线程即可同时服务大量客户端连接；转录管理器本身是线程安全的。
+
+    接口：
+        GET  /health      守护进程与提供商信息
+        GET  /stats       缓存、对冲、路由与调度统计
+        POST /transcribe  请求体为原始 PCM，X-Sample-Rate / X-Channels / X-Dtype 描述格式；
+                          ?verbose=1 返回分段时间戳（不经过缓存），X-Bypass-Cache: 1 跳过缓存；
+                          X-Deadline 为客户端剩余的秒数，超时返回 504，客户端断开连接时取消转录
+    """
+
+    def __init__(self, manager, address: str = None, workers: int = None, max_body_mb: float = None):
+        """初始化守护进程
+
+        Args:
+            manager: 进程内的 TranscriptionManager
+            address: 监听地址，默认读取 DAEMON_ADDRESS
+            workers: 执行转录的线程数，默认读取 DAEMON_WORKERS
+            max_body_mb: 单个请求体的大小上限（MB），默认读取 DAEMON_MAX_BODY_MB
+        """
+        self.manager = manager
+        self.address = address or default_address()
+        self.kind, self.target = parse_address(self.address)
+        self.workers = workers or int(os.getenv("DAEMON_WORKERS", "16"))
+        self.max_body = int((max_body_mb or float(os.getenv("DAEMON_MAX_BODY_MB", "200"))) * 1024 * 1024)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="daemon")
+        self.started_at = None
+        self._writers = set()
+        self._stats = {"connections": 0, "requests": 0, "errors": 0, "in_flight": 0, "audio_seconds": 0.0}
+
+    # ---- HTTP ----
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._stats["connections"] += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request line"}, keep_alive=False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > self.max_body:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                status, payload = await self._dispatch(reader, method, target, headers, body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any], keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+        reason = http.client.responses.get(status, "")
+        head = (f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _dispatch(self, reader: asyncio.StreamReader, method: str, target: str, headers: Dict[str, str],
+                        body: bytes) -> Tuple[int, Dict[str, Any]]:
+        path, _, query = target.partition("?")
+        self._stats["requests"] += 1
+        try:
+            if method == "GET" and path == "/health":
+                return 200, self.health()
+            if method == "GET" and path == "/stats":
+                return 200, await asyncio.get_running_loop().run_in_executor(self._executor, self.stats)
+            if method == "POST" and path == "/transcribe":
+                return await self._transcribe(reader, headers, body, verbose="verbose=1" in query.split("&"))
+            return 404, {"error": f"unknown endpoint {method} {path}"}
+        except Exception as e:
+            self._stats["errors"] += 1
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def _transcribe(self, reader: asyncio.StreamReader, headers: Dict[str, str], body: bytes,
+                          verbose: bool) -> Tuple[int, Dict[str, Any]]:
+        try:
+            sample_rate = int(headers["x-sample-rate"])
+            channels = int(headers.get("x-channels", "1"))
+            dtype = np.dtype(headers.get("x-dtype", "<i2"))
+        except (KeyError, ValueError, TypeError) as e:
+            return 400, {"error": f"invalid audio headers: {e}"}
+        audio = AudioData(body, sample_rate, dtype=dtype, channels=channels)
+        bypass_cache = headers.get("x-bypass-cache") == "1"
+        try:
+            budget = float(headers["x-deadline"]) if "x-deadline" in headers else None
+        except ValueError:
+            budget = None
+        if budget is not None and budget <= 0:
+            return 504, {"error": "客户端的截止时间已过", "deadline": True}
+        deadline = Deadline(budget)
+
+        def run():
+            with deadline_scope(deadline):
+                if verbose:
+                    text, inference_time, segments = self.manager.transcribe_verbose(audio)
+                else:
+                    text, inference_time = self.manager.transcribe_audio(audio, bypass_cache=bypass_cache)
+                    segments = None
+            return {"text": text, "inference_time": inference_time, "segments": segments,
+                    "provider": self.manager.last_provider_info(), "failed": self.manager.last_failed()}
+
+        self._stats["in_flight"] += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, run)
+            # 客户端放弃（断开连接）时取消转录，释放线程与上游连接
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=0.1)
+                if done:
+                    break
+                if reader.at_eof():
+                    deadline.cancel("客户端已断开")
+            result = future.result()
+        except DeadlineExceeded as e:
+            return 504, {"error": str(e), "deadline": True}
+        except Cancelled as e:
+            return 499, {"error": str(e), "cancelled": True}
+        finally:
+            self._stats["in_flight"] -= 1
+        self._stats["audio_seconds"] += audio.duration
+        return 200, result
+
+    # ---- 状态 ----
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started_at if self.started_at else 0.0,
+            "provider": self.manager.get_provider_info(),
+            "in_flight": self._stats["in_flight"],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        cache = self.manager.cache.get_stats() if self.manager.cache is not None else None
+        return {
+            "daemon": dict(self._stats),
+            "cache": cache,
+            "hedge": self.manager.get_hedge_stats(),
+            "routing": self.manager.get_routing_info(),
+            "scheduler": self.manager.get_scheduler_stats(),
+            "coalescing": self.manager.get_coalescing_stats(),
+        }
+
+    # ---- 生命周期 ----
+
+    def _claim_socket(self):
+        """清理上次异常退出留下的 socket 文件；已有守护进程在监听时报错"""
+        path = self.target
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"已有守护进程在监听 {path}")
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        if self.kind == "unix":
+            self._claim_socket()
+            server = await asyncio.start_unix_server(self._handle_connection, path=self.target,
+                                                     limit=MAX_HEADER_BYTES)
+            # 只允许当前用户访问
+            os.chmod(self.target, 0o600)
+        else:
+            host, port = self.target
+            server = await asyncio.start_server(self._handle_connection, host=host, port=port,
+                                                limit=MAX_HEADER_BYTES)
+        self.started_at = time.time()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        log.info(f"🛰️ 转录守护进程已启动: {self.address}（{self.workers} 个转录线程）")
+        async with server:
+            await stop.wait()
+            # 关闭空闲的 keep-alive 连接，让连接处理协程正常结束
+            server.close()
+            for writer in list(self._writers):
+                writer.close()
+            # 正在转录的请求最多再等 10 秒
+            deadline = loop.time() + 10
+            while self._writers and loop.time() < deadline:
+                await asyncio.sleep(0.01)
+        if self.kind == "unix" and os.path.exists(self.target):
+            os.unlink(self.target)
+
+    def serve_forever(self):
+        """运行守护进程直到收到 SIGINT / SIGTERM"""
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._executor.shutdown(wait=False)
+            stats = self._stats
+            log.info(f"🛰️ 守护进程退出: 连接 {stats['connections']} 个 | 请求 {stats['requests']} 次 | "
+                     f"失败 {stats['errors']} 次 | 音频 {stats['audio_seconds']:.0f}s")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过 Unix socket 连接的 HTTPConnection"""
+
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DaemonUnavailable(ConnectionError):
+    """守护进程未运行或连接中断"""
+
+
+class DaemonClient:
+    """转录守护进程的客户端，提供与 TranscriptionManager 相同的转录接口
+
+    每个线程复用一条 keep-alive 连接；守护进程不可用时交给 fallback_factory 创建的进程内管理器，
+    之后每隔 DAEMON_RETRY_INTERVAL 秒再尝试连接守护进程。
+    """
+
+    def __init__(self, address: str = None, fallback_factory: Callable[[], Any] = None, timeout: float = None,
+                 retry_interval: float = None):
+        """初始化客户端
+
+        Args:
+            address: 守护进程地址，默认读取 DAEMON_ADDRESS
+            fallback_factory: 创建进程内转录管理器的函数，为 None 时守护进程不可用直接报错
+            timeout: 单次请求的超时（秒），默认读取 DAEMON_TIMEOUT
+            retry_interval: 退回进程内转录后重新尝试守护进程的间隔（秒），默认读取 DAEMON_RETRY_INTERVAL
+        """
+        self.address = address or default_address()
+        self.kind, self.target = parse_address(self.address)
+        self.timeout = timeout or float(os.getenv("DAEMON_TIMEOUT", "120"))
+        self.retry_interval = retry_interval or float(os.getenv("DAEMON_RETRY_INTERVAL", "30"))
+        self._fallback_factory = fallback_factory
+        self._fallback = None
+        self._fallback_lock = threading.Lock()
+        self._unavailable_since = None
+        self._local = threading.local()
+        self._info = None
+
+    # ---- 连接 ----
+
+    def _new_connection(self, timeout: float) -> http.client.HTTPConnection:
+        if self.kind == "unix":
+            return _UnixHTTPConnection(self.target, timeout=timeout)
+        host, port = self.target
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    @staticmethod
+    def _set_timeout(conn: http.client.HTTPConnection, timeout: float):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    @staticmethod
+    def _abort(conn: http.client.HTTPConnection):
+        """录音被取消时关闭连接的 socket 读写，等待响应的线程立即返回"""
+        if conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _request(self, method: str, path: str, body: bytes = None, headers: Dict[str, str] = None,
+                 timeout: float = None) -> Dict[str, Any]:
+        """发送请求；复用的连接已被对端关闭时换新连接重试一次，连接失败时抛出 DaemonUnavailable
+
+        当前线程有截止时间时，超时收紧到剩余时间内，取消时中断等待；
+        守护进程一侧超时或被取消时抛出 DeadlineExceeded / Cancelled（不退回进程内转录）。
+        """
+        deadline = current_deadline()
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None or timeout is not None:
+                conn = self._new_connection(timeout or self.timeout)
+                if timeout is None:
+                    self._local.conn = conn
+            remove_hook = None
+            if deadline is not None:
+                self._set_timeout(conn, deadline.timeout(timeout or self.timeout))
+                remove_hook = deadline.on_cancel(lambda: self._abort(conn))
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                payload = json.loads(response.read() or b"{}")
+            except (ConnectionError, FileNotFoundError, http.client.RemoteDisconnected,
+                    http.client.BadStatusLine, socket.timeout, OSError) as e:
+                conn.close()
+                self._local.conn = None
+                if deadline is not None:
+                    deadline.check()
+                if attempt == 0 and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError,
+                                                   ConnectionResetError)):
+                    continue
+                raise DaemonUnavailable(f"无法连接转录守护进程 {self.address}: {e}")
+            finally:
+                if remove_hook is not None:
+                    remove_hook()
+            if timeout is not None:
+                conn.close()
+            elif deadline is not None:
+                self._set_timeout(conn, self.timeout)
+            if response.status == 504 and payload.get("deadline"):
+                raise DeadlineExceeded(payload.get("error") or "守护进程转录超时")
+            if response.status == 499 and payload.get("cancelled"):
+                raise Cancelled(payload.get("error") or "录音已取消")
+            if response.status != 200:
+                raise RuntimeError(payload.get("error") or f"守护进程返回 {response.status}")
+            return payload
+        raise DaemonUnavailable(f"无法连接转录守护进程 {self.address}")
+
+    def probe(self, timeout: float = 0.5) -> Optional[Dict[str, Any]]:
+        """检查守护进程是否在运行，返回 /health 信息；不可用时返回 None"""
+        if self.kind == "unix" and not os.path.exists(self.target):
+            return None
+        try:
+            self._info = self._request("GET", "/health", timeout=timeout)
+        except (DaemonUnavailable, RuntimeError, ValueError):
+            return None
+        return self._info
+
+    @property
+    def using_daemon(self) -> bool:
+        return self._unavailable_since is None
+
+    def _get_fallback(self):
+        with self._fallback_lock:
+            if self._fallback is None:
+                self._fallback = self._fallback_factory()
+            return self._fallback
+
+    def _use_daemon(self) -> bool:
+        """守护进程此前不可用时，每隔 retry_interval 重新探测一次"""
+        if self._unavailable_since is None:
+            return True
+        if self._fallback_factory is not None and time.time() - self._unavailable_since < self.retry_interval:
+            return False
+        if self.probe() is not None:
+            log.info("🛰️ 已重新连接转录守护进程")
+            self._unavailable_since = None
+            return True
+        self._unavailable_since = time.time()
+        return False
+
+    def _mark_unavailable(self, error: Exception):
+        if self._fallback_factory is None:
+            raise error
+        if self._unavailable_since is None:
+            log.warning(f"⚠️ {error}，改为进程内转录")
+        self._unavailable_since = time.time()
+
+    # ---- 转录接口 ----
+
+    def _post_audio(self, audio: Union[AudioData, EncodedAudio], verbose: bool,
+                    bypass_cache: bool) -> Dict[str, Any]:
+        source = audio.source if isinstance(audio, EncodedAudio) else audio
+        samples = np.ascontiguousarray(source.samples)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Sample-Rate": str(source.sample_rate),
+            "X-Channels": str(source.channels),
+            "X-Dtype": samples.dtype.str,
+        }
+        if bypass_cache:
+            headers["X-Bypass-Cache"] = "1"
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() is not None:
+            headers["X-Deadline"] = f"{max(0.0, deadline.remaining()):.3f}"
+        with span("daemon"):
+            result = self._request("POST", "/transcribe?verbose=1" if verbose else "/transcribe",
+                                   body=memoryview(samples).cast("B"), headers=headers)
+        self._local.provider = result.get("provider")
+        self._local.failed = bool(result.get("failed"))
+        return result
+
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], bypass_cache: bool = False) -> tuple[str, float]:
+        """通过守护进程转录，不可用时退回进程内转录"""
+        self._local.provider = None
+        self._local.failed = None
+        if self._use_daemon():
+            try:
+                result = self._post_audio(audio, verbose=False, bypass_cache=bypass_cache)
+                return result["text"], result["inference_time"]
+            except DaemonUnavailable as e:
+                self._mark_unavailable(e)
+            except RuntimeError as e:
+                log.error(f"❌ 守护进程转录失败: {e}")
+                self._local.failed = True
+                return "", 0.0
+        return self._get_fallback().transcribe_audio(audio, bypass_cache=bypass_cache)
+
+    def transcribe_verbose(self, audio: Union[AudioData, EncodedAudio]) -> tuple[str, float, List[Dict[str, Any]]]:
+        self._local.failed = None
+        if self._use_daemon():
+            try:
+                result = self._post_audio(audio, verbose=True, bypass_cache=True)
+                return result["text"], result["inference_time"], result["segments"] or []
+            except DaemonUnavailable as e:
+                self._mark_unavailable(e)
+            except RuntimeError as e:
+                log.error(f"❌ 守护进程转录失败: {e}")
+                self._local.failed = True
+                return "", 0.0, []
+        return self._get_fallback().transcribe_verbose(audio)
+
+    def transcribe(self, audio_path: str, bypass_cache: bool = False) -> tuple[str, float]:
+        return self.transcribe_audio(AudioData.from_file(audio_path), bypass_cache=bypass_cache)
+
+    def encode(self, audio: AudioData):
+        """守护进程在本机，直接发送 PCM，由守护进程编码；已退回进程内转录时在本地编码"""
+        if self._fallback is not None and not self.using_daemon:
+            return self._fallback.encode(audio)
+        return audio
+
+    def needs_chunking(self, audio) -> bool:
+        """长录音由守护进程分块"""
+        if self._fallback is not None and not self.using_daemon:
+            return self._fallback.needs_chunking(audio)
+        return False
+
+    def last_failed(self) -> bool:
+        failed = getattr(self._local, "failed", None)
+        if failed is not None:
+            return failed
+        return self._fallback.last_failed() if self._fallback is not None else False
+
+    def last_provider_info(self) -> Optional[Dict[str, Any]]:
+        provider = getattr(self._local, "provider", None)
+        if provider is not None:
+            return provider
+        if self._fallback is not None:
+            return self._fallback.last_provider_info()
+        return self.get_provider_info()
+
+    def get_provider_info(self) -> Dict[str, Any]:
+        if self._info is None:
+            self.probe()
+        if self._info is not None:
+            return self._info["provider"]
+        return self._get_fallback().get_provider_info() if self._fallback_factory else {"name": "daemon"}
+
+    def warm_up(self):
+        """守护进程的连接已预热，这里只建立到守护进程的连接"""
+        if self.probe() is None:
+            self._mark_unavailable(DaemonUnavailable(f"转录守护进程 {self.address} 未运行"))
+            self._get_fallback().warm_up()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """守护进程的缓存、对冲、路由与调度统计"""
+        return self._request("GET", "/stats")
+
+    # 以下统计只反映本进程：使用守护进程时为空，退回进程内转录后为进程内管理器的统计
+
+    @property
+    def providers(self) -> list:
+        return self._fallback.providers if self._fallback is not None else []
+
+    def get_scheduler_stats(self) -> Dict[str, Dict[str, Any]]:
+        return self._fallback.get_scheduler_stats() if self._fallback is not None else {}
+
+    def get_coalescing_stats(self) -> Optional[Dict[str, Any]]:
+        return self._fallback.get_coalescing_stats() if self._fallback is not None else None
+
+    def get_routing_info(self) -> Dict[str, Any]:
+        return self._fallback.get_routing_info() if self._fallback is not None else {"enabled": False}
+
+
+def connect(fallback_factory: Callable[[], Any] = None, address: str = None) -> Optional[DaemonClient]:
+    """守护进程在运行时返回客户端，否则返回 None"""
+    client = DaemonClient(address=address, fallback_factory=fallback_factory)
+    if client.probe() is None:
+        return None
+    return client
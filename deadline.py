@@ -0,0 +1,220 @@
+"""
+截止时间模块
+每次录音从松开按键起有一个端到端的截止时间，沿调用链（线程局部 + 线程池绑定）传到各个请求，
+换算为连接 / 读取超时；截止时间到达或录音被取消（重新录音、按下中止键）时，
+正在进行的请求通过注册的回调立即中断，释放占用的线程与连接
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+_local = threading.local()
+
+
+class DeadlineError(Exception):
+    """录音的处理因截止时间或取消而中止"""
+
+
+class DeadlineExceeded(DeadlineError, TimeoutError):
+    """超过端到端截止时间"""
+
+
+class Cancelled(DeadlineError):
+    """录音已被取消"""
+
+
+class _Watchdog:
+    """到期时触发截止时间的后台线程：所有截止时间共用一个线程，按到期时间排成小顶堆"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, "Deadline"]] = []
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, deadline: "Deadline"):
+        with self._cond:
+            heapq.heappush(self._heap, (deadline.expires_at, next(self._ids), deadline))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deadline-watchdog", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                expires_at, _, deadline = self._heap[0]
+                delay = expires_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            deadline._expire()
+
+
+_watchdog = _Watchdog()
+
+
+class Deadline:
+    """一次录音的截止时间与取消状态
+
+    到期或取消时依次调用 on_cancel 注册的回调（如关闭正在读写的 socket），
+    阻塞中的调用因此立即返回，再由调用方通过 check() 转换为 DeadlineExceeded / Cancelled。
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        """创建截止时间
+
+        Args:
+            budget: 从现在起的可用时长（秒），None 或不大于 0 表示不限时（仍可取消）
+        """
+        self.created_at = time.monotonic()
+        self.budget = budget if budget and budget > 0 else None
+        self.expires_at = self.created_at + self.budget if self.budget is not None else None
+        self.reason: Optional[str] = None
+        self._error: Optional[DeadlineError] = None
+        self._callbacks = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        # child() 派生的截止时间与父截止时间的关联
+        self._unlink: Optional[Callable[[], None]] = None
+        if self.expires_at is not None:
+            _watchdog.schedule(self)
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数（可能为负）；不限时返回 None"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    @property
+    def done(self) -> bool:
+        """已到期或已取消"""
+        return self._event.is_set() or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    @property
+    def cancelled(self) -> bool:
+        return isinstance(self._error, Cancelled)
+
+    def _finish(self, error: DeadlineError) -> bool:
+        with self._lock:
+            if self._error is not None:
+                return False
+            self._error = error
+            self.reason = str(error)
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        self._event.set()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+        return True
+
+    def cancel(self, reason: str = "录音已取消") -> bool:
+        """取消录音的处理；已到期或已取消时返回 False"""
+        return self._finish(Cancelled(reason))
+
+    def _expire(self):
+        self._finish(DeadlineExceeded(f"超过截止时间 {self.budget:.1f}s"))
+
+    def link(self, parent: "Deadline") -> Callable[[], None]:
+        """父截止时间到期或取消时本截止时间随之结束，返回注销函数"""
+        return parent.on_cancel(lambda: self._finish(parent._error))
+
+    def child(self) -> "Deadline":
+        """派生子截止时间：剩余时间相同，随本截止时间到期 / 取消而结束，也可以单独取消（如对冲中落后的请求）"""
+        remaining = self.remaining()
+        child = Deadline(max(remaining, 0.001) if remaining is not None else None)
+        child._unlink = child.link(self)
+        return child
+
+    def release(self):
+        """子截止时间用完后与父截止时间解除关联"""
+        if self._unlink is not None:
+            self._unlink()
+            self._unlink = None
+
+    def check(self):
+        """已取消时抛出 Cancelled，已到期时抛出 DeadlineExceeded"""
+        if self._error is None and self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self._expire()
+        if self._error is not None:
+            raise self._error
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册到期 / 取消时的回调，返回注销函数；已到期或已取消时立即调用"""
+        with self._lock:
+            if self._error is None:
+                key = next(self._ids)
+                self._callbacks[key] = callback
+                return lambda: self._callbacks.pop(key, None)
+        callback()
+        return lambda: None
+
+    def timeout(self, limit: Optional[float]) -> Optional[float]:
+        """把单次操作的超时上限收紧到剩余时间内；已到期或已取消时抛出异常"""
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        return remaining if limit is None else min(limit, remaining)
+
+    def wait(self, seconds: float) -> bool:
+        """等待指定秒数（不超过剩余时间），期间被取消或到期时提前返回 True"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, max(0.0, remaining))
+        return self._event.wait(seconds) or self.done
+
+
+def utterance_deadline(audio_seconds: float = 0.0) -> Deadline:
+    """按录音时长创建端到端截止时间：UTTERANCE_DEADLINE + 每秒音频 UTTERANCE_DEADLINE_PER_SECOND"""
+    base = float(os.getenv("UTTERANCE_DEADLINE", "30"))
+    if base <= 0:
+        return Deadline(None)
+    return Deadline(base + float(os.getenv("UTTERANCE_DEADLINE_PER_SECOND", "0.5")) * audio_seconds)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """当前线程正在处理的录音的截止时间"""
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """在当前线程内把 deadline 设为当前截止时间，退出时恢复"""
+    previous = getattr(_local, "deadline", None)
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def bind_deadline(fn):
+    """让提交到线程池的函数继续受当前截止时间约束"""
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        with deadline_scope(deadline):
+            return fn(*args, **kwargs)
+    return bound
+
+
+def check_deadline():
+    """当前截止时间已到期或已取消时抛出异常"""
+    deadline = getattr(_local, "deadline", None)
+    if deadline is not None:
+        deadline.check()
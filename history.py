@@ -0,0 +1,386 @@
+"""
+转录历史模块
+每条转录结果（文本、耗时、提供商与模型，可选压缩音频）写入本地 SQLite，并建立 FTS5 全文索引；
+写入在后台线程按批提交，不占用粘贴路径；提供搜索、重新粘贴与按保留期限压缩
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from audio_processing import AudioData, AudioEncoder, EncodedAudio
+from structured_logging import get_logger
+
+log = get_logger("history")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    text TEXT NOT NULL,
+    duration REAL,
+    record_time REAL,
+    inference_time REAL,
+    total_time REAL,
+    provider TEXT,
+    model TEXT,
+    audio BLOB,
+    audio_format TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_created ON entries(created);
+"""
+
+# trigram 分词对中文无需分词器，子串查询可直接走索引（至少 3 个字符）
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(text, content='entries', content_rowid='id',
+                                                          tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# 查询结果不包含音频数据
+COLUMNS = ", ".join(f"e.{column}" for column in ("id", "created", "text", "duration", "record_time", "inference_time",
+                                                   "total_time", "provider", "model", "audio_format"))
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    return {key: row[key] for key in row.keys()}
+
+
+class HistoryStore:
+    """转录历史存储
+
+    写入只是一次队列追加；后台线程每攒够 HISTORY_BATCH_SIZE 条或每隔 HISTORY_FLUSH_INTERVAL 秒在一个事务中提交。
+    数据库使用 WAL 模式，查询与写入互不阻塞。
+    """
+
+    def __init__(self, path: str = None, store_audio: bool = None, retention_days: float = None,
+                 max_entries: int = None, batch_size: int = None, flush_interval: float = None):
+        """初始化历史存储
+
+        Args:
+            path: 数据库路径，默认读取 HISTORY_DB
+            store_audio: 是否同时保存压缩音频，默认读取 HISTORY_AUDIO
+            retention_days: 保留天数，0 表示永久保留，默认读取 HISTORY_RETENTION_DAYS
+            max_entries: 最多保留的条目数，0 表示不限，默认读取 HISTORY_MAX_ENTRIES
+            batch_size: 每批提交的最大条目数，默认读取 HISTORY_BATCH_SIZE
+            flush_interval: 两次提交的最长间隔（秒），默认读取 HISTORY_FLUSH_INTERVAL
+        """
+        path = path or os.getenv("HISTORY_DB", "~/.local/share/whisper-pasts/history.db")
+        self.path = os.path.expanduser(path)
+        if store_audio is None:
+            store_audio = os.getenv("HISTORY_AUDIO", "false").lower() in ("1", "true", "yes")
+        self.store_audio = store_audio
+        self.retention_days = retention_days if retention_days is not None else float(
+            os.getenv("HISTORY_RETENTION_DAYS", "0"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("HISTORY_MAX_ENTRIES", "0"))
+        self.batch_size = batch_size or int(os.getenv("HISTORY_BATCH_SIZE", "32"))
+        self.flush_interval = flush_interval or float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self.fts = self._init_schema()
+        self._encoder = None
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._stats = {"recorded": 0, "written": 0, "batches": 0, "write_time": 0.0, "dropped": 0}
+        self._stats_lock = threading.Lock()
+        self._writer = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # 必须在切换 WAL（会写入数据库头）和建表之前设置，删除数据后才能用 incremental_vacuum 归还空间
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程使用自己的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _init_schema(self) -> bool:
+        """建表；SQLite 不支持 FTS5 或 trigram 分词时退回 LIKE 查询"""
+        conn = self._connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # 旧版本创建的数据库没有启用增量回收：auto_vacuum 已在连接时设置，整理一次后生效（只发生一次）
+            log.info("🧹 转录历史数据库启用增量空间回收（一次性整理）...")
+            conn.execute("VACUUM")
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            return True
+        except sqlite3.OperationalError as e:
+            log.warning(f"⚠️ SQLite 不支持 FTS5 trigram（{e}），历史搜索改用全表扫描")
+            return False
+
+    def start(self):
+        """启动后台写入线程（幂等）"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+            self._writer.start()
+
+    def record(self, text: str, duration: float = None, record_time: float = None, inference_time: float = None,
+               total_time: float = None, provider: str = None, model: str = None, audio=None,
+               created: float = None):
+        """记录一条转录结果（只入队，不等待写入）
+
+        Args:
+            audio: 录音（AudioData 或已编码的 EncodedAudio），仅在 store_audio 开启时保存
+        """
+        if not text:
+            return
+        self.start()
+        self._queue.put({
+            "created": created or time.time(), "text": text, "duration": duration, "record_time": record_time,
+            "inference_time": inference_time, "total_time": total_time, "provider": provider, "model": model,
+            "audio": audio if self.store_audio else None,
+        })
+        with self._stats_lock:
+            self._stats["recorded"] += 1
+
+    def _compress(self, audio) -> tuple:
+        """在写入线程中压缩音频；已编码为 opus/flac 的上传音频直接复用"""
+        if audio is None:
+            return None, None
+        if isinstance(audio, EncodedAudio):
+            if audio.format != "wav":
+                return audio.data, audio.format
+            audio = audio.source
+        if not isinstance(audio, AudioData):
+            return None, None
+        if self._encoder is None:
+            self._encoder = AudioEncoder(["opus", "flac", "wav"], minimize="size")
+        encoded = self._encoder.encode(audio, ("opus", "flac", "wav"))
+        return encoded.data, encoded.format
+
+    def _write_loop(self):
+        conn = self._connection()
+        if self.retention_days or self.max_entries:
+            self.compact()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.time() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(conn, batch)
+            if stop:
+                return
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[dict]):
+        start_time = time.perf_counter()
+        rows = []
+        for item in batch:
+            try:
+                audio, audio_format = self._compress(item["audio"])
+            except Exception as e:
+                log.warning(f"⚠️ 历史录音压缩失败，只保存文本: {e}")
+                audio, audio_format = None, None
+            rows.append((item["created"], item["text"], item["duration"], item["record_time"],
+                         item["inference_time"], item["total_time"], item["provider"], item["model"],
+                         audio, audio_format))
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO entries (created, text, duration, record_time, inference_time, total_time, "
+                    "provider, model, audio, audio_format) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            log.warning(f"⚠️ 写入转录历史失败: {e}")
+            with self._stats_lock:
+                self._stats["dropped"] += len(rows)
+            return
+        with self._stats_lock:
+            self._stats["written"] += len(rows)
+            self._stats["batches"] += 1
+            self._stats["write_time"] += time.perf_counter() - start_time
+
+    def flush(self, timeout: float = 5.0):
+        """等待队列中的条目全部写入"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._stats_lock:
+                done = self._stats["written"] + self._stats["dropped"] >= self._stats["recorded"]
+            if done:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def close(self):
+        """写完剩余条目后停止写入线程"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join(timeout=10)
+            self._writer = None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def search(self, query: str, limit: int = 20, since: float = None) -> List[Dict[str, Any]]:
+        """全文搜索，按时间倒序返回；少于 3 个字符的查询无法走 trigram 索引，改用 LIKE"""
+        conn = self._connection()
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("e.created >= ?")
+            params.append(since)
+        if self.fts and len(query) >= 3:
+            phrase = '"' + query.replace('"', '""') + '"'
+            sql = f"SELECT {COLUMNS} FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid WHERE entries_fts MATCH ?"
+            params.insert(0, phrase)
+            order = "entries_fts.rowid"
+        else:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            sql = f"SELECT {COLUMNS} FROM entries e WHERE e.text LIKE ? ESCAPE '\\'"
+            params.insert(0, f"%{escaped}%")
+            order = "e.id"
+        for condition in conditions:
+            sql += f" AND {condition}"
+        sql += f" ORDER BY {order} DESC LIMIT ?"
+        params.append(limit)
+        return [_row_to_dict(row) for row in conn.execute(sql, params)]
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的条目"""
+        rows = self._connection().execute(f"SELECT {COLUMNS} FROM entries e ORDER BY e.id DESC LIMIT ?", (limit,))
+        return [_row_to_dict(row) for row in rows]
+
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(f"SELECT {COLUMNS} FROM entries e WHERE e.id = ?", (entry_id,)).fetchone()
+        return _row_to_dict(row) if row is not None else None
+
+    def get_audio(self, entry_id: int) -> Optional[tuple]:
+        """条目保存的压缩音频 (数据, 格式)，未保存时返回 None"""
+        row = self._connection().execute("SELECT audio, audio_format FROM entries WHERE id = ?",
+                                         (entry_id,)).fetchone()
+        if row is None or row["audio"] is None:
+            return None
+        return bytes(row["audio"]), row["audio_format"]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def compact(self, retention_days: float = None, max_entries: int = None) -> int:
+        """删除超出保留期限或条目上限的旧记录，整理全文索引并归还磁盘空间，返回删除的条目数"""
+        retention_days = self.retention_days if retention_days is None else retention_days
+        max_entries = self.max_entries if max_entries is None else max_entries
+        conn = self._connection()
+        deleted = 0
+        with conn:
+            if retention_days:
+                deleted += conn.execute("DELETE FROM entries WHERE created < ?",
+                                        (time.time() - retention_days * 86400,)).rowcount
+            if max_entries:
+                deleted += conn.execute(
+                    "DELETE FROM entries WHERE id <= (SELECT id FROM entries ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (max_entries,)).rowcount
+            if self.fts:
+                conn.execute("INSERT INTO entries_fts(entries_fts) VALUES ('optimize')")
+        if deleted:
+            # incremental_vacuum 每执行一步只回收一页，execute 只会执行第一步；executescript 一直执行到结束
+            conn.executescript("PRAGMA incremental_vacuum;")
+            log.info(f"🧹 转录历史已清理 {deleted} 条旧记录")
+        return deleted
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        stats["avg_batch"] = stats["written"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_history_store() -> Optional[HistoryStore]:
+    """获取进程内共享的历史存储；HISTORY_ENABLED 关闭时返回 None"""
+    global _default_store
+    if os.getenv("HISTORY_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = HistoryStore()
+        return _default_store
+
+
+def _format_entry(entry: Dict[str, Any]) -> str:
+    created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"]))
+    source = "/".join(part for part in (entry["provider"], entry["model"]) if part)
+    audio = " 🔊" if entry.get("audio_format") else ""
+    return f"[{entry['id']}] {created} ({source or '?'}){audio}\n    {entry['text']}"
+
+
+def run_history_command(args, output_sink_factory=None) -> int:
+    """whisper-pasts history 子命令"""
+    store = HistoryStore()
+    try:
+        if args.action in ("search", "list"):
+            start_time = time.perf_counter()
+            if args.action == "search":
+                entries = store.search(args.query, limit=args.limit)
+            else:
+                entries = store.recent(limit=args.limit)
+            elapsed = time.perf_counter() - start_time
+            for entry in reversed(entries):
+                print(_format_entry(entry))
+            print(f"🔎 {len(entries)} 条结果，共 {store.count()} 条历史（查询 {elapsed * 1000:.1f}ms）")
+            return 0
+
+        if args.action in ("copy", "paste"):
+            entry = store.get(args.id)
+            if entry is None:
+                print(f"❌ 没有编号为 {args.id} 的历史记录")
+                return 1
+            sink = output_sink_factory()
+            sink.warm_up()
+            if args.action == "paste" and args.delay:
+                # 留出时间切换到目标窗口
+                print(f"⏳ {args.delay:.1f}s 后粘贴到光标位置...")
+                time.sleep(args.delay)
+            result = sink.output(entry["text"], paste=args.action == "paste")
+            print("✅ 已粘贴" if result["pasted"] else "📋 已复制到剪贴板" if result["copied"] else "❌ 输出失败")
+            return 0 if result["copied"] else 1
+
+        if args.action == "audio":
+            audio = store.get_audio(args.id)
+            if audio is None:
+                print(f"❌ 编号为 {args.id} 的历史记录没有保存录音")
+                return 1
+            data, audio_format = audio
+            path = args.output or f"history-{args.id}.{'ogg' if audio_format == 'opus' else audio_format}"
+            with open(path, "wb") as f:
+                f.write(data)
+            print(f"💾 已导出录音: {path}")
+            return 0
+
+        if args.action == "compact":
+            deleted = store.compact(retention_days=args.days, max_entries=args.max_entries)
+            print(f"🧹 删除 {deleted} 条，剩余 {store.count()} 条")
+            return 0
+    finally:
+        store.close()
+    return 1
@@ -0,0 +1,398 @@
+"""
+HTTP 传输模块
+所有转录提供商共享的连接池传输层：keep-alive 长连接、可选 HTTP/2 多路复用、启动预热；
+每个请求都有连接 / 读取超时，并受当前录音的截止时间约束，录音被取消时中断正在进行的请求
+"""
+
+import os
+import socket
+import threading
+import time
+from typing import Optional, Dict, Any, Iterable, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from tracing import span, record_span
+from deadline import current_deadline
+from structured_logging import get_logger
+
+log = get_logger("http")
+
+# 当前线程正在进行的请求注册的取消回调，请求结束时注销
+_request_local = threading.local()
+
+# 小于该大小的请求体主要受往返时间影响，不参与上传吞吐估计
+THROUGHPUT_MIN_BYTES = 16 * 1024
+
+
+class _UploadMeter:
+    """上传吞吐估计（字节/秒，指数滑动平均），供编码阶段权衡编码耗时与上传耗时
+
+    尚未有实测时使用 UPLOAD_THROUGHPUT_KBPS 的估计值。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._throughput: Optional[float] = None
+        self.default = float(os.getenv("UPLOAD_THROUGHPUT_KBPS", "1000")) * 1024
+
+    def record(self, nbytes: int, seconds: float):
+        if nbytes < THROUGHPUT_MIN_BYTES or seconds <= 0:
+            return
+        sample = nbytes / seconds
+        with self._lock:
+            self._throughput = sample if self._throughput is None else 0.7 * self._throughput + 0.3 * sample
+
+    def get(self) -> float:
+        with self._lock:
+            return self._throughput if self._throughput is not None else self.default
+
+
+_upload_meter = _UploadMeter()
+
+
+def upload_throughput() -> float:
+    """当前的上传吞吐估计（字节/秒）"""
+    return _upload_meter.get()
+
+
+def _body_size(body) -> int:
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return len(body)
+    return 0
+
+
+def _abort_socket(connection):
+    """关闭连接的 socket 读写，阻塞在 send / recv 上的线程立即返回错误，连接不再放回连接池"""
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _traced_connection(base):
+    """为 urllib3 连接类加上 connect / upload / server 三个 span，并在录音取消时中断请求"""
+
+    class TracedConnection(base):
+        def connect(self):
+            with span("connect"):
+                return super().connect()
+
+        def request(self, *args, **kwargs):
+            deadline = current_deadline()
+            hooks = getattr(_request_local, "hooks", None)
+            if deadline is not None and hooks is not None:
+                hooks.append(deadline.on_cancel(lambda: _abort_socket(self)))
+            body = kwargs.get("body", args[2] if len(args) > 2 else None)
+            start_time = time.time()
+            with span("upload"):
+                result = super().request(*args, **kwargs)
+            _upload_meter.record(_body_size(body), time.time() - start_time)
+            return result
+
+        def getresponse(self, *args, **kwargs):
+            # 请求体发送完毕到收到响应头：服务端处理时间 + 一个往返
+            with span("server"):
+                return super().getresponse(*args, **kwargs)
+
+    TracedConnection.__name__ = f"Traced{base.__name__}"
+    return TracedConnection
+
+
+class _TracedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _traced_connection(HTTPConnectionPool.ConnectionCls)
+
+
+class _TracedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _traced_connection(HTTPSConnectionPool.ConnectionCls)
+
+
+class _HttpxTraceRecorder:
+    """把 httpx trace 扩展的事件时间点转换为 connect / upload / server span，并记录上传吞吐"""
+
+    def __init__(self):
+        self._marks: Dict[str, float] = {}
+        self._body_bytes = 0
+
+    def __call__(self, event_name: str, info: Dict[str, Any]):
+        self._marks[event_name] = time.time()
+        if event_name.endswith("send_request_headers.started") and "request" in info:
+            # httpcore 的请求头是 (name, value) 字节串列表
+            for name, value in getattr(info["request"], "headers", ()):
+                if name.lower() == b"content-length" and value.isdigit():
+                    self._body_bytes = int(value)
+        if event_name.endswith("receive_response_headers.complete"):
+            self._flush()
+
+    def _flush(self):
+        marks = self._marks
+        connect_start = marks.get("connection.connect_tcp.started")
+        connect_end = marks.get("connection.start_tls.complete") or marks.get("connection.connect_tcp.complete")
+        if connect_start and connect_end:
+            record_span("connect", connect_start, connect_end - connect_start)
+        for protocol in ("http11", "http2"):
+            upload_start = marks.get(f"{protocol}.send_request_headers.started")
+            upload_end = marks.get(f"{protocol}.send_request_body.complete")
+            headers_end = marks.get(f"{protocol}.receive_response_headers.complete")
+            if upload_start and upload_end and headers_end:
+                record_span("upload", upload_start, upload_end - upload_start)
+                _upload_meter.record(self._body_bytes, upload_end - upload_start)
+                record_span("server", upload_end, headers_end - upload_end)
+
+
+class TransportResponse:
+    """统一的响应对象，屏蔽 requests / httpx 的差异"""
+
+    def __init__(self, status_code: int, content: bytes, headers: Dict[str, str],
+                 url: str, elapsed: float, reused: Optional[bool]):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.url = url
+        self.elapsed = elapsed
+        # 是否复用了已有连接；无法判断时为 None
+        self.reused = reused
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        import json
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """与 requests 行为一致：4xx/5xx 抛出 HTTPError"""
+        if 400 <= self.status_code < 600:
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} Error for url: {self.url}", response=self
+            )
+
+
+class HTTPTransport:
+    """共享 HTTP 传输层
+
+    - 基于连接池的长连接，避免每次转录重新进行 DNS + TCP + TLS 握手
+    - 安装了 httpx[http2] 时可开启 HTTP/2 多路复用
+    - 支持启动预热和空闲保活
+    """
+
+    def __init__(self, pool_size: int = None, http2: bool = None, keepalive_interval: float = None,
+                 connect_timeout: float = None, read_timeout: float = None):
+        """初始化传输层
+
+        Args:
+            pool_size: 每个主机的连接池大小，默认读取 HTTP_POOL_SIZE
+            http2: 是否启用 HTTP/2，默认读取 HTTP2_ENABLED
+            keepalive_interval: 空闲保活间隔（秒），0 表示关闭，默认读取 HTTP_KEEPALIVE_INTERVAL
+            connect_timeout: 建立连接的超时（秒），默认读取 HTTP_CONNECT_TIMEOUT
+            read_timeout: 等待响应数据的超时（秒），默认读取 HTTP_READ_TIMEOUT
+        """
+        self.pool_size = pool_size or int(os.getenv("HTTP_POOL_SIZE", "4"))
+        self.connect_timeout = connect_timeout or float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout or float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+        if http2 is None:
+            http2 = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+        if keepalive_interval is None:
+            keepalive_interval = float(os.getenv("HTTP_KEEPALIVE_INTERVAL", "30"))
+        self.keepalive_interval = keepalive_interval
+
+        self._client = None
+        self._session = None
+        self.http2 = False
+        if http2:
+            try:
+                import httpx
+                limits = httpx.Limits(max_connections=self.pool_size,
+                                      max_keepalive_connections=self.pool_size)
+                self._client = httpx.Client(http2=True, limits=limits)
+                self.http2 = True
+            except ImportError:
+                log.warning("⚠️ 未安装 httpx[http2]，回退到 HTTP/1.1 连接池")
+
+        if self._client is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            adapter.poolmanager.pool_classes_by_scheme = {
+                "http": _TracedHTTPConnectionPool,
+                "https": _TracedHTTPSConnectionPool,
+            }
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+
+        self._origins = set()
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+        self._stop_event = threading.Event()
+        self._stats = {"requests": 0, "reused": 0, "new_connections": 0, "unknown": 0}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}/"
+
+    def _connection_count(self, url: str) -> Optional[int]:
+        """读取目标主机连接池已建立的连接数，用于判断请求是否复用了连接"""
+        try:
+            if self._session is not None:
+                host = urlsplit(url).hostname
+                pools = self._session.get_adapter(url).poolmanager.pools
+                return sum(pools[key].num_connections for key in pools.keys()
+                           if pools[key].host == host)
+            # httpx 的连接池属于内部实现，取不到时返回 None
+            return len(self._client._transport._pool.connections)
+        except Exception:
+            return None
+
+    def _timeouts(self, timeout) -> Tuple[float, float]:
+        """(连接超时, 读取超时)：未指定时使用默认值，并收紧到当前录音的剩余时间内"""
+        if timeout is None:
+            connect, read = self.connect_timeout, self.read_timeout
+        elif isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        deadline = current_deadline()
+        if deadline is not None:
+            connect, read = deadline.timeout(connect), deadline.timeout(read)
+        return connect, read
+
+    def post(self, url: str, headers: Dict[str, str] = None, files: Dict[str, Any] = None,
+             data: Dict[str, Any] = None, timeout=None) -> TransportResponse:
+        """发送 POST 请求
+
+        网络层错误统一抛出 requests.exceptions.RequestException 子类，便于提供商统一处理；
+        当前录音到期或被取消时抛出 DeadlineExceeded / Cancelled。
+        """
+        connect_timeout, read_timeout = self._timeouts(timeout)
+        deadline = current_deadline()
+        before = self._connection_count(url)
+        start_time = time.time()
+
+        _request_local.hooks = hooks = []
+        try:
+            if self._session is not None:
+                response = self._session.post(url, headers=headers, files=files, data=data,
+                                              timeout=(connect_timeout, read_timeout), stream=True)
+                with span("download"):
+                    content = response.content
+                status_code, resp_headers = response.status_code, dict(response.headers)
+            else:
+                import httpx
+                extensions = {"trace": _HttpxTraceRecorder()}
+                try:
+                    with self._client.stream("POST", url, headers=headers, files=files, data=data,
+                                             timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                                             extensions=extensions) as response:
+                        if deadline is not None:
+                            hooks.append(deadline.on_cancel(response.close))
+                        with span("download"):
+                            content = response.read()
+                except httpx.TimeoutException as e:
+                    raise requests.exceptions.Timeout(str(e))
+                except httpx.HTTPError as e:
+                    raise requests.exceptions.ConnectionError(str(e))
+                status_code, resp_headers = response.status_code, dict(response.headers)
+        except (requests.exceptions.RequestException, OSError):
+            # 被取消回调中断的请求报告为取消 / 超时，而不是网络错误
+            if deadline is not None:
+                deadline.check()
+            raise
+        finally:
+            _request_local.hooks = None
+            for remove in hooks:
+                remove()
+
+        elapsed = time.time() - start_time
+        after = self._connection_count(url)
+        reused = None if before is None or after is None else after == before
+        self._record(url, reused)
+
+        return TransportResponse(status_code, content, resp_headers, url, elapsed, reused)
+
+    def _record(self, url: str, reused: Optional[bool]):
+        origin = self._origin(url)
+        with self._lock:
+            self._origins.add(origin)
+            self._last_used[origin] = time.time()
+            self._stats["requests"] += 1
+            if reused is None:
+                self._stats["unknown"] += 1
+            elif reused:
+                self._stats["reused"] += 1
+            else:
+                self._stats["new_connections"] += 1
+
+    def _ping(self, origin: str):
+        """对主机发送一个轻量 HEAD 请求，用于建立或保持连接"""
+        try:
+            if self._session is not None:
+                self._session.head(origin, timeout=5)
+            else:
+                self._client.head(origin, timeout=5)
+        except Exception:
+            pass
+
+    def warm_up(self, urls: Iterable[str]):
+        """预热连接：提前完成 DNS + TCP + TLS 握手，并登记为保活目标"""
+        origins = {self._origin(url) for url in urls if url}
+        with self._lock:
+            self._origins.update(origins)
+        for origin in origins:
+            self._ping(origin)
+            with self._lock:
+                self._last_used[origin] = time.time()
+        self.start_keepalive()
+
+    def start_keepalive(self):
+        """启动后台保活线程（幂等）"""
+        if self.keepalive_interval <= 0 or self._keepalive_thread is not None:
+            return
+        self._keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+        self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop_event.wait(self.keepalive_interval):
+            now = time.time()
+            with self._lock:
+                idle = [origin for origin in self._origins
+                        if now - self._last_used.get(origin, 0) >= self.keepalive_interval]
+            for origin in idle:
+                self._ping(origin)
+                with self._lock:
+                    self._last_used[origin] = time.time()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接复用统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["http2"] = self.http2
+        stats["pool_size"] = self.pool_size
+        return stats
+
+    def close(self):
+        """关闭传输层，停止保活并释放连接"""
+        self._stop_event.set()
+        if self._session is not None:
+            self._session.close()
+        if self._client is not None:
+            self._client.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> HTTPTransport:
+    """获取进程内共享的默认传输层"""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HTTPTransport()
+        return _default_transport
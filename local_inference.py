@@ -0,0 +1,352 @@
+"""
+本地推理模块
+在常驻的子进程中加载 Whisper / SenseVoice 类模型并在 CPU 上推理：
+模型只加载一次并保持预热，主进程把内存中的 PCM 直接通过管道发给子进程，不经过编码与网络
+"""
+
+import atexit
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from deadline import DeadlineError, current_deadline
+from structured_logging import get_logger
+
+log = get_logger("local_inference")
+
+# 模型输入的采样率
+MODEL_SAMPLE_RATE = 16000
+# 支持的推理后端：(说明, 需要安装的包)
+BACKENDS = {
+    "faster_whisper": ("Whisper（CTranslate2，支持 int8 量化）", "faster-whisper"),
+    "sensevoice": ("SenseVoice（ONNX Runtime，支持 int8 量化）", "funasr-onnx"),
+}
+
+
+class LocalInferenceError(RuntimeError):
+    """本地推理子进程返回的错误"""
+
+
+def _to_model_input(pcm: bytes, dtype: str, sample_rate: int, channels: int) -> np.ndarray:
+    """PCM 缓冲转为模型输入：单声道、16kHz、[-1, 1] 的 float32"""
+    samples = np.frombuffer(pcm, dtype=np.dtype(dtype))
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if samples.dtype.kind in ("i", "u"):
+        samples = samples.astype(np.float32) / float(np.iinfo(np.dtype(dtype)).max)
+    else:
+        samples = samples.astype(np.float32, copy=False)
+    if sample_rate != MODEL_SAMPLE_RATE:
+        from math import gcd
+        from scipy.signal import resample_poly
+        divisor = gcd(sample_rate, MODEL_SAMPLE_RATE)
+        samples = resample_poly(samples, MODEL_SAMPLE_RATE // divisor, sample_rate // divisor).astype(np.float32)
+    return samples
+
+
+def _load_backend(config: Dict[str, Any]):
+    """在子进程中加载模型，返回 transcribe(samples) -> (文本, 分段)"""
+    backend = config["backend"]
+    threads = config["threads"]
+    quantized = config["compute_type"].startswith("int8")
+
+    if backend == "faster_whisper":
+        from faster_whisper import WhisperModel
+        model = WhisperModel(config["model"], device="cpu", compute_type=config["compute_type"],
+                             cpu_threads=threads, download_root=config["model_dir"] or None)
+
+        def transcribe(samples: np.ndarray) -> Tuple[str, List[Dict[str, Any]]]:
+            segments, _ = model.transcribe(samples, language=config["language"] or None,
+                                           beam_size=config["beam_size"], condition_on_previous_text=False)
+            segments = [{"start": float(segment.start), "end": float(segment.end), "text": segment.text}
+                        for segment in segments]
+            return "".join(segment["text"] for segment in segments).strip(), segments
+        return transcribe
+
+    if backend == "sensevoice":
+        from funasr_onnx import SenseVoiceSmall
+        from funasr_onnx.utils.postprocess_utils import rich_transcription_postprocess
+        model = SenseVoiceSmall(config["model_dir"] or config["model"], batch_size=1, quantize=quantized,
+                                intra_op_num_threads=threads)
+
+        def transcribe(samples: np.ndarray) -> Tuple[str, List[Dict[str, Any]]]:
+            results = model(samples, language=config["language"] or "auto", textnorm="withitn")
+            text = rich_transcription_postprocess(results[0]) if results else ""
+            return text.strip(), []
+        return transcribe
+
+    raise ValueError(f"不支持的本地推理后端: {backend}（可选: {', '.join(BACKENDS)}）")
+
+
+def _worker_main(conn, config: Dict[str, Any]):
+    """子进程入口：加载并预热模型，然后逐个处理请求
+
+    请求为 (请求 ID, dtype, 采样率, 声道数)，随后一帧原始 PCM 字节；
+    响应为 (请求 ID, 是否成功, 文本或错误信息, 分段, 推理耗时)。主进程发送 None 时退出。
+    """
+    # 推理库在导入时读取线程数，必须在导入之前设置
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(config["threads"])
+    start_time = time.time()
+    try:
+        transcribe = _load_backend(config)
+        # 用一小段静音跑一次推理，分配好缓冲区，首个真实请求不再承担这部分开销
+        transcribe(np.zeros(MODEL_SAMPLE_RATE // 2, dtype=np.float32))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", time.time() - start_time))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        if request is None:
+            return
+        request_id, dtype, sample_rate, channels = request
+        pcm = conn.recv_bytes()
+        start_time = time.time()
+        try:
+            text, segments = transcribe(_to_model_input(pcm, dtype, sample_rate, channels))
+            conn.send((request_id, True, text, segments, time.time() - start_time))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}", [], time.time() - start_time))
+
+
+class LocalInferenceWorker:
+    """常驻推理子进程
+
+    子进程启动时加载模型并保持预热；请求按顺序在同一个模型上执行（模型内部已按 LOCAL_THREADS 并行），
+    子进程崩溃或超时时结束它，下一个请求重新拉起。
+    """
+
+    def __init__(self, backend: str = None, model: str = None, compute_type: str = None, threads: int = None,
+                 language: str = None, model_dir: str = None, beam_size: int = None, timeout: float = None):
+        """初始化推理子进程配置（不会立即启动）
+
+        Args:
+            backend: 推理后端 faster_whisper / sensevoice，默认读取 LOCAL_BACKEND
+            model: 模型名称或路径，默认读取 LOCAL_MODEL
+            compute_type: 计算精度，int8 为量化模型，默认读取 LOCAL_COMPUTE_TYPE
+            threads: 推理线程数，默认读取 LOCAL_THREADS（未设置时最多 4 个）
+            language: 识别语言，为空时自动检测，默认读取 LOCAL_LANGUAGE
+            model_dir: 模型下载/存放目录，默认读取 LOCAL_MODEL_DIR
+            beam_size: 解码束宽，1 为贪心解码，默认读取 LOCAL_BEAM_SIZE
+            timeout: 单次推理的超时（秒），默认读取 LOCAL_TIMEOUT
+        """
+        self.config = {
+            "backend": (backend or os.getenv("LOCAL_BACKEND", "faster_whisper")).lower(),
+            "model": model or os.getenv("LOCAL_MODEL", "small"),
+            "compute_type": compute_type or os.getenv("LOCAL_COMPUTE_TYPE", "int8"),
+            "threads": threads or int(os.getenv("LOCAL_THREADS", "0")) or min(4, os.cpu_count() or 1),
+            "language": language if language is not None else os.getenv("LOCAL_LANGUAGE", ""),
+            "model_dir": os.path.expanduser(model_dir or os.getenv("LOCAL_MODEL_DIR", "")),
+            "beam_size": beam_size or int(os.getenv("LOCAL_BEAM_SIZE", "1")),
+        }
+        self.timeout = timeout or float(os.getenv("LOCAL_TIMEOUT", "60"))
+        self.load_time = None
+        self._process = None
+        self._conn = None
+        self._ids = itertools.count(1)
+        # 调用方已放弃（录音到期或被取消）但子进程仍在推理的请求，其响应到达后丢弃
+        self._abandoned = set()
+        self._lock = threading.Lock()
+        # 模型加载中时为加载结束时置位的事件；加载失败的原因留给等待的请求
+        self._loading: Optional[threading.Event] = None
+        self._load_error: Optional[str] = None
+        self._stats = {"requests": 0, "failures": 0, "restarts": 0, "abandoned": 0, "inference_time": 0.0,
+                       "audio_seconds": 0.0}
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def _start(self) -> threading.Event:
+        """启动子进程，由后台线程等待模型加载完成，返回加载结束时置位的事件（调用方持有锁）
+
+        首次运行可能需要下载模型，加载期间不持有锁，等待的请求各自按截止时间放弃。
+        """
+        if self._loading is not None:
+            return self._loading
+        if self.config["backend"] not in BACKENDS:
+            raise ValueError(f"不支持的本地推理后端: {self.config['backend']}（可选: {', '.join(BACKENDS)}）")
+        # spawn：子进程不继承主进程的线程与音频设备句柄
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn, self.config),
+                                  name="local-inference", daemon=True)
+        process.start()
+        child_conn.close()
+
+        description, _ = BACKENDS[self.config["backend"]]
+        log.info(f"🧠 加载本地模型: {description} {self.config['model']} "
+                 f"({self.config['compute_type']}, {self.config['threads']} 线程)...")
+        self._loading = threading.Event()
+        self._load_error = None
+        threading.Thread(target=self._await_ready, args=(process, parent_conn, self._loading),
+                         name="local-inference-load", daemon=True).start()
+        return self._loading
+
+    def _await_ready(self, process, conn, loaded: threading.Event):
+        """后台等待子进程报告模型加载结果（不受推理超时限制）"""
+        try:
+            status, detail = conn.recv()
+        except (EOFError, OSError):
+            status, detail = "exit", None
+        if status != "ready":
+            process.join()
+            if detail is None:
+                error = f"本地推理进程启动失败（退出码 {process.exitcode}）"
+            else:
+                if "ModuleNotFoundError" in detail or "ImportError" in detail:
+                    detail += f"（请安装 {BACKENDS[self.config['backend']][1]}）"
+                error = f"本地模型加载失败: {detail}"
+            conn.close()
+        with self._lock:
+            if status == "ready":
+                self._process, self._conn = process, conn
+                self.load_time = detail
+            else:
+                self._load_error = error
+            self._loading = None
+        if status == "ready":
+            log.info(f"✅ 本地模型已就绪，加载耗时 {detail:.1f}s")
+        loaded.set()
+
+    def _wait_ready(self, deadline=None):
+        """确保子进程已就绪：需要时（重新）启动，并在不持有锁的情况下等待加载完成
+
+        录音到期或被取消时抛出 DeadlineExceeded / Cancelled，加载继续在后台进行，供后面的请求使用。
+        """
+        with self._lock:
+            if self.alive:
+                return
+            if self._loading is None and self._process is not None:
+                self._stats["restarts"] += 1
+                self._stop()
+            loaded = self._start()
+        while not loaded.wait(0.05 if deadline is not None else None):
+            deadline.check()
+        with self._lock:
+            if not self.alive and self._load_error is not None:
+                raise LocalInferenceError(self._load_error)
+
+    def _stop(self):
+        """结束子进程（调用方持有锁）"""
+        process, conn = self._process, self._conn
+        self._process = self._conn = None
+        self._abandoned.clear()
+        if process is None:
+            return
+        try:
+            conn.send(None)
+        except (OSError, ValueError):
+            pass
+        process.join(timeout=2)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=2)
+        conn.close()
+
+    def start(self):
+        """启动子进程并等待模型加载完成（已启动时直接返回）"""
+        self._wait_ready()
+
+    def _receive(self, request_id: int, deadline) -> tuple:
+        """等待本请求的响应（调用方持有锁）
+
+        前面被放弃的请求的响应先到达时丢弃；子进程超过 timeout 没有任何响应视为卡死，抛出 TimeoutError。
+        录音到期或被取消时不结束子进程（重新加载模型代价很高），只放弃本请求并抛出 DeadlineExceeded / Cancelled。
+        """
+        hung_at = time.monotonic() + self.timeout
+        while True:
+            now = time.monotonic()
+            if now >= hung_at:
+                raise TimeoutError(f"本地推理超过 {self.timeout:.0f}s 未返回")
+            # 有截止时间时分片等待，及时响应取消
+            if self._conn.poll(min(0.05, hung_at - now) if deadline is not None else hung_at - now):
+                response = self._conn.recv()
+                if response[0] in self._abandoned:
+                    self._abandoned.discard(response[0])
+                    hung_at = time.monotonic() + self.timeout
+                    continue
+                return response
+            if deadline is not None and deadline.done:
+                self._abandoned.add(request_id)
+                self._stats["abandoned"] += 1
+                deadline.check()
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> Tuple[str, float, List[Dict[str, Any]]]:
+        """转录 PCM 缓冲，返回 (文本, 推理耗时, 分段)；失败时抛出异常"""
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+        samples = np.ascontiguousarray(samples)
+        channels = samples.shape[1] if samples.ndim == 2 else 1
+        while True:
+            self._wait_ready(deadline)
+            with self._lock:
+                # 等待加载期间子进程可能已经退出，重新等待
+                if self.alive:
+                    return self._request(samples, sample_rate, channels, deadline)
+
+    def _request(self, samples: np.ndarray, sample_rate: int, channels: int,
+                 deadline) -> Tuple[str, float, List[Dict[str, Any]]]:
+        """向已就绪的子进程发送一次请求并等待响应（调用方持有锁）"""
+        request_id = next(self._ids)
+        self._stats["requests"] += 1
+        try:
+            self._conn.send((request_id, samples.dtype.str, sample_rate, channels))
+            # 直接发送数组底层缓冲，不经过 pickle
+            self._conn.send_bytes(memoryview(samples).cast("B"))
+            response_id, ok, text, segments, inference_time = self._receive(request_id, deadline)
+        except DeadlineError:
+            raise
+        except (TimeoutError, EOFError, OSError) as e:
+            # 子进程卡死或崩溃：结束它，下一个请求重新启动
+            self._stats["failures"] += 1
+            self._stop()
+            raise LocalInferenceError(f"本地推理进程异常: {e}")
+        if response_id != request_id or not ok:
+            self._stats["failures"] += 1
+            raise LocalInferenceError(text if not ok else "本地推理响应错位")
+        self._stats["inference_time"] += inference_time
+        self._stats["audio_seconds"] += len(samples) / sample_rate
+        return text, inference_time, segments
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["load_time"] = self.load_time
+        stats["alive"] = self.alive
+        stats["rtf"] = stats["inference_time"] / stats["audio_seconds"] if stats["audio_seconds"] else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+
+_workers: Dict[tuple, LocalInferenceWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_local_worker(**kwargs) -> LocalInferenceWorker:
+    """获取进程内共享的推理子进程，相同配置只加载一份模型"""
+    worker = LocalInferenceWorker(**kwargs)
+    key = tuple(sorted(worker.config.items()))
+    with _workers_lock:
+        return _workers.setdefault(key, worker)
+
+
+@atexit.register
+def _close_workers():
+    with _workers_lock:
+        workers = list(_workers.values())
+    for worker in workers:
+        worker.close()
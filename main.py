@@ -1,219 +1,142 @@
+import argparse
 import os
-import tempfile
 import time
-import subprocess
-import threading
-import sounddevice as sd
-import numpy as np
-from pynput import keyboard
-from scipy.io.wavfile import write as write_wav
+from startup import StartupProfiler, Lazy, preload
 from dotenv import load_dotenv
-from speech_transcription import create_transcription_manager
+from pipeline import ProcessingPipeline, Utterance
+from tracing import get_tracer, activate, span
+from deadline import DeadlineError, deadline_scope, utterance_deadline
+from structured_logging import configure_logging, get_logger, log_context, flush_logs
+
+# 启动耗时从导入 startup 开始计算；numpy / sounddevice / requests 等重量级依赖推迟到后台预加载或首次使用时导入
+profiler = StartupProfiler()
 
 load_dotenv()
 
 # 支持的提供商配置
 PROVIDER = os.getenv("TRANSCRIPTION_PROVIDER", "siliconflow").lower()
+# 对冲提供商：主提供商响应过慢时并发请求，取先返回的结果
+HEDGE_PROVIDER = os.getenv("HEDGE_PROVIDER") or None
+# 额外参与路由的提供商（逗号分隔），按实时延迟与错误率为每个请求选择提供商
+ROUTING_PROVIDERS = [name.strip() for name in os.getenv("TRANSCRIPTION_PROVIDERS", "").split(",") if name.strip()]
 
 if PROVIDER == "groq":
     API_TOKEN = os.getenv("GROQ_API_KEY")
     MODEL = os.getenv("GROQ_MODEL", "whisper-large-v3-turbo")
-    transcription_manager = create_transcription_manager("groq", api_key=API_TOKEN, model=MODEL)
+elif PROVIDER == "local":
+    # 本地 CPU 推理，不需要 API 密钥
+    API_TOKEN = None
+    MODEL = os.getenv("LOCAL_MODEL", "small")
 else:  # 默认使用 siliconflow
+    PROVIDER = "siliconflow"
     API_TOKEN = os.getenv("SILICONFLOW_API_KEY")
     MODEL = os.getenv("SILICONFLOW_MODEL", "FunAudioLLM/SenseVoiceSmall")
-    transcription_manager = create_transcription_manager("siliconflow", api_key=API_TOKEN, model=MODEL)
 
 SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
-
+# 流式模式：按住快捷键期间即在停顿处分段转录
+STREAMING_MODE = os.getenv("STREAMING_MODE", "false").lower() in ("1", "true", "yes")
+# 上传前的语音活动检测：裁剪首尾静音，无语音时跳过转录
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() in ("1", "true", "yes")
+# 转录守护进程：auto 为守护进程在运行时使用它，off 为始终进程内转录
+DAEMON_MODE = os.getenv("DAEMON_MODE", "auto").lower()
+# 中止键：取消正在进行的录音与所有尚未输出的转录，none 表示不启用
+ABORT_KEY = os.getenv("ABORT_KEY", "none").lower()
+# 开始新的录音时取消之前尚未输出的转录
+UTTERANCE_SUPERSEDE = os.getenv("UTTERANCE_SUPERSEDE", "false").lower() in ("1", "true", "yes")
+# 从松开按键到粘贴完成的分段延迟追踪
+tracer = get_tracer()
+# 运行中的提示与错误经日志队列在后台写出，不阻塞快捷键、录音与粘贴线程
+log = get_logger("main")
+
+
+def _create_audio_input():
+    """导入录音依赖（numpy + PortAudio 初始化）；AUDIO_ALWAYS_ON 开启时在此打开常开输入流"""
+    import sounddevice  # noqa: F401
+    from audio_input import AudioInput
+    audio = AudioInput(SAMPLE_RATE)
+    audio.open()
+    return audio
+
+
+def _create_local_manager():
+    from speech_transcription import create_transcription_manager
+    return create_transcription_manager(PROVIDER, hedge_provider=HEDGE_PROVIDER, routing_providers=ROUTING_PROVIDERS,
+                                        api_key=API_TOKEN, model=MODEL)
+
+
+def _create_transcription_manager():
+    # 本机有转录守护进程在运行时共享它的连接池、缓存与限速，守护进程中断后自动退回进程内转录
+    if DAEMON_MODE != "off":
+        from daemon import connect
+        client = connect(fallback_factory=_create_local_manager)
+        if client is not None:
+            log.info(f"🛰️ 使用转录守护进程: {client.address}")
+            return client
+    return _create_local_manager()
+
+
+def _create_vad():
+    if not VAD_ENABLED:
+        return None
+    from vad import VoiceActivityDetector
+    return VoiceActivityDetector()
+
+
+def _create_text_processor():
+    # 词表替换规则编译为自动机，规则文件变化时自动重新加载
+    from text_postprocess import TextPostProcessor
+    return TextPostProcessor()
+
+
+def _create_history_store():
+    # 转录历史：SQLite + 全文索引，后台批量写入；HISTORY_ENABLED=false 时为 None
+    from history import get_history_store
+    store = get_history_store()
+    if store is not None:
+        store.start()
+    return store
+
+
+def _create_output_sink():
+    # 剪贴板与粘贴后端，按平台自动选择，OUTPUT_SINK=memory 时只在进程内输出
+    from output_sink import create_output_sink
+    return create_output_sink()
+
+
+audio_input = Lazy("audio_input", _create_audio_input, profiler)
+transcription = Lazy("transcription_manager", _create_transcription_manager, profiler)
+voice_activity = Lazy("vad", _create_vad, profiler)
+text_processor = Lazy("text_processor", _create_text_processor, profiler)
+output = Lazy("output_sink", _create_output_sink, profiler)
+history = Lazy("history", _create_history_store, profiler)
+processing = Lazy("pipeline", lambda: ProcessingPipeline(PIPELINE_STAGES), profiler)
+# 预热项：值为 None，只保证执行一次
+connection_warm_up = Lazy("connection_warm_up", lambda: get_transcription_manager().warm_up(), profiler)
+paste_warm_up = Lazy("paste_warm_up", lambda: get_output_sink().warm_up(), profiler)
+
+
+def get_transcription_manager():
+    return transcription.get()
+
+
+def get_output_sink():
+    return output.get()
+
+
+# 快捷键监听依赖的 pynput.keyboard，在 main() 中导入
+keyboard = None
 recording = False
-audio_frames = []
-stream = None
-start_time = None
+streaming_session = None
 cmd_semicolon_pressed = False
 pressed_keys = set()
 
 
-def initialize_paste_system():
-    """初始化粘贴系统，确保资源就绪"""
-    print("🔧 初始化粘贴系统...")
-    
-    # 预热剪贴板系统
-    try:
-        test_text = "warm_up_test"
-        process = subprocess.Popen(['pbcopy'], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-        process.communicate(test_text.encode('utf-8'))
-        
-        # 验证剪贴板工作正常
-        verify_process = subprocess.Popen(['pbpaste'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = verify_process.communicate()
-        
-        # 清理测试数据
-        empty_process = subprocess.Popen(['pbcopy'], stdin=subprocess.PIPE)
-        empty_process.communicate(b'')
-        
-        print("✅ 剪贴板系统就绪")
-    except Exception as e:
-        print(f"⚠️ 剪贴板预热警告: {e}")
-    
-    # 预热权限系统
-    try:
-        # 发送一个 AppleScript 命令来"唤醒"系统权限
-        subprocess.run(['osascript', '-e', '''
-        tell application "System Events"
-            -- 触发权限检查但不实际执行操作
-            get name of application process "System Events"
-        end tell
-        '''], capture_output=True, check=True)
-        print("✅ 权限系统就绪")
-    except Exception as e:
-        print(f"⚠️ 权限预热警告: {e}")
-    
-    # 测试 AppleScript 功能
-    try:
-        test_applescript = '''
-        tell application "System Events"
-            -- 测试 AppleScript 基本功能
-            delay 0.1
-        end tell
-        '''
-        process = subprocess.run(['osascript', '-e', test_applescript], 
-                               capture_output=True, text=True, timeout=3)
-        if process.returncode == 0:
-            print("✅ AppleScript 系统就绪")
-        else:
-            print(f"⚠️ AppleScript 预热失败: {process.stderr}")
-    except Exception as e:
-        print(f"⚠️ AppleScript 预热警告: {e}")
-    
-    time.sleep(0.2)  # 给系统一些时间完成初始化
-    print("🚀 粘贴系统初始化完成")
-
-
-def copy_to_clipboard(text):
-    """复制文本到剪贴板 (macOS)"""
-    try:
-        process = subprocess.Popen(['pbcopy'], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate(text.encode('utf-8'))
-        
-        if process.returncode != 0:
-            print(f"❌ 复制到剪贴板失败: {stderr.decode()}")
-            return False
-        return True
-    except Exception as e:
-        print(f"❌ 复制到剪贴板异常: {e}")
-        return False
-
-
-def verify_clipboard_content(expected_text):
-    """验证剪贴板内容是否正确"""
-    try:
-        process = subprocess.Popen(['pbpaste'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        
-        if process.returncode == 0:
-            clipboard_content = stdout.decode('utf-8').strip()
-            return expected_text.strip() in clipboard_content
-    except Exception:
-        pass
-    return False
-
-
-def paste_to_cursor(text, delay=0.1):
-    """粘贴文本到当前光标位置 - 仅使用 AppleScript"""
-    max_retries = 3
-    
-    # 确保文本已复制到剪贴板
-    if not copy_to_clipboard(text):
-        print("❌ 无法复制文本到剪贴板")
+def _is_abort_key(key) -> bool:
+    if ABORT_KEY in ("", "none", "off"):
         return False
-    
-    if delay > 0:
-        print(f"⏳ 准备粘贴... ({delay:.1f}秒)")
-        time.sleep(delay)
-    else:
-        print("⚡ 立即粘贴...")
-    
-    for attempt in range(max_retries):
-        try:
-            print(f"📝 尝试粘贴 (第 {attempt + 1}/{max_retries} 次)...")
-            
-            # 确保剪贴板内容正确
-            if not verify_clipboard_content(text):
-                print("🔄 剪贴板内容验证失败，重新复制...")
-                copy_to_clipboard(text)
-                time.sleep(0.2)
-            
-            # 使用 AppleScript 粘贴
-            try:
-                print("🍎 执行 AppleScript 粘贴...")
-                applescript = '''
-                tell application "System Events"
-                    -- 确保目标应用处于前台并获得焦点
-                    delay 0.2
-                    
-                    -- 标准粘贴
-                    try
-                        keystroke "v" using command down
-                        delay 0.1
-                    on error
-                        -- 如果失败，先激活应用再粘贴
-                        activate
-                        delay 0.1
-                        keystroke "v" using command down
-                    end try
-                end tell
-                '''
-                
-                process = subprocess.run(['osascript', '-e', applescript], 
-                                       capture_output=True, text=True, timeout=8)
-                
-                if process.returncode == 0:
-                    print("✅ 粘贴完成！")
-                    time.sleep(0.3)  # 等待粘贴完成
-                    return True
-                else:
-                    print(f"⚠️ 粘贴失败: {process.stderr}")
-                    # 如果是权限错误，给出明确提示
-                    if 'not allowed' in process.stderr.lower() or 'authorized' in process.stderr.lower():
-                        print("🔑 检测到权限问题，请检查辅助功能权限")
-                        
-            except subprocess.TimeoutExpired:
-                print("⚠️ 粘贴超时，请重试")
-            except Exception as e1:
-                print(f"⚠️ 粘贴异常: {e1}")
-            
-            if attempt < max_retries - 1:
-                wait_time = 0.8 + (attempt * 0.3)  # 递增等待时间
-                print(f"🔄 第 {attempt + 1} 次尝试失败，等待 {wait_time:.1f} 秒后重试...")
-                time.sleep(wait_time)
-                
-        except Exception as e:
-            print(f"❌ 第 {attempt + 1} 次粘贴尝试异常: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(0.8)
-    
-    print("❌ 所有粘贴尝试均失败")
-    print("🔧 故障排除建议：")
-    print("   1. 检查系统偏好设置 → 安全性与隐私 → 屏幕录制权限")
-    print("   2. 检查系统偏好设置 → 安全性与隐私 → 辅助功能权限")
-    print("   3. 确保目标应用处于活动状态")
-    print("   4. 尝试重启终端或重新运行程序")
-    print("   5. 如果是首次运行，请在权限弹窗中点击'允许'")
-    
-    # 清理剪贴板（隐私保护）
-    try:
-        empty_clipboard = subprocess.Popen(['pbcopy'], stdin=subprocess.PIPE)
-        empty_clipboard.communicate(b'')
-    except Exception:
-        pass
-    
-    return False
-
-
-def audio_callback(indata, frames, time_info, status):
-    if recording:
-        audio_frames.append(indata.copy())
+    if len(ABORT_KEY) == 1:
+        return key == keyboard.KeyCode.from_char(ABORT_KEY)
+    return key == getattr(keyboard.Key, ABORT_KEY, None)
 
 
 def on_key_press(key):
@@ -222,6 +145,9 @@ def on_key_press(key):
     pressed_keys.add(key)
 
     try:
+        if _is_abort_key(key):
+            abort_processing()
+            return
         if key == keyboard.KeyCode.from_char(';') and keyboard.Key.cmd in pressed_keys:
             if not cmd_semicolon_pressed and not recording:
                 cmd_semicolon_pressed = True
@@ -240,95 +166,302 @@ def on_key_release(key):
         if key == keyboard.KeyCode.from_char(';'):
             if cmd_semicolon_pressed and recording:
                 cmd_semicolon_pressed = False
-                audio_path, record_time = stop_recording()
-
-                if audio_path:
-                    threading.Thread(target=process_audio, args=(audio_path, record_time), daemon=True).start()
+                session = streaming_session
+                trace = tracer.start_trace(streaming=session is not None)
+                with activate(trace), span("stop_recording"):
+                    audio, record_time = stop_recording()
+
+                if audio is not None:
+                    # 截止时间从松开按键起算，随录音时长放宽
+                    processing.get().submit(audio, record_time, session, trace,
+                                            deadline=utterance_deadline(record_time))
     except AttributeError:
         pass
 
 
-def process_audio(audio_path, record_time):
-    """处理音频文件 - 使用新的转录模块"""
-    text, inference_time = transcription_manager.transcribe(audio_path)
-    os.unlink(audio_path)
+def encode_stage(utterance):
+    """编码阶段：VAD 裁剪静音，再按提供商支持的格式编码"""
+    if utterance.session is not None:
+        return
+    audio = utterance.audio
+    vad = voice_activity.get()
+    if vad is not None:
+        audio = vad.process(audio)
+        if audio is None:
+            utterance.skipped = True
+            stats = vad.get_stats()
+            log.info(f"📉 VAD 累计跳过 {stats['skipped_calls']} 次调用，节省 {stats['bytes_saved'] / 1024:.1f}KB",
+                     skipped_calls=stats["skipped_calls"], bytes_saved=stats["bytes_saved"])
+            return
+    # 长录音由转录管理器分块后再逐块编码
+    manager = get_transcription_manager()
+    if manager.needs_chunking(audio):
+        utterance.encoded = audio
+    else:
+        utterance.encoded = manager.encode(audio)
+
+
+def transcribe_stage(utterance):
+    """转录阶段：流式模式下大部分分段已在录音期间转录，这里只等待尾段并拼接结果"""
+    if utterance.session is not None:
+        utterance.text, utterance.inference_time = utterance.session.finish()
+    else:
+        manager = get_transcription_manager()
+        utterance.text, utterance.inference_time = manager.transcribe_audio(utterance.encoded)
+        utterance.provider = manager.last_provider_info()
+
+
+def postprocess_stage(utterance):
+    """后处理阶段：词表替换与标点规范化"""
+    if not utterance.text:
+        return
+    utterance.text, count, elapsed = text_processor.get().process(utterance.text)
+    if count:
+        log.info(f"✏️ 后处理替换 {count} 处（{elapsed * 1000:.2f}ms）", replacements=count, duration=round(elapsed, 6))
 
+
+def output_stage(utterance):
+    """输出阶段：复制并粘贴，按录音顺序执行"""
+    text = utterance.text
     if text:
-        copy_to_clipboard(text)
-        print("📋 已复制到剪贴板!")
-        paste_to_cursor(text, delay=0)  # 无延迟，AppleScript 会自动处理应用切换
-        print(f"⏱️  录音 {record_time:.2f}s | 转录 {inference_time:.2f}s | RTF {inference_time/record_time:.2f}x")
+        result = get_output_sink().output(text)
+        if result["pasted"]:
+            log.info(f"✅ 已粘贴 | 复制 {result['copy_time'] * 1000:.0f}ms | 粘贴 {result['paste_time'] * 1000:.0f}ms",
+                     copy_time=round(result["copy_time"], 4), paste_time=round(result["paste_time"], 4))
+        elif result["copied"]:
+            log.info("📋 已复制到剪贴板!", copy_time=round(result["copy_time"], 4))
+        record_time = utterance.record_time
+        log.info(f"⏱️  录音 {record_time:.2f}s | 转录 {utterance.inference_time:.2f}s | RTF {utterance.inference_time/record_time:.2f}x",
+                 record_time=round(record_time, 3), inference_time=round(utterance.inference_time, 3),
+                 total_time=round(time.time() - utterance.created_at, 3))
+        # 粘贴完成后再入队，写入在后台线程批量进行
+        store = history.get()
+        if store is not None:
+            provider = utterance.provider or get_transcription_manager().get_provider_info()
+            store.record(text, duration=utterance.audio.duration, record_time=record_time,
+                         inference_time=utterance.inference_time, total_time=time.time() - utterance.created_at,
+                         provider=provider.get("name"), model=provider.get("model"),
+                         audio=utterance.encoded if utterance.encoded is not None else utterance.audio)
     else:
-        print("❌ 转录失败或无内容")
+        log.warning("❌ 转录失败或无内容")
+
+
+# 流水线各阶段：(阶段名, 处理函数, 线程数)
+PIPELINE_STAGES = [
+    ("encode", encode_stage, int(os.getenv("PIPELINE_ENCODE_WORKERS", "1"))),
+    ("transcribe", transcribe_stage, int(os.getenv("PIPELINE_TRANSCRIBE_WORKERS", "3"))),
+    ("postprocess", postprocess_stage, 1),
+    ("output", output_stage, 1),
+]
+
+
+def process_audio(audio, record_time, session=None):
+    """同步处理一次录音，依次执行流水线的各个阶段"""
+    utterance = Utterance(audio, record_time, session, tracer.start_trace(), utterance_deadline(record_time))
+    with activate(utterance.trace), deadline_scope(utterance.deadline):
+        for name, handler, _ in PIPELINE_STAGES:
+            if utterance.skipped:
+                break
+            with span(name), log_context(stage=name):
+                try:
+                    handler(utterance)
+                except DeadlineError as e:
+                    utterance.error = e
+                    log.warning(f"⏹️ 录音处理中止（{name}）: {e}")
+                    break
+    utterance.finish_trace()
+    return utterance
 
 
 def start_recording():
-    global recording, audio_frames, stream, start_time
+    global recording, streaming_session
 
     if recording:
         return
 
-    audio_frames = []
-    recording = True
-    start_time = time.time()
+    # 后台预加载尚未完成时在这里等待导入完成
+    audio = audio_input.get()
 
-    stream = sd.InputStream(
-        samplerate=SAMPLE_RATE,
-        channels=1,
-        dtype=np.int16,
-        callback=audio_callback
-    )
+    if UTTERANCE_SUPERSEDE and processing.ready:
+        cancelled = processing.get().cancel_all("已开始新的录音")
+        if cancelled:
+            log.info(f"⏹️ 已取消 {cancelled} 条未完成的转录", cancelled=cancelled)
 
-    stream.start()
-    print("🎤 开始录音...")
+    # 每次录音使用新的缓冲，上一次的录音可能仍在后台转录；
+    # 常开模式下只在缓冲中标记起点（含预录音频），不必再打开输入流
+    if STREAMING_MODE:
+        from streaming import StreamingTranscriber
+        streaming_session = StreamingTranscriber(get_transcription_manager(), SAMPLE_RATE)
+    recording = True
+    audio.start(on_block=streaming_session.feed if streaming_session is not None else None)
+    log.info("🎤 开始录音...")
 
 
 def stop_recording():
-    global recording, audio_frames, stream, start_time
+    global recording, streaming_session
 
     if not recording:
         return None, 0
 
     recording = False
-    stream.stop()
-    stream.close()
+    audio, record_time = audio_input.get().stop()
+    streaming_session = None
 
-    record_time = time.time() - start_time
-
-    if not audio_frames:
-        print("没有录到音频")
+    if audio is None:
+        log.info("没有录到音频")
         return None, 0
 
-    audio_data = np.concatenate(audio_frames, axis=0)
-    print(f"录音完成！时长 {record_time:.2f} 秒")
+    log.info(f"录音完成！时长 {record_time:.2f} 秒", record_time=round(record_time, 3))
+
+    return audio, record_time
 
-    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    write_wav(temp_file.name, SAMPLE_RATE, audio_data)
-    return temp_file.name, record_time
 
+def abort_processing():
+    """中止键：丢弃正在进行的录音，取消所有尚未输出的转录（进行中的请求立即中断）"""
+    global recording, streaming_session, cmd_semicolon_pressed
 
-def main():
-    # 检查转录管理器配置
-    if not transcription_manager.get_provider_info().get("configured", False):
+    aborted = False
+    if recording:
+        recording = False
+        cmd_semicolon_pressed = False
+        if streaming_session is not None:
+            streaming_session.cancel("已按下中止键")
+            streaming_session = None
+        audio_input.get().stop()
+        aborted = True
+    cancelled = processing.get().cancel_all("已按下中止键") if processing.ready else 0
+    if aborted:
+        log.info("⏹️ 已中止录音")
+    if cancelled:
+        log.info(f"⏹️ 已取消 {cancelled} 条未完成的转录", cancelled=cancelled)
+
+
+def _daemon_running() -> bool:
+    if DAEMON_MODE == "off":
+        return False
+    from daemon import DaemonClient
+    return DaemonClient().probe() is not None
+
+
+def parse_args(argv=None):
+    """解析命令行参数：不带子命令时启动快捷键录音，batch 子命令批量转录文件"""
+    parser = argparse.ArgumentParser(prog="whisper-pasts", description="语音转文字工具")
+    parser.add_argument("--startup-profile", action="store_true",
+                        default=os.getenv("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes"),
+                        help="后台初始化完成后打印启动耗时明细")
+    parser.add_argument("-q", "--quiet", action="store_true", default=None,
+                        help="安静模式：只输出警告与错误，默认读取 LOG_QUIET")
+    parser.add_argument("--log-format", choices=["text", "json"], help="日志格式，默认读取 LOG_FORMAT")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], help="日志级别，默认读取 LOG_LEVEL")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="批量转录录音文件（WAV/FLAC/OGG）")
+    batch.add_argument("directory", nargs="?", help="递归遍历的录音目录")
+    batch.add_argument("--manifest", help="清单文件：每行一个路径，或含 path 字段的 JSONL")
+    batch.add_argument("-o", "--output", default="transcriptions.jsonl", help="结果 JSONL 路径（追加写入）")
+    batch.add_argument("--checkpoint", help="检查点路径，默认为 <output>.checkpoint")
+    batch.add_argument("-j", "--concurrency", type=int, help="并发请求数，默认读取 BATCH_CONCURRENCY")
+
+    daemon = subparsers.add_parser("daemon", help="以守护进程运行转录服务，供快捷键客户端与批量任务共享")
+    daemon.add_argument("--address", help="监听地址 unix:/path 或 host:port，默认读取 DAEMON_ADDRESS")
+    daemon.add_argument("--workers", type=int, help="转录线程数，默认读取 DAEMON_WORKERS")
+
+    history_parser = subparsers.add_parser("history", help="搜索、重新复制/粘贴转录历史")
+    history_actions = history_parser.add_subparsers(dest="action", required=True)
+    search = history_actions.add_parser("search", help="全文搜索历史")
+    search.add_argument("query", help="搜索内容")
+    search.add_argument("-n", "--limit", type=int, default=20, help="最多显示的条数")
+    recent = history_actions.add_parser("list", help="列出最近的历史")
+    recent.add_argument("-n", "--limit", type=int, default=20, help="最多显示的条数")
+    copy = history_actions.add_parser("copy", help="把一条历史复制到剪贴板")
+    copy.add_argument("id", type=int, help="历史编号")
+    paste = history_actions.add_parser("paste", help="把一条历史粘贴到光标位置")
+    paste.add_argument("id", type=int, help="历史编号")
+    paste.add_argument("--delay", type=float, default=2.0, help="粘贴前等待的秒数，用于切换到目标窗口")
+    export = history_actions.add_parser("audio", help="导出一条历史保存的录音")
+    export.add_argument("id", type=int, help="历史编号")
+    export.add_argument("-o", "--output", help="输出文件路径")
+    compact = history_actions.add_parser("compact", help="按保留期限或条目上限清理旧记录")
+    compact.add_argument("--days", type=float, help="保留天数，默认读取 HISTORY_RETENTION_DAYS")
+    compact.add_argument("--max-entries", type=int, help="最多保留条目数，默认读取 HISTORY_MAX_ENTRIES")
+
+    args = parser.parse_args(argv)
+    if args.command == "batch" and not args.directory and not args.manifest:
+        parser.error("batch 需要指定目录或 --manifest")
+    return args
+
+
+def print_startup_report():
+    profiler.mark("background_ready")
+    profiler.report()
+
+
+def main(argv=None):
+    global keyboard
+
+    args = parse_args(argv)
+    configure_logging(level=args.log_level, fmt=args.log_format, quiet=args.quiet)
+
+    if args.command == "history":
+        from history import run_history_command
+        raise SystemExit(run_history_command(args, output_sink_factory=get_output_sink))
+
+    # 检查转录服务配置（只读环境变量，不为此提前创建转录管理器）；客户端使用守护进程时不需要密钥
+    if PROVIDER != "local" and not API_TOKEN and not (args.command != "daemon" and _daemon_running()):
         print("❌ 语音转录服务未配置")
-        provider_info = transcription_manager.get_provider_info()
-        if provider_info["name"] == "Groq":
+        if PROVIDER == "groq":
             print("请在 .env 文件中设置 GROQ_API_KEY")
         else:  # SiliconFlow
             print("请在 .env 文件中设置 SILICONFLOW_API_KEY")
         return
 
+    if args.command == "daemon":
+        from daemon import TranscriptionDaemon
+        manager = _create_local_manager()
+        manager.warm_up()
+        TranscriptionDaemon(manager, address=args.address, workers=args.workers).serve_forever()
+        return
+
+    if args.command == "batch":
+        from batch_transcribe import run_batch
+        manager = get_transcription_manager()
+        manager.warm_up()
+        run_batch(manager, directory=args.directory, manifest=args.manifest,
+                  output=args.output, checkpoint=args.checkpoint, concurrency=args.concurrency)
+        return
+
+    # 先让快捷键监听就绪，其余初始化在后台进行
+    with profiler.phase("pynput"):
+        from pynput import keyboard
+    listener = keyboard.Listener(
+        on_press=on_key_press,
+        on_release=on_key_release
+    )
+    with profiler.phase("listener"):
+        listener.start()
+        listener.wait()
+    ready = profiler.mark("ready")
+
     print("=" * 50)
     print("🎙️  语音转文字工具 v2.0")
     
     # 显示提供商信息
-    provider_info = transcription_manager.get_provider_info()
-    print(f"🔧 语音转录提供商: {provider_info['name']}")
-    print(f"🤖 使用模型: {provider_info['model']}")
+    print(f"🔧 语音转录提供商: {PROVIDER}")
+    print(f"🤖 使用模型: {MODEL}")
+    if ROUTING_PROVIDERS:
+        print(f"🧭 多提供商路由: {', '.join([PROVIDER] + [name for name in ROUTING_PROVIDERS if name != PROVIDER])}")
+    if HEDGE_PROVIDER:
+        print(f"🔀 对冲提供商: {HEDGE_PROVIDER}")
+    if STREAMING_MODE:
+        print("🌊 流式分段转录: 已开启")
+    if os.getenv("AUDIO_ALWAYS_ON", "false").lower() in ("1", "true", "yes"):
+        print(f"🎙️ 常开输入流: 已开启（预录 {os.getenv('AUDIO_PREROLL_MS', '300')}ms）")
     print()
     print("快捷键说明：")
     print("• Cmd + ; : 复制到剪贴板")
     print("• Option (Alt) + ; : 直接粘贴到光标位置")
+    if ABORT_KEY not in ("", "none", "off"):
+        print(f"• {ABORT_KEY} : 中止录音并取消未完成的转录")
     print()
     print("使用方法：")
     print("1. 按住相应快捷键开始录音")
@@ -337,20 +470,17 @@ def main():
     print()
     print("按 Ctrl+C 退出")
     print("=" * 50)
-    print("\n程序已启动，等待按键触发...")
+    print(f"\n程序已启动，等待按键触发...（{ready * 1000:.0f}ms 就绪）")
     print("提示：可能需要授予终端/Python辅助功能权限")
     print("      直接粘贴模式需要额外的屏幕录制/辅助功能权限")
     print()
+    profiler.check_budget("ready")
 
-    # 初始化粘贴系统
-    initialize_paste_system()
-
-    listener = keyboard.Listener(
-        on_press=on_key_press,
-        on_release=on_key_release
-    )
-
-    listener.start()
+    # 后台依次完成：录音依赖 → 流水线 → 转录管理器与连接预热 → 粘贴系统 → VAD
+    # 任何一项在后台完成前被用到，都会在使用处等待它完成
+    preload([audio_input, processing, transcription, connection_warm_up, text_processor, output, paste_warm_up,
+             voice_activity, history],
+            on_complete=print_startup_report if args.startup_profile else None)
 
     try:
         while True:
@@ -361,6 +491,71 @@ def main():
         listener.stop()
         if recording:
             stop_recording()
+        if audio_input.ready:
+            audio_input.get().close()
+        if processing.ready:
+            processing.get().shutdown()
+        if history.ready and history.get() is not None:
+            history.get().close()
+        # 退出统计直接打印到终端，先写出队列中剩余的日志，保证输出顺序
+        flush_logs()
+        if audio_input.ready:
+            audio_input.get().print_budget_report()
+        if processing.ready:
+            processing_pipeline = processing.get()
+            pipeline_metrics = processing_pipeline.get_metrics()
+            for name, stage in pipeline_metrics.items():
+                if isinstance(stage, dict) and stage["processed"]:
+                    print(f"📊 {name}: 处理 {stage['processed']} 次 | 平均等待 {stage['avg_wait'] * 1000:.0f}ms | "
+                          f"平均耗时 {stage['avg_service'] * 1000:.0f}ms")
+            if pipeline_metrics["cancelled"]:
+                print(f"⏹️ 已取消 {pipeline_metrics['cancelled']} 条转录")
+            if pipeline_metrics["rejected"]:
+                print(f"⚠️ 处理队列已满，丢弃了 {pipeline_metrics['rejected']} 条录音")
+        tracer.print_summary()
+        tracer.close()
+        if transcription.ready:
+            coalescing = get_transcription_manager().get_coalescing_stats()
+            if coalescing and coalescing["batches"]:
+                print(f"📦 请求合并: 合并 {coalescing['batches']} 次（{coalescing['batched_clips']} 段录音）| "
+                      f"节省请求 {coalescing['requests_saved']} 次 | 平均等待 {coalescing['avg_wait'] * 1000:.0f}ms")
+        if text_processor.ready:
+            text_stats = text_processor.get().get_stats()
+            if text_stats["processed"] and text_stats["rules"]:
+                print(f"✏️ 后处理 {text_stats['processed']} 次 | 替换 {text_stats['replacements']} 处 | "
+                      f"规则 {text_stats['rules']} 条 | 平均 {text_stats['avg_time'] * 1000:.2f}ms | "
+                      f"最大 {text_stats['max_time'] * 1000:.2f}ms")
+        if history.ready and history.get() is not None:
+            store = history.get()
+            history_stats = store.get_stats()
+            if history_stats["written"]:
+                print(f"🗂️ 转录历史: 写入 {history_stats['written']} 条（{history_stats['batches']} 批）| {store.path}")
+        if output.ready:
+            output_stats = get_output_sink().get_stats()
+            if output_stats["outputs"]:
+                print(f"📋 输出 {output_stats['outputs']} 次 | 平均复制 {output_stats['avg_copy_time'] * 1000:.0f}ms | "
+                      f"平均粘贴 {output_stats['avg_paste_time'] * 1000:.0f}ms | "
+                      f"最大粘贴 {output_stats['max_paste_time'] * 1000:.0f}ms")
+        if transcription.ready:
+            for name, stats in get_transcription_manager().get_scheduler_stats().items():
+                if stats["requests"]:
+                    print(f"🚦 {name}: 请求 {stats['requests']} 次 | 重试 {stats['retries']} 次 | "
+                          f"限流 {stats['throttled']} 次 | 放弃 {stats['gave_up']} 次 | "
+                          f"平均排队 {stats['avg_queue_wait'] * 1000:.0f}ms | 并发上限 {stats['concurrency_limit']}")
+            for provider in get_transcription_manager().providers:
+                worker = getattr(provider, "worker", None)
+                if worker is not None and worker.get_stats()["requests"]:
+                    local_stats = worker.get_stats()
+                    print(f"🧠 本地推理: {local_stats['requests']} 次 | 失败 {local_stats['failures']} 次 | "
+                          f"RTF {local_stats['rtf']:.2f} | 模型加载 {local_stats['load_time'] or 0:.1f}s")
+            routing = get_transcription_manager().get_routing_info()
+            if routing["enabled"]:
+                for name, health in routing["health"].items():
+                    latency = health["ewma_latency"]
+                    line = f"🧭 {name}: {health['state']} | 成功 {health['successes']} 失败 {health['failures']}"
+                    if latency is not None:
+                        line += f" | EWMA 延迟 {latency:.2f}s"
+                    print(line)
         print("\n👋 已退出")
 
 
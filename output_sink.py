@@ -0,0 +1,375 @@
+"""
+输出模块
+把转录结果写入剪贴板并粘贴到光标位置。后端常驻复用（macOS / Linux X11 / Wayland / 进程内测试），
+每次输出只复制一次，用轮询确认代替固定等待，并统计复制与粘贴耗时
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from tracing import record_span
+from structured_logging import get_logger
+
+log = get_logger("output")
+
+
+class OutputSink:
+    """输出后端基类
+
+    子类实现 set_clipboard / send_paste，能读取剪贴板的后端再实现 get_clipboard 用于确认写入。
+    常驻资源（剪贴板句柄、键盘控制器）在 warm_up 中创建一次，之后每次输出复用。
+    """
+
+    name = "base"
+    # 全部粘贴尝试失败时的排查提示
+    troubleshooting: List[str] = []
+
+    def __init__(self, settle: float = None, confirm_timeout: float = None, retries: int = None):
+        """初始化输出后端
+
+        Args:
+            settle: 连续两次输出之间，给目标应用读取上一次剪贴板内容的最短间隔（秒），默认读取 OUTPUT_PASTE_SETTLE
+            confirm_timeout: 轮询确认剪贴板写入的超时（秒），默认读取 OUTPUT_CONFIRM_TIMEOUT
+            retries: 粘贴按键发送失败时的尝试次数，默认读取 OUTPUT_PASTE_RETRIES
+        """
+        self.settle = settle if settle is not None else float(os.getenv("OUTPUT_PASTE_SETTLE", "0.05"))
+        self.confirm_timeout = confirm_timeout or float(os.getenv("OUTPUT_CONFIRM_TIMEOUT", "0.5"))
+        self.retries = retries or int(os.getenv("OUTPUT_PASTE_RETRIES", "2"))
+        self._ready = False
+        self._lock = threading.Lock()
+        self._last_paste = 0.0
+        self._stats = {"outputs": 0, "copy_failures": 0, "paste_failures": 0,
+                       "total_copy_time": 0.0, "total_paste_time": 0.0, "max_paste_time": 0.0}
+
+    def warm_up(self):
+        """创建常驻资源，可重复调用"""
+        if not self._ready:
+            self._setup()
+            self._ready = True
+
+    def _setup(self):
+        pass
+
+    def set_clipboard(self, text: str) -> bool:
+        raise NotImplementedError
+
+    def get_clipboard(self) -> Optional[str]:
+        """读取剪贴板；无法低成本读取的后端返回 None，视为写入即生效"""
+        return None
+
+    def send_paste(self) -> bool:
+        raise NotImplementedError
+
+    def clear(self):
+        """清空剪贴板（隐私保护）"""
+        try:
+            self.set_clipboard("")
+        except Exception:
+            pass
+
+    def _confirm_clipboard(self, text: str) -> bool:
+        """轮询确认剪贴板内容已更新，间隔从 5ms 指数增长"""
+        deadline = time.time() + self.confirm_timeout
+        interval = 0.005
+        while True:
+            current = self.get_clipboard()
+            if current is None or current == text:
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, 0.05)
+
+    def output(self, text: str, paste: bool = True) -> Dict[str, Any]:
+        """复制文本并（可选）粘贴到光标位置
+
+        Returns:
+            dict: copied / pasted 是否成功，copy_time 复制耗时，paste_time 从开始复制到粘贴按键发出的耗时
+        """
+        self.warm_up()
+        result = {"copied": False, "pasted": False, "copy_time": 0.0, "paste_time": 0.0}
+        with self._lock:
+            # 上一次粘贴刚发出时，目标应用可能还没读取剪贴板，只在这种情况下等待剩余的间隔
+            remaining = self._last_paste + self.settle - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+
+            start_time = time.time()
+            try:
+                result["copied"] = self.set_clipboard(text) and self._confirm_clipboard(text)
+            except Exception as e:
+                log.error(f"❌ 复制到剪贴板异常: {e}")
+            result["copy_time"] = time.time() - start_time
+            record_span("clipboard", start_time, result["copy_time"])
+
+            if result["copied"] and paste:
+                paste_start = time.time()
+                for attempt in range(self.retries):
+                    try:
+                        result["pasted"] = self.send_paste()
+                    except Exception as e:
+                        log.warning(f"⚠️ 粘贴异常 (第 {attempt + 1}/{self.retries} 次): {e}")
+                    if result["pasted"]:
+                        break
+                self._last_paste = time.time()
+                result["paste_time"] = self._last_paste - start_time
+                record_span("paste", paste_start, self._last_paste - paste_start, pasted=result["pasted"])
+
+            self._record(result, paste)
+
+        if not result["copied"]:
+            log.error("❌ 无法复制文本到剪贴板")
+        elif paste and not result["pasted"]:
+            log.error("❌ 所有粘贴尝试均失败")
+            if self.troubleshooting:
+                log.warning("🔧 故障排除建议：")
+                for index, tip in enumerate(self.troubleshooting, 1):
+                    log.warning(f"   {index}. {tip}")
+            self.clear()
+        return result
+
+    def _record(self, result: Dict[str, Any], paste: bool):
+        self._stats["outputs"] += 1
+        self._stats["total_copy_time"] += result["copy_time"]
+        if not result["copied"]:
+            self._stats["copy_failures"] += 1
+        elif paste and not result["pasted"]:
+            self._stats["paste_failures"] += 1
+        elif paste:
+            self._stats["total_paste_time"] += result["paste_time"]
+            self._stats["max_paste_time"] = max(self._stats["max_paste_time"], result["paste_time"])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取输出次数、失败次数与平均耗时"""
+        with self._lock:
+            stats = dict(self._stats)
+        pasted = stats["outputs"] - stats["copy_failures"] - stats["paste_failures"]
+        stats["backend"] = self.name
+        stats["avg_copy_time"] = stats["total_copy_time"] / stats["outputs"] if stats["outputs"] else 0.0
+        stats["avg_paste_time"] = stats["total_paste_time"] / pasted if pasted > 0 else 0.0
+        return stats
+
+
+def _create_keyboard_controller():
+    """创建常驻的 pynput 键盘控制器，不可用时返回 None"""
+    try:
+        from pynput.keyboard import Controller
+        return Controller()
+    except Exception as e:
+        log.warning(f"⚠️ 键盘控制器不可用: {e}")
+        return None
+
+
+def _tap_with_modifier(controller, modifier, key: str = "v") -> bool:
+    with controller.pressed(modifier):
+        controller.press(key)
+        controller.release(key)
+    return True
+
+
+def _run_with_input(command: List[str], text: str, timeout: float = 2.0, forks: bool = False) -> bool:
+    """把文本写入命令的标准输入
+
+    forks 为 True 表示命令会留下后台进程持有剪贴板（xclip / xsel / wl-copy）：后台进程继承的输出管道
+    不会关闭，捕获 stderr 会一直等到超时，因此这类命令的输出全部丢弃，只根据退出码判断。
+    """
+    stderr = subprocess.DEVNULL if forks else subprocess.PIPE
+    process = subprocess.run(command, input=text.encode("utf-8"), stdout=subprocess.DEVNULL,
+                             stderr=stderr, timeout=timeout)
+    if process.returncode != 0:
+        detail = process.stderr.decode(errors="replace").strip() if process.stderr else f"退出码 {process.returncode}"
+        log.error(f"❌ 复制到剪贴板失败: {detail}")
+        return False
+    return True
+
+
+class MacOSSink(OutputSink):
+    """macOS 后端：NSPasteboard 写剪贴板，Quartz 键盘事件发送 Cmd+V，均在进程内完成"""
+
+    name = "macos"
+    troubleshooting = [
+        "检查系统偏好设置 → 安全性与隐私 → 辅助功能权限",
+        "确保目标应用处于活动状态",
+        "尝试重启终端或重新运行程序",
+        "如果是首次运行，请在权限弹窗中点击'允许'",
+    ]
+
+    def _setup(self):
+        self._pasteboard = None
+        try:
+            from AppKit import NSPasteboard, NSPasteboardTypeString
+            self._pasteboard = NSPasteboard.generalPasteboard()
+            self._string_type = NSPasteboardTypeString
+            log.info("✅ 剪贴板系统就绪 (NSPasteboard)")
+        except ImportError:
+            log.warning("⚠️ 未安装 pyobjc AppKit，剪贴板退回 pbcopy")
+        self._controller = _create_keyboard_controller()
+        if self._controller is not None:
+            from pynput.keyboard import Key
+            self._modifier = Key.cmd
+            log.info("✅ 键盘事件系统就绪")
+
+    def set_clipboard(self, text: str) -> bool:
+        if self._pasteboard is None:
+            return _run_with_input(["pbcopy"], text)
+        self._pasteboard.clearContents()
+        return bool(self._pasteboard.setString_forType_(text, self._string_type))
+
+    def get_clipboard(self) -> Optional[str]:
+        if self._pasteboard is None:
+            return None
+        return self._pasteboard.stringForType_(self._string_type)
+
+    def send_paste(self) -> bool:
+        if self._controller is not None:
+            return _tap_with_modifier(self._controller, self._modifier)
+        process = subprocess.run(["osascript", "-e", 'tell application "System Events" to keystroke "v" using command down'],
+                                 capture_output=True, text=True, timeout=5)
+        if process.returncode != 0 and ("not allowed" in process.stderr.lower() or "authorized" in process.stderr.lower()):
+            log.warning("🔑 检测到权限问题，请检查辅助功能权限")
+        return process.returncode == 0
+
+
+class X11Sink(OutputSink):
+    """Linux X11 后端：xclip / xsel 持有剪贴板（X11 剪贴板需要常驻的所有者进程），pynput 发送 Ctrl+V"""
+
+    name = "x11"
+    troubleshooting = [
+        "确认已安装 xclip 或 xsel",
+        "确认 DISPLAY 环境变量指向当前会话",
+        "确保目标应用处于活动状态",
+    ]
+
+    def _setup(self):
+        if shutil.which("xclip"):
+            self._copy_command = ["xclip", "-selection", "clipboard", "-in"]
+        elif shutil.which("xsel"):
+            self._copy_command = ["xsel", "--clipboard", "--input"]
+        else:
+            self._copy_command = None
+            log.warning("⚠️ 未找到 xclip 或 xsel，无法写入剪贴板")
+        self._controller = _create_keyboard_controller()
+        if self._controller is not None:
+            from pynput.keyboard import Key
+            self._modifier = Key.ctrl
+        elif shutil.which("xdotool"):
+            log.warning("⚠️ 退回 xdotool 发送粘贴按键")
+
+    def set_clipboard(self, text: str) -> bool:
+        # xclip / xsel 在取得剪贴板所有权后才返回，返回即写入完成
+        return self._copy_command is not None and _run_with_input(self._copy_command, text, forks=True)
+
+    def send_paste(self) -> bool:
+        if self._controller is not None:
+            return _tap_with_modifier(self._controller, self._modifier)
+        if shutil.which("xdotool"):
+            return subprocess.run(["xdotool", "key", "--clearmodifiers", "ctrl+v"], timeout=2).returncode == 0
+        return False
+
+
+class WaylandSink(OutputSink):
+    """Linux Wayland 后端：wl-copy 写剪贴板，wtype / ydotool 发送 Ctrl+V
+
+    Wayland 不允许普通客户端在进程内注入按键，只能借助外部工具。
+    """
+
+    name = "wayland"
+    troubleshooting = [
+        "确认已安装 wl-clipboard（wl-copy）",
+        "确认已安装 wtype，或 ydotool 且 ydotoold 正在运行",
+        "确保目标应用处于活动状态",
+    ]
+
+    def _setup(self):
+        if not shutil.which("wl-copy"):
+            log.warning("⚠️ 未找到 wl-copy，无法写入剪贴板")
+        if shutil.which("wtype"):
+            self._paste_command = ["wtype", "-M", "ctrl", "-k", "v", "-m", "ctrl"]
+        elif shutil.which("ydotool"):
+            # 29 = KEY_LEFTCTRL，47 = KEY_V
+            self._paste_command = ["ydotool", "key", "29:1", "47:1", "47:0", "29:0"]
+        else:
+            self._paste_command = None
+            log.warning("⚠️ 未找到 wtype 或 ydotool，只能复制到剪贴板")
+
+    def set_clipboard(self, text: str) -> bool:
+        return bool(shutil.which("wl-copy")) and _run_with_input(["wl-copy", "--type", "text/plain"], text, forks=True)
+
+    def send_paste(self) -> bool:
+        if self._paste_command is None:
+            return False
+        return subprocess.run(self._paste_command, timeout=2).returncode == 0
+
+
+class MemorySink(OutputSink):
+    """进程内输出后端：不访问系统剪贴板与键盘，用于无图形界面环境与流水线测试"""
+
+    name = "memory"
+
+    def __init__(self, paste_delay: float = 0.0, **kwargs):
+        """初始化进程内后端
+
+        Args:
+            paste_delay: 模拟的粘贴按键耗时（秒）
+        """
+        super().__init__(settle=kwargs.pop("settle", 0.0), **kwargs)
+        self.paste_delay = paste_delay
+        self.clipboard = ""
+        self.pasted: List[str] = []
+
+    def set_clipboard(self, text: str) -> bool:
+        self.clipboard = text
+        return True
+
+    def get_clipboard(self) -> Optional[str]:
+        return self.clipboard
+
+    def send_paste(self) -> bool:
+        if self.paste_delay > 0:
+            time.sleep(self.paste_delay)
+        self.pasted.append(self.clipboard)
+        return True
+
+
+OUTPUT_SINKS = {
+    "macos": MacOSSink,
+    "x11": X11Sink,
+    "wayland": WaylandSink,
+    "memory": MemorySink,
+}
+
+
+def detect_backend() -> str:
+    """按平台与会话类型选择输出后端"""
+    if sys.platform == "darwin":
+        return "macos"
+    if sys.platform.startswith("linux"):
+        if os.getenv("WAYLAND_DISPLAY") or os.getenv("XDG_SESSION_TYPE", "").lower() == "wayland":
+            return "wayland"
+        if os.getenv("DISPLAY"):
+            return "x11"
+    return "memory"
+
+
+def create_output_sink(name: str = None, **kwargs) -> OutputSink:
+    """创建输出后端
+
+    Args:
+        name: 后端名称（macos / x11 / wayland / memory / auto），默认读取 OUTPUT_SINK
+
+    Returns:
+        OutputSink: 输出后端实例
+    """
+    name = (name or os.getenv("OUTPUT_SINK", "auto")).lower()
+    if name == "auto":
+        name = detect_backend()
+        if name == "memory":
+            log.warning("⚠️ 未检测到图形会话，转录结果只保存在进程内")
+    if name not in OUTPUT_SINKS:
+        raise ValueError(f"不支持的输出后端: {name}。支持的后端: {', '.join(OUTPUT_SINKS)}")
+    return OUTPUT_SINKS[name](**kwargs)
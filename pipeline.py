@@ -0,0 +1,267 @@
+"""
+处理流水线模块
+编码 → 转录 → 后处理 → 输出，各阶段固定线程池，阶段之间用有界队列连接并形成背压，
+输出阶段按录音顺序执行
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from tracing import activate
+from deadline import Deadline, DeadlineError, deadline_scope
+from structured_logging import get_logger, log_context
+
+log = get_logger("pipeline")
+
+
+class Utterance:
+    """流水线中流转的一次录音"""
+
+    def __init__(self, audio, record_time: float, session=None, trace=None, deadline: Deadline = None):
+        self.seq: Optional[int] = None
+        self.audio = audio
+        self.record_time = record_time
+        # 流式模式下的 StreamingTranscriber，转录阶段只需等待尾段
+        self.session = session
+        # 从松开按键开始的延迟追踪，各阶段及其内部的 span 都记录在这里
+        self.trace = trace
+        # 端到端截止时间；被取消（重新录音、按下中止键）后剩余阶段不再执行，也不输出
+        self.deadline = deadline
+        self.encoded = None
+        self.text = ""
+        self.inference_time = 0.0
+        # 实际完成转录的提供商信息（name / model）
+        self.provider: Optional[Dict[str, Any]] = None
+        # 被前面阶段判定为无需处理（如无语音），后续阶段直接透传
+        self.skipped = False
+        # 提交时第一个阶段队列已满，被流水线丢弃
+        self.rejected = False
+        self.error: Optional[Exception] = None
+        self.created_at = time.time()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.deadline is not None and self.deadline.cancelled
+
+    def finish_trace(self):
+        """流水线处理完毕，结束追踪"""
+        if self.trace is not None:
+            self.trace.attrs.update(record_time=self.record_time, skipped=self.skipped, error=self.error is not None,
+                                    cancelled=self.cancelled, rejected=self.rejected)
+            self.trace.finish()
+
+
+class _StageMetrics:
+    """单个阶段的统计"""
+
+    def __init__(self):
+        self.processed = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_service = 0.0
+
+    def record(self, wait: float, service: float, failed: bool):
+        self.processed += 1
+        self.errors += int(failed)
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.total_service += service
+
+
+class ProcessingPipeline:
+    """多阶段处理流水线
+
+    stages 为 (阶段名, 处理函数, 线程数) 列表，处理函数接收 Utterance 并原地填充结果。
+    每个阶段前有一个有界队列，下游处理不过来时上游阻塞，不会无限堆积线程；
+    submit() 在按键监听线程中调用，不阻塞：第一个阶段队列已满时直接丢弃这次录音。
+    ordered_output 为 True 时最后一个阶段单线程运行，并按提交顺序执行。
+    每次录音的处理都在其截止时间内进行（deadline_scope），cancel_all 可中止所有未输出的录音。
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Utterance], None], int]],
+                 queue_size: int = None, ordered_output: bool = True):
+        """初始化流水线
+
+        Args:
+            stages: (阶段名, 处理函数, 线程数) 列表
+            queue_size: 每个阶段输入队列的容量，默认读取 PIPELINE_QUEUE_SIZE
+            ordered_output: 最后一个阶段是否按录音顺序执行
+        """
+        queue_size = queue_size or int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+        self.stages = stages
+        self.ordered_output = ordered_output
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._metrics = {name: _StageMetrics() for name, _, _ in stages}
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        # 下一个提交的序号；只有成功入队才占用序号，按序输出不会等待被丢弃的录音
+        self._seq = 0
+        # 已提交、尚未处理完的录音
+        self._active: Dict[int, Utterance] = {}
+        self._cancelled = 0
+        self._rejected = 0
+
+        # 按序输出的重排缓冲
+        self._pending: Dict[int, Tuple[float, Utterance]] = {}
+        self._next_seq = 0
+
+        self._workers = [self._worker_count(index) for index in range(len(stages))]
+        self._alive = list(self._workers)
+        self._threads: List[threading.Thread] = []
+        for index, (name, _, _) in enumerate(stages):
+            for n in range(self._workers[index]):
+                thread = threading.Thread(target=self._worker, args=(index,),
+                                          name=f"pipeline-{name}-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _is_output(self, index: int) -> bool:
+        return self.ordered_output and index == len(self.stages) - 1
+
+    def _worker_count(self, index: int) -> int:
+        return 1 if self._is_output(index) else max(1, self.stages[index][2])
+
+    def submit(self, audio, record_time: float, session=None, trace=None, deadline: Deadline = None) -> Utterance:
+        """提交一次录音；第一个阶段队列已满时不等待，丢弃这次录音并记录日志
+
+        Returns:
+            Utterance: 提交的录音；被丢弃时 rejected 为 True
+        """
+        utterance = Utterance(audio, record_time, session, trace, deadline)
+        with self._submit_lock:
+            utterance.seq = self._seq
+            with self._lock:
+                self._active[utterance.seq] = utterance
+            # 在锁内入队，保证序号顺序与入队顺序一致
+            try:
+                self._queues[0].put_nowait((time.time(), utterance))
+                self._seq += 1
+            except queue.Full:
+                with self._lock:
+                    self._active.pop(utterance.seq, None)
+                    self._rejected += 1
+                utterance.rejected = True
+        if utterance.rejected:
+            log.warning(f"⚠️ 处理队列已满（{self._queues[0].maxsize} 条录音在排队），丢弃本次录音",
+                        record_time=round(record_time, 2))
+            if session is not None:
+                session.cancel("处理队列已满")
+            utterance.finish_trace()
+        return utterance
+
+    def _worker(self, index: int):
+        name, handler, _ = self.stages[index]
+        input_queue = self._queues[index]
+        is_output = self._is_output(index)
+        while True:
+            item = input_queue.get()
+            if item is None:
+                self._worker_exit(index)
+                break
+            enqueued_at, utterance = item
+
+            if is_output:
+                self._run_ordered(index, enqueued_at, utterance)
+                continue
+
+            self._run(name, handler, enqueued_at, utterance)
+            if index + 1 < len(self.stages):
+                self._queues[index + 1].put((time.time(), utterance))
+            else:
+                self._finish(utterance)
+
+    def _run(self, name: str, handler: Callable[[Utterance], None], enqueued_at: float, utterance: Utterance):
+        start_time = time.time()
+        failed = False
+        ran = not utterance.skipped and utterance.error is None and not utterance.cancelled
+        if ran:
+            with activate(utterance.trace), deadline_scope(utterance.deadline), \
+                    log_context(stage=name, seq=utterance.seq):
+                try:
+                    handler(utterance)
+                except DeadlineError as e:
+                    utterance.error = e
+                    failed = True
+                    log.warning(f"⏹️ 录音处理中止（{name}）: {e}", error=type(e).__name__)
+                except Exception as e:
+                    utterance.error = e
+                    failed = True
+                    log.error(f"❌ 流水线阶段 {name} 异常: {e}", error=type(e).__name__)
+        end_time = time.time()
+        with self._lock:
+            self._metrics[name].record(start_time - enqueued_at, end_time - start_time, failed)
+        if ran and utterance.trace is not None:
+            utterance.trace.add(f"{name}.wait", enqueued_at, start_time - enqueued_at)
+            utterance.trace.add(name, start_time, end_time - start_time)
+
+    def _run_ordered(self, index: int, enqueued_at: float, utterance: Utterance):
+        """输出阶段：先到的后序录音在重排缓冲中等待，直到前面的录音都已输出"""
+        name, handler, _ = self.stages[index]
+        self._pending[utterance.seq] = (enqueued_at, utterance)
+        while self._next_seq in self._pending:
+            # 等待时间包含在重排缓冲中等待前序录音的时间
+            queued_at, ready = self._pending.pop(self._next_seq)
+            self._run(name, handler, queued_at, ready)
+            self._finish(ready)
+            self._next_seq += 1
+
+    def _finish(self, utterance: Utterance):
+        with self._lock:
+            self._active.pop(utterance.seq, None)
+        utterance.finish_trace()
+
+    def cancel_all(self, reason: str = "录音已取消") -> int:
+        """取消所有尚未输出的录音：进行中的请求立即中断，排队中的录音跳过剩余阶段，返回取消的条数"""
+        with self._lock:
+            pending = list(self._active.values())
+        count = 0
+        for utterance in pending:
+            if utterance.deadline is not None and utterance.deadline.cancel(reason):
+                count += 1
+        with self._lock:
+            self._cancelled += count
+        return count
+
+    def _worker_exit(self, index: int):
+        """阶段最后一个线程退出时，把停止信号传给下一阶段，保证已入队的录音先处理完"""
+        with self._lock:
+            self._alive[index] -= 1
+            last = self._alive[index] == 0
+        if last and index + 1 < len(self.stages):
+            for _ in range(self._workers[index + 1]):
+                self._queues[index + 1].put(None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取各阶段队列深度、等待时间与处理时间"""
+        metrics = {}
+        with self._lock:
+            for (name, _, workers), input_queue in zip(self.stages, self._queues):
+                stage = self._metrics[name]
+                processed = stage.processed or 1
+                metrics[name] = {
+                    "workers": workers,
+                    "queue_depth": input_queue.qsize(),
+                    "processed": stage.processed,
+                    "errors": stage.errors,
+                    "avg_wait": stage.total_wait / processed,
+                    "max_wait": stage.max_wait,
+                    "avg_service": stage.total_service / processed,
+                }
+            if self.ordered_output:
+                metrics["reorder_pending"] = len(self._pending)
+            metrics["in_flight"] = len(self._active)
+            metrics["cancelled"] = self._cancelled
+            metrics["rejected"] = self._rejected
+        return metrics
+
+    def shutdown(self, wait: bool = False):
+        """停止流水线，已入队的录音会先处理完"""
+        for _ in range(self._workers[0]):
+            self._queues[0].put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
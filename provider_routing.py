@@ -0,0 +1,233 @@
+"""
+提供商调度模块
+记录各提供商的实时延迟与健康状况：为对冲请求提供基于百分位的等待时间，
+按 EWMA 延迟、错误率与音频时长为每个请求选择提供商，并用熔断器暂时摘除故障提供商
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List
+
+import numpy as np
+from structured_logging import get_logger
+
+log = get_logger("routing")
+
+
+class LatencyTracker:
+    """按提供商记录最近的成功请求延迟"""
+
+    def __init__(self, window: int = 100):
+        """初始化延迟记录
+
+        Args:
+            window: 每个提供商保留的最近样本数
+        """
+        self.window = window
+        self._samples: Dict[Any, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, latency: float):
+        """记录一次成功请求的延迟"""
+        with self._lock:
+            samples = self._samples.setdefault(provider, deque(maxlen=self.window))
+            samples.append(latency)
+
+    def percentile(self, provider, q: float, min_samples: int = 10) -> Optional[float]:
+        """延迟的第 q 百分位；样本不足时返回 None"""
+        with self._lock:
+            samples = list(self._samples.get(provider, ()))
+        if len(samples) < min_samples:
+            return None
+        return float(np.percentile(samples, q))
+
+    def count(self, provider) -> int:
+        with self._lock:
+            return len(self._samples.get(provider, ()))
+
+
+def provider_label(provider) -> str:
+    """提供商的可读名称"""
+    try:
+        info = provider.get_info()
+        return f"{info['name']}/{info['model']}" if info.get("model") else info["name"]
+    except Exception:
+        return provider.__class__.__name__
+
+
+class ProviderHealth:
+    """单个提供商的健康状况与熔断器
+
+    熔断器状态：closed（正常）→ 连续失败达到阈值 → open（摘除）→ 冷却结束 → half_open（放行一个试探请求），
+    试探成功回到 closed，失败重新 open。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, alpha: float, failure_threshold: int, cooldown: float):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        # 所有请求的延迟 EWMA（主要反映短音频的往返时间）
+        self.ewma_latency: Optional[float] = None
+        # 吞吐：每秒墙钟时间处理的音频秒数（1 / RTF）的 EWMA
+        self.ewma_throughput: Optional[float] = None
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else self.alpha * value + (1 - self.alpha) * current
+
+    def record_success(self, latency: float, duration: float):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        self.ewma_latency = self._ewma(self.ewma_latency, latency)
+        if duration > 0 and latency > 0:
+            self.ewma_throughput = self._ewma(self.ewma_throughput, duration / latency)
+        self.state = self.CLOSED
+        self._trial_in_flight = False
+
+    def record_failure(self, latency: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+        # 失败的耗时同样计入延迟，超时的提供商排名会下降
+        self.ewma_latency = self._ewma(self.ewma_latency, latency)
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                log.warning(f"⛔ 熔断: 连续失败 {self.consecutive_failures} 次，暂停使用 {self.cooldown:.0f} 秒")
+            self.state = self.OPEN
+            self.opened_at = time.time()
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        """是否可以接收请求；冷却结束的熔断器转为半开并只放行一个试探请求"""
+        if self.state == self.OPEN and time.time() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            return not self._trial_in_flight
+        return self.state == self.CLOSED
+
+    def acquire(self) -> bool:
+        """实际发出请求前调用：半开状态下占用唯一的试探名额，返回是否占用了名额（需要 release）"""
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release(self):
+        """试探请求结束却没有记录结果（如被用户取消）时归还名额，下一个请求可以继续试探"""
+        self._trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ewma_latency": self.ewma_latency,
+            "ewma_throughput": self.ewma_throughput,
+            "error_rate": self.error_rate,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ProviderRouter:
+    """按实时健康状况为每个请求排序候选提供商
+
+    - 短音频（不超过 ROUTING_SHORT_CLIP 秒）按延迟 EWMA 选最快往返的提供商；
+    - 长音频按吞吐 EWMA 估算总耗时，选处理长音频最快的提供商；
+    - 估算值按错误率放大（失败意味着重试），没有样本的提供商优先试探；
+    - 熔断中的提供商不参与排序，全部熔断时退回到最早恢复的一个。
+    """
+
+    def __init__(self, providers: List, short_clip: float = None, alpha: float = None,
+                 failure_threshold: int = None, cooldown: float = None):
+        """初始化路由器
+
+        Args:
+            providers: 候选提供商列表，顺序作为同分时的优先级
+            short_clip: 短音频的时长上限（秒），默认读取 ROUTING_SHORT_CLIP
+            alpha: EWMA 平滑系数，默认读取 ROUTING_EWMA_ALPHA
+            failure_threshold: 连续失败多少次后熔断，默认读取 CIRCUIT_FAILURE_THRESHOLD
+            cooldown: 熔断冷却时间（秒），默认读取 CIRCUIT_COOLDOWN
+        """
+        self.providers = list(providers)
+        self.short_clip = short_clip or float(os.getenv("ROUTING_SHORT_CLIP", "10"))
+        alpha = alpha or float(os.getenv("ROUTING_EWMA_ALPHA", "0.3"))
+        failure_threshold = failure_threshold or int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+        cooldown = cooldown or float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+        self._health = {provider: ProviderHealth(alpha, failure_threshold, cooldown) for provider in self.providers}
+        self._decisions = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def _estimate(self, health: ProviderHealth, duration: float) -> float:
+        """估算该提供商处理这段音频的耗时"""
+        if health.ewma_latency is None:
+            return 0.0
+        if duration > self.short_clip and health.ewma_throughput:
+            estimate = duration / health.ewma_throughput
+        else:
+            estimate = health.ewma_latency
+        return estimate / max(0.05, 1.0 - health.error_rate)
+
+    def rank(self, duration: float) -> List:
+        """按估算耗时从小到大返回可用提供商，并记录本次路由决策"""
+        with self._lock:
+            available = [provider for provider in self.providers if self._health[provider].available()]
+            if not available:
+                available = [min(self.providers, key=lambda provider: self._health[provider].opened_at)]
+                reason = "all_open"
+            else:
+                reason = "short_clip" if duration <= self.short_clip else "long_clip"
+
+            estimates = {provider: self._estimate(self._health[provider], duration) for provider in available}
+            ranked = sorted(available, key=lambda provider: (estimates[provider], self.providers.index(provider)))
+            self._decisions.append({
+                "time": time.time(),
+                "duration": duration,
+                "reason": reason,
+                "chosen": provider_label(ranked[0]),
+                "estimates": {provider_label(provider): estimates[provider] for provider in ranked},
+            })
+        return ranked
+
+    def acquire(self, provider) -> bool:
+        """向提供商发出请求前调用，返回是否占用了半开熔断器的试探名额"""
+        with self._lock:
+            return provider in self._health and self._health[provider].acquire()
+
+    def release(self, provider):
+        """请求结束后归还 acquire 占用的试探名额（已记录成功 / 失败时为空操作）"""
+        with self._lock:
+            if provider in self._health:
+                self._health[provider].release()
+
+    def record_success(self, provider, latency: float, duration: float):
+        with self._lock:
+            if provider in self._health:
+                self._health[provider].record_success(latency, duration)
+
+    def record_failure(self, provider, latency: float):
+        with self._lock:
+            if provider in self._health:
+                self._health[provider].record_failure(latency)
+
+    def get_health(self) -> Dict[str, Any]:
+        """各提供商的健康状况"""
+        with self._lock:
+            return {provider_label(provider): self._health[provider].snapshot() for provider in self.providers}
+
+    def get_decisions(self) -> List[Dict[str, Any]]:
+        """最近的路由决策"""
+        with self._lock:
+            return list(self._decisions)
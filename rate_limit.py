@@ -0,0 +1,326 @@
+"""
+请求调度模块
+按提供商限制请求速率与并发：令牌桶按账户的每分钟请求数放行，
+并发上限随 429/5xx 响应加性增、乘性减（AIMD）自适应调整，
+遇到限流时遵守 Retry-After 并以带抖动的指数退避重试，不再直接丢弃录音
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Any, Optional, TypeVar
+
+import requests
+
+from tracing import record_span
+from deadline import current_deadline
+from structured_logging import get_logger
+
+log = get_logger("rate_limit")
+
+T = TypeVar("T")
+
+# 未配置 <NAME>_RPM 时的每分钟请求数（0 表示不限）；Groq 免费账户的转录接口为 20 次/分钟
+DEFAULT_RPM = {"groq": 20}
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），没有或无法解析时返回 None"""
+    headers = getattr(response, "headers", None) or {}
+    value = None
+    for key, header in headers.items():
+        if key.lower() == "retry-after":
+            value = header
+            break
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: Exception) -> Optional[int]:
+    """可重试的错误返回 HTTP 状态码（429 或 5xx），其余返回 None"""
+    if not isinstance(error, requests.exceptions.HTTPError):
+        return None
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status == 429 or (status is not None and 500 <= status < 600):
+        return status
+    return None
+
+
+class QueueTimeout(TimeoutError):
+    """请求在调度器中排队（等待令牌、并发名额或 Retry-After 暂停）超时，尚未发出，与提供商的健康状况无关"""
+
+
+class TokenBucket:
+    """令牌桶：平均每分钟放行 rpm 个请求，允许 burst 个请求的突发"""
+
+    def __init__(self, rpm: float, burst: int = None):
+        self.rate = rpm / 60.0
+        self.capacity = float(burst or max(1, int(rpm // 10)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """预订一个令牌，返回需要等待的秒数（令牌可以透支，等待期间的请求按顺序排队）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def refund(self):
+        """归还未使用的令牌"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class ProviderScheduler:
+    """单个提供商的调度器：令牌桶 + AIMD 并发上限 + Retry-After 暂停"""
+
+    def __init__(self, name: str, rpm: float = 0, max_concurrency: int = 4, min_concurrency: int = 1,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 max_wait: float = 60.0):
+        """初始化调度器
+
+        Args:
+            name: 提供商名称
+            rpm: 每分钟请求数上限，0 表示不限速
+            max_concurrency: 并发上限的最大值，也是初始值
+            min_concurrency: 并发上限的最小值
+            max_retries: 429/5xx 的最大重试次数
+            backoff_base: 指数退避的基础间隔（秒）
+            backoff_max: 单次退避的最长间隔（秒）
+            max_wait: 单个请求排队与退避的总时长上限（秒），超过后放弃并交给调用方切换提供商
+        """
+        self.name = name
+        self.bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.rpm = rpm
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._stats = {"requests": 0, "attempts": 0, "retries": 0, "throttled": 0, "server_errors": 0,
+                       "gave_up": 0, "queue_wait": 0.0, "max_queue_wait": 0.0}
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_concurrency, int(self._limit))
+
+    def _acquire(self, deadline: float, utterance=None) -> float:
+        """等待令牌、Retry-After 暂停与并发名额，返回排队时长
+
+        先取令牌再占并发名额：等待令牌的线程不占用名额，其他已有令牌的请求可以照常发出。
+        超过 deadline 时抛出 QueueTimeout；录音到期或被取消（utterance）时抛出 DeadlineExceeded / Cancelled。
+        """
+        start = time.monotonic()
+        if self.bucket is not None:
+            delay = self.bucket.reserve()
+            if delay > 0:
+                if time.monotonic() + delay > deadline:
+                    self.bucket.refund()
+                    if utterance is not None:
+                        utterance.check()
+                    raise QueueTimeout(f"{self.name} 请求排队超过 {self.max_wait:.0f}s")
+                if utterance is None:
+                    time.sleep(delay)
+                elif utterance.wait(delay):
+                    self.bucket.refund()
+                    utterance.check()
+        try:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if utterance is not None:
+                        utterance.check()
+                    if now >= deadline:
+                        raise QueueTimeout(f"{self.name} 请求排队超过 {self.max_wait:.0f}s")
+                    if now < self._paused_until:
+                        self._cond.wait(min(self._paused_until, deadline) - now)
+                    elif self._in_flight >= self.limit:
+                        self._cond.wait(deadline - now)
+                    else:
+                        self._in_flight += 1
+                        break
+        except BaseException:
+            # 没有发出请求，令牌归还给后面的请求
+            if self.bucket is not None:
+                self.bucket.refund()
+            raise
+        return time.monotonic() - start
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _on_success(self):
+        """加性增：每个成功请求让并发上限增加 1/上限，约每轮并发增加 1"""
+        with self._cond:
+            self._limit = min(float(self.max_concurrency), self._limit + 1.0 / max(1.0, self._limit))
+            self._cond.notify_all()
+
+    def _on_congestion(self, started: float, retry_after: Optional[float]):
+        """乘性减：同一轮内发出的请求只触发一次减半；有 Retry-After 时暂停该提供商的所有请求"""
+        with self._cond:
+            if started >= self._last_decrease:
+                self._limit = max(float(self.min_concurrency), self._limit / 2)
+                self._last_decrease = time.monotonic()
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def _backoff(self, attempt: int) -> float:
+        """带完全抖动的指数退避"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def run(self, fn: Callable[[], T]) -> T:
+        """按调度规则执行一次请求，429/5xx 时重试；其余错误与重试耗尽时抛出最后一次的异常
+
+        排队与退避的总时长不超过 max_wait，也不超过当前录音的剩余时间；录音被取消时立即停止等待。
+        """
+        deadline = time.monotonic() + self.max_wait
+        utterance = current_deadline()
+        if utterance is not None and utterance.expires_at is not None:
+            deadline = min(deadline, utterance.expires_at)
+        # 录音被取消时唤醒正在等待并发名额的线程
+        remove_hook = utterance.on_cancel(self._wake) if utterance is not None else None
+        try:
+            return self._run(fn, deadline, utterance)
+        finally:
+            if remove_hook is not None:
+                remove_hook()
+
+    def _run(self, fn: Callable[[], T], deadline: float, utterance) -> T:
+        with self._cond:
+            self._stats["requests"] += 1
+        attempt = 0
+        while True:
+            wall_start = time.time()
+            try:
+                waited = self._acquire(deadline, utterance)
+            except TimeoutError:
+                with self._cond:
+                    self._stats["gave_up"] += 1
+                raise
+            if waited > 0.001:
+                record_span("queue", wall_start, waited, provider=self.name)
+            with self._cond:
+                self._stats["attempts"] += 1
+                self._stats["queue_wait"] += waited
+                self._stats["max_queue_wait"] = max(self._stats["max_queue_wait"], waited)
+
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self._release()
+                status = classify_error(e)
+                if status is None:
+                    raise
+                retry_after = retry_after_seconds(getattr(e, "response", None))
+                self._on_congestion(started, retry_after)
+                with self._cond:
+                    self._stats["throttled" if status == 429 else "server_errors"] += 1
+                if attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["gave_up"] += 1
+                    raise
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                if time.monotonic() + delay >= deadline or (utterance is not None and utterance.done):
+                    with self._cond:
+                        self._stats["gave_up"] += 1
+                    raise
+                attempt += 1
+                with self._cond:
+                    self._stats["retries"] += 1
+                log.warning(f"⏳ {self.name} 返回 {status}，{delay:.1f}s 后重试（第 {attempt} 次，并发上限 {self.limit}）",
+                            provider=self.name, status=status, delay=round(delay, 3), attempt=attempt)
+                if retry_after is None:
+                    if utterance is not None:
+                        utterance.wait(delay)
+                    else:
+                        time.sleep(delay)
+                continue
+            self._release()
+            self._on_success()
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["concurrency_limit"] = self.limit
+            stats["in_flight"] = self._in_flight
+            stats["paused_for"] = max(0.0, self._paused_until - time.monotonic())
+        stats["rpm"] = self.rpm
+        stats["avg_queue_wait"] = stats["queue_wait"] / stats["attempts"] if stats["attempts"] else 0.0
+        return stats
+
+
+class RequestScheduler:
+    """按提供商分配调度器，配置读取 <NAME>_RPM 与 <NAME>_MAX_CONCURRENCY（NAME 为提供商名的大写）"""
+
+    def __init__(self, enabled: bool = None):
+        """初始化请求调度
+
+        Args:
+            enabled: 是否启用调度，默认读取 RATE_LIMIT_ENABLED；关闭时请求直接执行
+        """
+        if enabled is None:
+            enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        self.max_retries = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "4"))
+        self.max_wait = float(os.getenv("RATE_LIMIT_MAX_WAIT", "60"))
+        self.backoff_base = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "0.5"))
+        self._schedulers: Dict[str, ProviderScheduler] = {}
+        self._lock = threading.Lock()
+
+    def for_provider(self, name: str) -> ProviderScheduler:
+        """获取提供商的调度器（同名提供商共享同一个账户额度）"""
+        key = name.lower()
+        with self._lock:
+            scheduler = self._schedulers.get(key)
+            if scheduler is None:
+                prefix = "".join(c if c.isalnum() else "_" for c in name.upper())
+                rpm = float(os.getenv(f"{prefix}_RPM", str(DEFAULT_RPM.get(key, 0))))
+                concurrency = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "4"))
+                scheduler = self._schedulers[key] = ProviderScheduler(
+                    name, rpm=rpm, max_concurrency=concurrency, max_retries=self.max_retries,
+                    backoff_base=self.backoff_base, max_wait=self.max_wait)
+            return scheduler
+
+    def run(self, name: str, fn: Callable[[], T]) -> T:
+        """通过提供商的调度器执行请求"""
+        if not self.enabled:
+            return fn()
+        return self.for_provider(name).run(fn)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各提供商的请求、重试、限流次数与排队时长"""
+        with self._lock:
+            schedulers = dict(self._schedulers)
+        return {scheduler.name: scheduler.get_stats() for scheduler in schedulers.values()}
@@ -0,0 +1,245 @@
+"""
+请求合并模块
+连续快速口述时，同时在等待的多段短录音用静音间隔拼接为一次上传，
+再按返回的分段与词级时间戳拆回各段录音的结果，减少请求次数与限流额度的消耗
+"""
+
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+import numpy as np
+
+from audio_processing import AudioData, EncodedAudio
+from streaming import join_texts
+from deadline import DeadlineError, current_deadline
+from tracing import span
+from structured_logging import get_logger
+
+log = get_logger("coalescing")
+
+
+class _Clip:
+    """等待合并的一段录音"""
+
+    def __init__(self, audio: Union[AudioData, EncodedAudio]):
+        # 单独发送时直接使用已编码的音频，拼接时使用原始 PCM
+        self.audio = audio
+        self.source = audio.source if isinstance(audio, EncodedAudio) else audio
+        self.deadline = current_deadline()
+        self.arrived_at = time.monotonic()
+        self.done = False
+        self.text = ""
+        # 合并请求失败或无法拆分时由各自的线程单独转录
+        self.fallback = False
+
+
+class RequestCoalescer:
+    """短录音请求合并
+
+    没有其他请求在进行或排队时直接单独发送，不增加等待；已有请求在进行时，新到的短录音最多等待
+    max_wait 秒，与同时到达的录音一起（至多 max_batch 段）合并为一次请求。
+    第一段进入队列的录音所在线程负责发送合并请求，其余线程等待结果。
+    落在单段录音内的分段整段归属该录音；模型常把短暂停顿前后的话合成一个分段，跨越录音边界的分段
+    按词级时间戳逐词拆分。跨越边界的分段缺少词级时间戳、或返回了文本却没有分段时，各段退回单独请求。
+    """
+
+    def __init__(self, manager, max_batch: int = None, max_wait: float = None, max_clip: float = None,
+                 gap: float = None):
+        """初始化请求合并
+
+        Args:
+            manager: TranscriptionManager 实例
+            max_batch: 一次请求最多合并的录音段数，默认读取 COALESCE_MAX_BATCH
+            max_wait: 为等待合并最多增加的延迟（秒），默认读取 COALESCE_MAX_WAIT
+            max_clip: 不超过该时长（秒）的录音才参与合并，默认读取 COALESCE_MAX_CLIP
+            gap: 拼接时插入的静音间隔（秒），默认读取 COALESCE_GAP
+        """
+        self.manager = manager
+        self.max_batch = max(2, max_batch or int(os.getenv("COALESCE_MAX_BATCH", "4")))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("COALESCE_MAX_WAIT", "0.3"))
+        self.max_clip = max_clip or float(os.getenv("COALESCE_MAX_CLIP", "5"))
+        self.gap = gap if gap is not None else float(os.getenv("COALESCE_GAP", "1.0"))
+        self._pending: List[_Clip] = []
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._stats = {"clips": 0, "batches": 0, "batched_clips": 0, "requests_saved": 0,
+                       "fallbacks": 0, "waits": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+    def _uses_timestamps(self) -> bool:
+        """所有候选提供商都是返回分段时间戳的远程服务时才合并（本地推理没有请求开销）"""
+        providers = self.manager.providers + ([self.manager.hedge_provider] if self.manager.hedge_provider else [])
+        return all(getattr(provider, "supports_segments", False) and not provider.accepts_pcm
+                   for provider in providers)
+
+    def should_coalesce(self, audio) -> bool:
+        return audio.duration <= self.max_clip and self._uses_timestamps()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def transcribe(self, audio: Union[AudioData, EncodedAudio]) -> Tuple[str, float]:
+        """转录一段短录音，可能与同时等待的录音合并为一次请求
+
+        Returns:
+            tuple: (文本, 从调用开始的耗时，包含等待合并的时间)
+        """
+        start_time = time.time()
+        clip = _Clip(audio)
+        with self._cond:
+            self._stats["clips"] += 1
+            alone = not self._pending and self._in_flight == 0
+            if alone:
+                self._in_flight += 1
+            else:
+                self._pending.append(clip)
+                self._cond.notify_all()
+
+        if alone:
+            try:
+                text, _, _ = self.manager.transcribe_verbose(audio)
+            finally:
+                self._finish_request()
+            return text, time.time() - start_time
+
+        remove_hook = clip.deadline.on_cancel(self._wake) if clip.deadline is not None else None
+        try:
+            with span("coalesce"):
+                batch = self._wait(clip)
+        finally:
+            if remove_hook is not None:
+                remove_hook()
+        if batch is not None:
+            self._send(batch)
+        if clip.fallback:
+            text, _, _ = self.manager.transcribe_verbose(audio)
+            return text, time.time() - start_time
+        return clip.text, time.time() - start_time
+
+    def _wait(self, clip: _Clip) -> Optional[List[_Clip]]:
+        """等待合并：排在队首时负责凑批并返回这一批，否则等待队首的线程送回结果"""
+        with self._cond:
+            while not clip.done:
+                if clip.deadline is not None and clip.deadline.done:
+                    if clip in self._pending:
+                        self._pending.remove(clip)
+                        self._cond.notify_all()
+                    clip.deadline.check()
+                if self._pending and self._pending[0] is clip:
+                    batch = self._compatible(clip)
+                    waited = time.monotonic() - clip.arrived_at
+                    if len(batch) >= self.max_batch or waited >= self.max_wait:
+                        for member in batch:
+                            self._pending.remove(member)
+                        self._in_flight += 1
+                        self._stats["waits"] += 1
+                        self._stats["total_wait"] += waited
+                        self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+                        # 剩下的录音由新的队首接着凑批
+                        self._cond.notify_all()
+                        return batch
+                    self._cond.wait(self.max_wait - waited)
+                else:
+                    self._cond.wait()
+        return None
+
+    def _compatible(self, head: _Clip) -> List[_Clip]:
+        """队列中可与队首拼接的录音（采样率、声道与数据类型相同），至多 max_batch 段"""
+        key = (head.source.sample_rate, head.source.channels, head.source.dtype)
+        return [clip for clip in self._pending
+                if (clip.source.sample_rate, clip.source.channels, clip.source.dtype) == key][:self.max_batch]
+
+    def _finish_request(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _send(self, batch: List[_Clip]):
+        """发送一批录音（只有一段时即单独请求），把拆分结果交给各自的线程"""
+        results = None
+        try:
+            if len(batch) == 1:
+                text, _, _ = self.manager.transcribe_verbose(batch[0].audio)
+                results = [text]
+            else:
+                combined, bounds = self.concatenate([clip.source for clip in batch])
+                log.info(f"📦 合并 {len(batch)} 段短录音为一次请求（{combined.duration:.1f}s）", clips=len(batch))
+                # 合并请求受发送线程所属录音的截止时间约束；中止时其余录音改为单独请求
+                # 只有合并请求需要词级时间戳，用来拆分跨越录音边界的分段
+                text, _, segments = self.manager.transcribe_verbose(combined, word_timestamps=True)
+                results = self.split(text, segments, bounds)
+                if results is None:
+                    log.warning(f"⚠️ 合并结果无法按时间戳拆分，{len(batch)} 段录音改为单独请求")
+        except DeadlineError:
+            pass
+        except Exception as e:
+            log.error(f"❌ 合并请求异常: {e}")
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                if len(batch) > 1:
+                    if results is not None:
+                        self._stats["batches"] += 1
+                        self._stats["batched_clips"] += len(batch)
+                        self._stats["requests_saved"] += len(batch) - 1
+                    else:
+                        self._stats["fallbacks"] += 1
+                for index, clip in enumerate(batch):
+                    if results is None:
+                        clip.fallback = True
+                    else:
+                        clip.text = results[index]
+                    clip.done = True
+                self._cond.notify_all()
+
+    def concatenate(self, clips: List[AudioData]) -> Tuple[AudioData, List[Tuple[float, float]]]:
+        """用静音间隔拼接录音，返回拼接后的音频与各段的 (起点, 终点) 秒数"""
+        first = clips[0]
+        gap = np.zeros((int(self.gap * first.sample_rate),) + first.samples.shape[1:], dtype=first.dtype)
+        pieces, bounds, position = [], [], 0
+        for index, clip in enumerate(clips):
+            if index:
+                pieces.append(gap)
+                position += len(gap)
+            pieces.append(clip.samples)
+            bounds.append((position / first.sample_rate, (position + clip.num_frames) / first.sample_rate))
+            position += clip.num_frames
+        return AudioData(np.concatenate(pieces), first.sample_rate), bounds
+
+    def split(self, text: str, segments: List[Dict[str, Any]],
+              bounds: List[Tuple[float, float]]) -> Optional[List[str]]:
+        """按时间戳把文本分回各段录音；跨越录音边界的分段按词的中点拆分，无法拆分时返回 None"""
+        if not segments:
+            return [""] * len(bounds) if not text.strip() else None
+        # 每段录音负责的区间延伸到两侧静音间隔的中点
+        edges = [(bounds[i][1] + bounds[i + 1][0]) / 2 for i in range(len(bounds) - 1)]
+
+        def owner(start: float, end: float) -> int:
+            middle = (start + end) / 2
+            return sum(1 for edge in edges if middle >= edge)
+
+        tolerance = self.gap / 2
+        parts: List[List[str]] = [[] for _ in bounds]
+        for segment in segments:
+            start, end = float(segment["start"]), float(segment["end"])
+            index = owner(start, end)
+            clip_start, clip_end = bounds[index]
+            if clip_start - tolerance <= start and end <= clip_end + tolerance:
+                # 整段落在一段录音内时保留分段原文（含标点）
+                parts[index].append(segment["text"])
+                continue
+            words = segment.get("words")
+            if not words:
+                return None
+            for word in words:
+                parts[owner(float(word["start"]), float(word["end"]))].append(word["text"].strip())
+        return [join_texts(part) for part in parts]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """合并统计：参与合并的录音数、合并请求数与节省的请求数"""
+        with self._cond:
+            stats = dict(self._stats)
+        stats["avg_wait"] = stats["total_wait"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
@@ -5,21 +5,69 @@
 
 from abc import ABC, abstractmethod
 import os
+import threading
 import time
 import requests
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, Union, List
 from dotenv import load_dotenv
+from http_transport import HTTPTransport, get_default_transport, upload_throughput
+from audio_processing import AudioData, AudioEncoder, EncodedAudio
+from provider_routing import LatencyTracker, ProviderRouter, provider_label
+from transcription_cache import TranscriptionCache
+from rate_limit import QueueTimeout, RequestScheduler
+from chunked_transcription import ChunkedTranscriber
+from request_coalescing import RequestCoalescer
+from tracing import span, bind
+from deadline import Deadline, DeadlineError, Cancelled, check_deadline, current_deadline, deadline_scope
+from structured_logging import get_logger
 
 load_dotenv()
 
+log = get_logger("transcription")
+
 
 class TranscriptionProvider(ABC):
     """语音转录提供商的抽象基类"""
     
+    # 提供商接受的上传格式，编码阶段会在其中选择体积最小的一种
+    supported_formats = ("wav",)
+    # 是否能返回分段时间戳（长录音重叠分块去重依赖它）
+    supports_segments = False
+    # 是否直接接受内存 PCM（本地推理），为 True 时不为它编码
+    accepts_pcm = False
+    
     @abstractmethod
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False) -> tuple[str, float]:
+        """
+        转录内存中的音频
+        
+        Args:
+            audio: 内存音频对象（PCM 缓冲、采样率、数据类型），或已编码的上传音频
+            raise_errors: 失败时抛出异常而不是返回空文本，便于调用方区分失败与无内容
+            
+        Returns:
+            tuple: (转录文本, 转录耗时)
+        """
+        pass
+    
+    def transcribe_verbose(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False,
+                           word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """
+        转录并返回分段时间戳，不支持分段的提供商返回空列表
+        
+        Args:
+            word_timestamps: 同时请求词级时间戳（写入各分段的 words），不支持的提供商忽略
+        
+        Returns:
+            tuple: (转录文本, 转录耗时, [{"start": 秒, "end": 秒, "text": 文本}, ...])
+        """
+        text, inference_time = self.transcribe_audio(audio, raise_errors=raise_errors)
+        return text, inference_time, []
+    
     def transcribe(self, audio_path: str) -> tuple[str, float]:
         """
-        转录音频文件
+        转录音频文件（读入内存后交给 transcribe_audio）
         
         Args:
             audio_path: 音频文件路径
@@ -27,23 +75,31 @@ class TranscriptionProvider(ABC):
         Returns:
             tuple: (转录文本, 转录耗时)
         """
-        pass
+        return self.transcribe_audio(AudioData.from_file(audio_path))
     
     @abstractmethod
     def is_configured(self) -> bool:
         """检查提供商是否已正确配置"""
         pass
+    
+    def warm_up(self):
+        """预热到提供商的网络连接，默认无操作"""
+        pass
 
 
 class SiliconFlowProvider(TranscriptionProvider):
     """SiliconFlow 语音转录提供商"""
     
-    def __init__(self, api_url: str = None, api_token: str = None, model: str = None):
+    supported_formats = ("opus", "flac", "wav")
+    
+    def __init__(self, api_url: str = None, api_token: str = None, model: str = None,
+                 transport: HTTPTransport = None):
         self.api_url = api_url or os.getenv("SILICONFLOW_API_URL", "https://api.siliconflow.cn/v1/audio/transcriptions")
         self.api_token = api_token or os.getenv("SILICONFLOW_API_KEY")
         self.model = model or os.getenv("SILICONFLOW_MODEL", "FunAudioLLM/SenseVoiceSmall")
+        self.transport = transport or get_default_transport()
     
-    def transcribe(self, audio_path: str) -> tuple[str, float]:
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False) -> tuple[str, float]:
         """使用 SiliconFlow API 转录音频"""
         if not self.is_configured():
             raise ValueError("SiliconFlow API 未配置，请设置 SILICONFLOW_API_KEY")
@@ -52,41 +108,60 @@ class SiliconFlowProvider(TranscriptionProvider):
             "Authorization": f"Bearer {self.api_token}",
         }
         
-        print("📝 转录中...")
+        log.info("📝 转录中...", provider="SiliconFlow")
         start_time = time.time()
         
         try:
-            with open(audio_path, "rb") as audio_file:
-                files = {"file": audio_file}
-                data = {"model": self.model}
-                response = requests.post(self.api_url, headers=headers, files=files, data=data)
+            files = {"file": audio.to_upload()}
+            data = {"model": self.model}
+            response = self.transport.post(self.api_url, headers=headers, files=files, data=data)
             
             inference_time = time.time() - start_time
             response.raise_for_status()
             
-            result = response.json()
-            text = result.get("text", "")
-            print(f"✅ 转录结果: {text}")
+            with span("parse"):
+                result = response.json()
+                text = result.get("text", "")
+            log.info(f"✅ 转录结果: {text}", provider="SiliconFlow", duration=round(inference_time, 3),
+                     connection_reused=response.reused)
+            if response.reused is not None:
+                log.debug(f"🔗 连接复用: {'是' if response.reused else '否（新建连接）'}")
             return text, inference_time
             
+        except DeadlineError as e:
+            log.warning(f"⏹️ 转录中止: {e}", provider="SiliconFlow", duration=round(time.time() - start_time, 3))
+            if raise_errors:
+                raise
+            return "", time.time() - start_time
+        
         except requests.exceptions.RequestException as e:
             inference_time = time.time() - start_time
             error_msg = f"API 请求失败: {e}"
-            print(f"❌ {error_msg}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"响应内容: {e.response.text}")
+            status = e.response.status_code if getattr(e, "response", None) is not None else None
+            log.error(f"❌ {error_msg}", provider="SiliconFlow", duration=round(inference_time, 3),
+                      status=status)
+            if status is not None:
+                log.error(f"响应内容: {e.response.text}", status=status)
+            if raise_errors:
+                raise
             return "", inference_time
         
         except Exception as e:
             inference_time = time.time() - start_time
             error_msg = f"转录异常: {e}"
-            print(f"❌ {error_msg}")
+            log.error(f"❌ {error_msg}", provider="SiliconFlow", error=type(e).__name__)
+            if raise_errors:
+                raise
             return "", inference_time
     
     def is_configured(self) -> bool:
         """检查 SiliconFlow 是否已配置"""
         return bool(self.api_token)
     
+    def warm_up(self):
+        """预热到 SiliconFlow 的连接"""
+        self.transport.warm_up([self.api_url])
+    
     def get_info(self) -> Dict[str, Any]:
         """获取提供商信息"""
         return {
@@ -100,36 +175,390 @@ class SiliconFlowProvider(TranscriptionProvider):
 class TranscriptionManager:
     """语音转录管理器"""
     
-    def __init__(self, provider: TranscriptionProvider = None):
+    def __init__(self, provider: TranscriptionProvider = None, encoder: AudioEncoder = None,
+                 hedge_provider: TranscriptionProvider = None, hedge_percentile: float = None,
+                 providers: List[TranscriptionProvider] = None, cache: TranscriptionCache = None,
+                 scheduler: RequestScheduler = None):
         """初始化转录管理器
         
         Args:
             provider: 语音转录提供商，默认使用 SiliconFlow
+            encoder: 上传编码器，默认按 UPLOAD_FORMATS 配置
+            hedge_provider: 对冲提供商，主提供商超过对冲延迟仍未返回时并发请求它
+            hedge_percentile: 对冲延迟取主提供商历史延迟的百分位，默认读取 HEDGE_PERCENTILE
+            providers: 参与路由的全部提供商（可包含 provider），多于一个时按实时健康状况为每个请求选择
+            cache: 转录缓存，默认按 TRANSCRIPTION_CACHE 配置创建
+            scheduler: 请求调度（限速、自适应并发与限流重试），默认按 RATE_LIMIT_ENABLED 配置创建
         """
-        self.provider = provider or SiliconFlowProvider()
+        self.provider = provider or (providers[0] if providers else SiliconFlowProvider())
+        self.providers = [self.provider] + [p for p in (providers or []) if p is not self.provider]
+        self.router = ProviderRouter(self.providers) if len(self.providers) > 1 else None
+        self.encoder = encoder or AudioEncoder(upload_throughput=upload_throughput)
+        if cache is None and os.getenv("TRANSCRIPTION_CACHE", "true").lower() in ("1", "true", "yes"):
+            cache = TranscriptionCache()
+        self.cache = cache
+        self.scheduler = scheduler or RequestScheduler()
+        # 超过阈值的长录音切分为重叠分块并发转录
+        self.chunker = None
+        if os.getenv("LONG_AUDIO_CHUNKING", "true").lower() in ("1", "true", "yes"):
+            self.chunker = ChunkedTranscriber(self)
+        # 同时等待的短录音合并为一次请求（需要提供商返回分段时间戳）
+        self.coalescer = None
+        if os.getenv("COALESCE_ENABLED", "false").lower() in ("1", "true", "yes"):
+            self.coalescer = RequestCoalescer(self)
+        self.hedge_provider = hedge_provider
+        self.hedge_percentile = hedge_percentile or float(os.getenv("HEDGE_PERCENTILE", "95"))
+        # 历史样本不足时使用的固定对冲延迟，以及对冲延迟下限（秒）
+        self.hedge_default_delay = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+        self.hedge_min_delay = float(os.getenv("HEDGE_MIN_DELAY", "0.3"))
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="transcribe")
+        self._stats_lock = threading.Lock()
+        # 当前线程最近一次转录实际使用的提供商（路由、对冲与失败切换后）
+        self._local = threading.local()
+        self._hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "latency_saved": 0.0}
         
         # 验证提供商配置
         if not self.provider.is_configured():
-            print(f"⚠️ 语音转录提供商未配置: {self.provider.__class__.__name__}")
+            log.warning(f"⚠️ 语音转录提供商未配置: {self.provider.__class__.__name__}")
     
     def set_provider(self, provider: TranscriptionProvider):
-        """设置转录提供商"""
+        """设置转录提供商（关闭多提供商路由）"""
         self.provider = provider
+        self.providers = [provider]
+        self.router = None
         if not self.provider.is_configured():
-            print(f"⚠️ 新提供商未配置: {provider.__class__.__name__}")
+            log.warning(f"⚠️ 新提供商未配置: {provider.__class__.__name__}")
     
-    def transcribe(self, audio_path: str) -> tuple[str, float]:
+    def set_hedge_provider(self, provider: Optional[TranscriptionProvider]):
+        """设置对冲提供商，传入 None 关闭对冲"""
+        self.hedge_provider = provider
+        if provider is not None and not provider.is_configured():
+            log.warning(f"⚠️ 对冲提供商未配置: {provider.__class__.__name__}")
+    
+    def transcribe(self, audio_path: str, bypass_cache: bool = False) -> tuple[str, float]:
         """转录音频文件"""
+        return self.transcribe_audio(AudioData.from_file(audio_path), bypass_cache=bypass_cache)
+    
+    def encode(self, audio: AudioData) -> EncodedAudio:
+        """按提供商接受的格式编码音频；启用路由时选择所有提供商都接受的格式，路由后无需重新编码
+        
+        只有本地推理（接受 PCM）的提供商时不编码，直接返回原始音频。
+        """
+        upload_providers = [provider for provider in self.providers + ([self.hedge_provider] if self.hedge_provider else [])
+                            if not provider.accepts_pcm]
+        if not upload_providers:
+            return audio
+        formats = set(upload_providers[0].supported_formats)
+        for provider in upload_providers[1:]:
+            formats &= set(provider.supported_formats)
+        return self.encoder.encode(audio, formats or upload_providers[0].supported_formats)
+    
+    def _prepare(self, provider: TranscriptionProvider, audio: Union[AudioData, EncodedAudio]) -> EncodedAudio:
+        """把音频编码为该提供商接受的格式，已编码且格式合适时直接复用；接受 PCM 的提供商直接使用原始音频"""
+        if provider.accepts_pcm:
+            return audio.source if isinstance(audio, EncodedAudio) else audio
+        if isinstance(audio, EncodedAudio):
+            if audio.format in provider.supported_formats:
+                return audio
+            audio = audio.source
+        return self.encoder.encode(audio, provider.supported_formats)
+    
+    def _call(self, provider: TranscriptionProvider, audio: Union[AudioData, EncodedAudio],
+              word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """调用单个提供商，记录延迟与健康状况；限流与服务端错误由调度器重试，最终失败时抛出异常
+        
+        记录的延迟只包含最后一次成功的请求，排队与退避时间单独计入调度统计。
+        """
+        prepared = self._prepare(provider, audio)
+        start_time = time.time()
+        
+        # 只在需要时传入 word_timestamps，兼容未声明该参数的自定义提供商
+        options = {"word_timestamps": True} if word_timestamps else {}
+        
+        def attempt():
+            attempt_start = time.time()
+            with span("request", provider=provider_label(provider)):
+                result = provider.transcribe_verbose(prepared, raise_errors=True, **options)
+            return result, time.time() - attempt_start
+        
+        # 半开熔断器的试探名额只在真正发出请求时占用，无论结果如何都在结束时归还
+        trial = self.router is not None and self.router.acquire(provider)
+        try:
+            (text, inference_time, segments), latency = self.scheduler.run(self._scheduler_name(provider), attempt)
+        except (Cancelled, QueueTimeout):
+            # 用户取消、在调度器中排队超时（请求没有发出）都与提供商的健康状况无关
+            raise
+        except Exception:
+            if self.router is not None:
+                self.router.record_failure(provider, time.time() - start_time)
+            raise
+        finally:
+            if trial:
+                self.router.release(provider)
+        self.latency.record(provider, latency)
+        if self.router is not None:
+            self.router.record_success(provider, latency, prepared.duration)
+        return text, inference_time, segments
+    
+    @staticmethod
+    def _scheduler_name(provider: TranscriptionProvider) -> str:
+        """调度器按提供商名称区分（同一账户的额度由同名提供商共享）"""
+        try:
+            return provider.get_info()["name"]
+        except Exception:
+            return provider.__class__.__name__
+    
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], bypass_cache: bool = False) -> tuple[str, float]:
+        """转录内存中的音频，未编码的音频会先经过编码阶段
+        
+        Args:
+            audio: 内存音频或已编码的上传音频
+            bypass_cache: 跳过转录缓存，强制重新请求（结果仍会写入缓存）
+        """
+        self._local.provider = None
+        self._local.failed = False
         if not self.provider.is_configured():
-            print("❌ 语音转录提供商未配置")
+            log.error("❌ 语音转录提供商未配置")
+            self._local.failed = True
             return "", 0.0
+        check_deadline()
+        
+        if self.cache is None:
+            return self._transcribe_full(audio)
+        
+        key = self.cache_key(audio)
+        if bypass_cache:
+            self.cache.record_bypass()
+        else:
+            cached = self.cache.get(key)
+            if cached is not None:
+                log.info(f"💾 命中转录缓存: {cached}", provider="cache")
+                self._local.provider = "cache"
+                return cached, 0.0
+        
+        text, inference_time = self._transcribe_full(audio)
+        self.cache.put(key, text)
+        return text, inference_time
+    
+    def needs_chunking(self, audio: Union[AudioData, EncodedAudio]) -> bool:
+        """录音是否足够长，需要分块并发转录"""
+        return self.chunker is not None and self.chunker.should_chunk(audio)
+    
+    def _transcribe_full(self, audio: Union[AudioData, EncodedAudio]) -> tuple[str, float]:
+        """长录音分块并发转录，短录音可能与同时等待的录音合并请求，其余直接转录"""
+        if self.needs_chunking(audio):
+            source = audio.source if isinstance(audio, EncodedAudio) else audio
+            return self.chunker.transcribe(source)
+        if self.coalescer is not None and self.coalescer.should_coalesce(audio):
+            return self.coalescer.transcribe(audio)
+        text, inference_time, _ = self._transcribe_uncached(audio)
+        return text, inference_time
+    
+    def transcribe_verbose(self, audio: Union[AudioData, EncodedAudio],
+                           word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """转录并返回分段时间戳（不经过缓存与分块），提供商不支持分段时返回空列表
+        
+        word_timestamps 为 True 时同时请求词级时间戳（只有合并请求需要按词拆分结果）。
+        """
+        if not self.provider.is_configured():
+            log.error("❌ 语音转录提供商未配置")
+            self._local.failed = True
+            return "", 0.0, []
+        return self._transcribe_uncached(audio, word_timestamps)
+    
+    def cache_key(self, audio: Union[AudioData, EncodedAudio]) -> str:
+        """转录缓存键：PCM 内容 + 提供商、模型与请求参数"""
+        source = audio.source if isinstance(audio, EncodedAudio) else audio
+        config = []
+        for provider in self.providers + ([self.hedge_provider] if self.hedge_provider else []):
+            info = {key: value for key, value in provider.get_info().items() if key != "configured"}
+            info["class"] = provider.__class__.__name__
+            config.append(info)
+        return TranscriptionCache.make_key(source, config)
+    
+    def _transcribe_uncached(self, audio: Union[AudioData, EncodedAudio],
+                             word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """路由、对冲与失败切换"""
+        if self.router is not None:
+            candidates = [p for p in self.router.rank(audio.duration) if p.is_configured()] or [self.provider]
+        else:
+            candidates = [self.provider]
+        primary = candidates[0]
+        
+        hedge = self.hedge_provider
+        if hedge is primary:
+            hedge = candidates[1] if len(candidates) > 1 else None
+        if hedge is not None and hedge.is_configured():
+            return self._transcribe_hedged(audio, primary, hedge, word_timestamps)
+        
+        # 未启用对冲：按路由顺序依次尝试，主提供商失败时切换到下一个
+        start_time = time.time()
+        for provider in candidates:
+            try:
+                text, _, segments = self._call(provider, audio, word_timestamps)
+                self._local.provider = provider
+                self._local.failed = False
+                return text, time.time() - start_time, segments
+            except DeadlineError:
+                # 录音已到期或被取消，不再切换提供商
+                raise
+            except Exception:
+                if provider is not candidates[-1]:
+                    log.warning("🔁 提供商请求失败，切换到下一个提供商...", provider=provider_label(provider))
+        self._local.failed = True
+        return "", time.time() - start_time, []
+    
+    def get_hedge_delay(self, provider: TranscriptionProvider = None) -> float:
+        """对冲延迟：主提供商近期延迟的百分位，样本不足时使用固定值"""
+        delay = self.latency.percentile(provider or self.provider, self.hedge_percentile)
+        if delay is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, delay)
+    
+    def _transcribe_hedged(self, audio: Union[AudioData, EncodedAudio], primary_provider: TranscriptionProvider,
+                           hedge_provider: TranscriptionProvider,
+                           word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """对冲请求：主提供商超过对冲延迟未返回（或已失败）时并发请求对冲提供商，取先成功的结果
+        
+        每个请求使用从录音截止时间派生的子截止时间，一方成功后取消另一方：
+        尚未开始的请求不再发出，已发出的请求中断连接，不再占用并发名额与限流额度。
+        """
+        start_time = time.time()
+        delay = self.get_hedge_delay(primary_provider)
+        with self._stats_lock:
+            self._hedge_stats["requests"] += 1
         
-        return self.provider.transcribe(audio_path)
+        utterance = current_deadline()
+        deadlines = {}
+        
+        def submit(provider):
+            deadline = utterance.child() if utterance is not None else Deadline(None)
+            future = self._executor.submit(self._call_within, deadline, bind(self._call), provider, audio,
+                                           word_timestamps)
+            deadlines[future] = deadline
+            return future
+        
+        try:
+            primary = submit(primary_provider)
+            done, _ = wait([primary], timeout=delay)
+            if done and self._result_text(primary):
+                text, _, segments = primary.result()
+                self._local.provider = primary_provider
+                self._local.failed = False
+                return text, time.time() - start_time, segments
+            
+            if done:
+                log.warning("🔀 主提供商转录失败，改用对冲提供商...", provider=provider_label(hedge_provider))
+            else:
+                log.info(f"🔀 主提供商 {delay:.2f}s 内未返回，发起对冲请求...", provider=provider_label(hedge_provider),
+                         hedge_delay=round(delay, 3))
+            hedge = submit(hedge_provider)
+            with self._stats_lock:
+                self._hedge_stats["hedged"] += 1
+            
+            pending = {primary, hedge}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    text = self._result_text(future)
+                    if not text:
+                        continue
+                    for other in pending:
+                        other.cancel()
+                        deadlines[other].cancel("对冲请求已由另一个提供商完成")
+                    if future is hedge:
+                        self._record_hedge_win(primary_provider, time.time() - start_time)
+                    self._local.provider = hedge_provider if future is hedge else primary_provider
+                    self._local.failed = False
+                    return text, time.time() - start_time, future.result()[2]
+            
+            check_deadline()
+            # 两个请求都没有文本：至少一个正常返回时是「无内容」，否则是失败
+            self._local.failed = all(future.cancelled() or future.exception() is not None
+                                     for future in (primary, hedge))
+            return "", time.time() - start_time, []
+        finally:
+            for deadline in deadlines.values():
+                deadline.release()
+    
+    @staticmethod
+    def _call_within(deadline: Deadline, fn, *args):
+        with deadline_scope(deadline):
+            return fn(*args)
+    
+    @staticmethod
+    def _result_text(future) -> str:
+        try:
+            return future.result()[0]
+        except Exception:
+            # 提供商已输出错误信息
+            return ""
+    
+    def _record_hedge_win(self, primary_provider: TranscriptionProvider, elapsed: float):
+        """对冲请求胜出：落后的主请求已被取消，节省的延迟按主提供商近期的延迟中位数估算"""
+        expected = self.latency.percentile(primary_provider, 50, min_samples=3)
+        with self._stats_lock:
+            self._hedge_stats["hedge_wins"] += 1
+            if expected is not None:
+                self._hedge_stats["latency_saved"] += max(0.0, expected - elapsed)
+    
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """获取对冲统计：对冲率、对冲胜出次数与累计节省的延迟"""
+        with self._stats_lock:
+            stats = dict(self._hedge_stats)
+        stats["hedge_rate"] = stats["hedged"] / stats["requests"] if stats["requests"] else 0.0
+        stats["hedge_delay"] = self.get_hedge_delay()
+        return stats
+    
+    def get_coalescing_stats(self) -> Optional[Dict[str, Any]]:
+        """获取请求合并统计，未启用时返回 None"""
+        return self.coalescer.get_stats() if self.coalescer is not None else None
+    
+    def last_failed(self) -> bool:
+        """当前线程最近一次转录是否因请求失败而没有结果，用于区分失败与录音中没有内容"""
+        return getattr(self._local, "failed", False)
+    
+    def mark_failed(self):
+        """在其他线程发出请求的转录路径（如分块转录）用它把失败记到调用线程"""
+        self._local.failed = True
+    
+    def last_provider_info(self) -> Optional[Dict[str, Any]]:
+        """当前线程最近一次 transcribe_audio 实际使用的提供商信息；命中缓存时 name 为 cache，
+        分块转录等无法确定单一提供商时返回主提供商信息"""
+        provider = getattr(self._local, "provider", None)
+        if provider == "cache":
+            return {"name": "cache", "model": None}
+        return (provider or self.provider).get_info()
+    
+    def get_scheduler_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各提供商的调度统计：请求与重试次数、限流次数、并发上限与排队时长"""
+        return self.scheduler.get_stats()
     
     def get_provider_info(self) -> Dict[str, Any]:
         """获取当前提供商信息"""
         return self.provider.get_info()
     
+    def get_routing_info(self) -> Dict[str, Any]:
+        """获取路由状态：各提供商健康状况与最近的路由决策"""
+        if self.router is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "health": self.router.get_health(),
+            "decisions": self.router.get_decisions(),
+        }
+    
+    def warm_up(self):
+        """预热提供商连接，失败不影响后续使用"""
+        for provider in self.providers + [self.hedge_provider]:
+            if provider is None or not provider.is_configured():
+                continue
+            try:
+                provider.warm_up()
+            except Exception as e:
+                log.warning(f"⚠️ 连接预热警告: {e}")
+    
     @classmethod
     def create_siliconflow(cls, api_key: str = None, model: str = None) -> 'TranscriptionManager':
         """工厂方法：创建 SiliconFlow 提供商"""
@@ -142,36 +571,61 @@ class TranscriptionManager:
         return cls()
 
 
-def create_transcription_manager(provider_name: str = "siliconflow", **kwargs) -> TranscriptionManager:
-    """创建转录管理器的工厂函数
+def create_provider(provider_name: str, **kwargs) -> TranscriptionProvider:
+    """创建转录提供商的工厂函数
     
     Args:
-        provider_name: 提供商名称，支持 "siliconflow", "groq"
+        provider_name: 提供商名称，支持 "siliconflow", "groq", "local"
         **kwargs: 提供商配置参数
         
     Returns:
-        TranscriptionManager: 转录管理器实例
+        TranscriptionProvider: 提供商实例
     """
     if provider_name.lower() == "siliconflow":
         if kwargs:
-            provider = SiliconFlowProvider(
+            return SiliconFlowProvider(
                 api_token=kwargs.get("api_key"),
                 model=kwargs.get("model"),
                 api_url=kwargs.get("api_url")
             )
-        else:
-            provider = SiliconFlowProvider()
-        return TranscriptionManager(provider)
+        return SiliconFlowProvider()
+    elif provider_name.lower() == "local":
+        return LocalProvider(model=kwargs.get("model"))
     elif provider_name.lower() == "groq":
-        provider = GroqProvider(
+        return GroqProvider(
             api_key=kwargs.get("api_key"),
-            model=kwargs.get("model", "whisper-large-v3-turbo")
+            model=kwargs.get("model") or os.getenv("GROQ_MODEL", "whisper-large-v3-turbo"),
+            api_url=kwargs.get("api_url")
         )
-        return TranscriptionManager(provider)
     else:
         raise ValueError(f"不支持的提供商: {provider_name}")
 
 
+def create_transcription_manager(provider_name: str = "siliconflow", hedge_provider: str = None,
+                                 routing_providers: List[str] = None, **kwargs) -> TranscriptionManager:
+    """创建转录管理器的工厂函数
+    
+    Args:
+        provider_name: 提供商名称，支持 "siliconflow", "groq", "local"
+        hedge_provider: 对冲提供商名称（使用环境变量中的配置），默认不对冲
+        routing_providers: 额外参与路由的提供商名称（使用环境变量中的配置）
+        **kwargs: 提供商配置参数
+        
+    Returns:
+        TranscriptionManager: 转录管理器实例
+    """
+    provider = create_provider(provider_name, **kwargs)
+    providers = {provider_name.lower(): provider}
+    for name in routing_providers or []:
+        if name.lower() not in providers:
+            providers[name.lower()] = create_provider(name)
+    
+    hedge = None
+    if hedge_provider:
+        hedge = providers.get(hedge_provider.lower()) or create_provider(hedge_provider)
+    return TranscriptionManager(provider, hedge_provider=hedge, providers=list(providers.values()))
+
+
 # 预留其他提供商的扩展接口
 class OpenAIProvider(TranscriptionProvider):
     """OpenAI Whisper 提供商（预留接口）"""
@@ -180,7 +634,7 @@ class OpenAIProvider(TranscriptionProvider):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         self.model = model
     
-    def transcribe(self, audio_path: str) -> tuple[str, float]:
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False) -> tuple[str, float]:
         """使用 OpenAI API 转录音频"""
         # TODO: 实现 OpenAI Whisper API 调用
         raise NotImplementedError("OpenAI 提供商尚未实现")
@@ -199,13 +653,27 @@ class OpenAIProvider(TranscriptionProvider):
 class GroqProvider(TranscriptionProvider):
     """Groq Whisper 提供商"""
     
-    def __init__(self, api_key: str = None, model: str = "whisper-large-v3-turbo"):
-        self.api_url = "https://api.groq.com/openai/v1/audio/transcriptions"
+    supported_formats = ("opus", "flac", "wav")
+    supports_segments = True
+    
+    def __init__(self, api_key: str = None, model: str = "whisper-large-v3-turbo",
+                 transport: HTTPTransport = None, api_url: str = None):
+        self.api_url = api_url or os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/audio/transcriptions")
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
         self.model = model
+        self.transport = transport or get_default_transport()
     
-    def transcribe(self, audio_path: str) -> tuple[str, float]:
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False) -> tuple[str, float]:
         """使用 Groq API 转录音频"""
+        text, inference_time, _ = self.transcribe_verbose(audio, raise_errors=raise_errors)
+        return text, inference_time
+    
+    def transcribe_verbose(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False,
+                           word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """使用 Groq API 转录音频，并返回 verbose_json 中的分段时间戳
+        
+        词级时间戳会增加服务端耗时，只在调用方需要按时间拆分结果（请求合并）时请求。
+        """
         if not self.is_configured():
             raise ValueError("Groq API 未配置，请设置 GROQ_API_KEY")
         
@@ -213,45 +681,86 @@ class GroqProvider(TranscriptionProvider):
             "Authorization": f"Bearer {self.api_key}",
         }
         
-        print("📝 转录中...")
+        log.info("📝 转录中...", provider="Groq")
         start_time = time.time()
         
         try:
-            with open(audio_path, "rb") as audio_file:
-                files = {"file": audio_file}
-                data = {
-                    "model": self.model,
-                    "temperature": 0,
-                    "response_format": "verbose_json"
-                }
-                response = requests.post(self.api_url, headers=headers, files=files, data=data)
+            files = {"file": audio.to_upload()}
+            data = {
+                "model": self.model,
+                "temperature": 0,
+                "response_format": "verbose_json"
+            }
+            if word_timestamps:
+                data["timestamp_granularities[]"] = ["word", "segment"]
+            response = self.transport.post(self.api_url, headers=headers, files=files, data=data)
             
             inference_time = time.time() - start_time
             response.raise_for_status()
             
-            result = response.json()
-            text = result.get("text", "")
-            print(f"✅ 转录结果: {text}")
-            return text, inference_time
+            with span("parse"):
+                result = response.json()
+                text = result.get("text", "")
+                segments = [
+                    {"start": float(segment["start"]), "end": float(segment["end"]), "text": segment.get("text", "")}
+                    for segment in result.get("segments") or []
+                ]
+                self._attach_words(segments, result.get("words") or [])
+            log.info(f"✅ 转录结果: {text}", provider="Groq", duration=round(inference_time, 3),
+                     connection_reused=response.reused)
+            if response.reused is not None:
+                log.debug(f"🔗 连接复用: {'是' if response.reused else '否（新建连接）'}")
+            return text, inference_time, segments
             
+        except DeadlineError as e:
+            log.warning(f"⏹️ 转录中止: {e}", provider="Groq", duration=round(time.time() - start_time, 3))
+            if raise_errors:
+                raise
+            return "", time.time() - start_time, []
+        
         except requests.exceptions.RequestException as e:
             inference_time = time.time() - start_time
             error_msg = f"API 请求失败: {e}"
-            print(f"❌ {error_msg}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"响应内容: {e.response.text}")
-            return "", inference_time
+            status = e.response.status_code if getattr(e, "response", None) is not None else None
+            log.error(f"❌ {error_msg}", provider="Groq", duration=round(inference_time, 3),
+                      status=status)
+            if status is not None:
+                log.error(f"响应内容: {e.response.text}", status=status)
+            if raise_errors:
+                raise
+            return "", inference_time, []
         
         except Exception as e:
             inference_time = time.time() - start_time
             error_msg = f"转录异常: {e}"
-            print(f"❌ {error_msg}")
-            return "", inference_time
+            log.error(f"❌ {error_msg}", provider="Groq", error=type(e).__name__)
+            if raise_errors:
+                raise
+            return "", inference_time, []
+    
+    @staticmethod
+    def _attach_words(segments: List[Dict[str, Any]], words: List[Dict[str, Any]]):
+        """把顶层的词级时间戳按词的中点归入所在分段的 words 列表"""
+        if not segments or not words:
+            return
+        for segment in segments:
+            segment["words"] = []
+        index = 0
+        for word in words:
+            start, end = float(word["start"]), float(word["end"])
+            middle = (start + end) / 2
+            while index + 1 < len(segments) and middle >= segments[index + 1]["start"]:
+                index += 1
+            segments[index]["words"].append({"start": start, "end": end, "text": word.get("word", "")})
     
     def is_configured(self) -> bool:
         """检查 Groq 是否已配置"""
         return bool(self.api_key)
     
+    def warm_up(self):
+        """预热到 Groq 的连接"""
+        self.transport.warm_up([self.api_url])
+    
     def get_info(self) -> Dict[str, Any]:
         """获取提供商信息"""
         return {
@@ -262,10 +771,68 @@ class GroqProvider(TranscriptionProvider):
         }
 
 
+class LocalProvider(TranscriptionProvider):
+    """本地 CPU 推理提供商：模型常驻在子进程中，直接接收内存 PCM，不需要网络"""
+    
+    supported_formats = ("opus", "flac", "wav")
+    accepts_pcm = True
+    
+    def __init__(self, model: str = None, backend: str = None, compute_type: str = None, threads: int = None):
+        from local_inference import get_local_worker
+        self.worker = get_local_worker(backend=backend, model=model, compute_type=compute_type, threads=threads)
+        # 只有 Whisper 后端返回分段时间戳
+        self.supports_segments = self.worker.config["backend"] == "faster_whisper"
+    
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False) -> tuple[str, float]:
+        """使用本地模型转录音频"""
+        text, inference_time, _ = self.transcribe_verbose(audio, raise_errors=raise_errors)
+        return text, inference_time
+    
+    def transcribe_verbose(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False,
+                           word_timestamps: bool = False) -> tuple[str, float, List[Dict[str, Any]]]:
+        """使用本地模型转录音频，Whisper 后端同时返回分段时间戳"""
+        source = audio.source if isinstance(audio, EncodedAudio) else audio
+        log.info("📝 本地转录中...", provider="Local")
+        start_time = time.time()
+        try:
+            with span("inference"):
+                text, _, segments = self.worker.transcribe(source.samples, source.sample_rate)
+            inference_time = time.time() - start_time
+            log.info(f"✅ 转录结果: {text}", provider="Local", duration=round(inference_time, 3))
+            return text, inference_time, segments
+        except DeadlineError as e:
+            log.warning(f"⏹️ 本地转录中止: {e}", provider="Local")
+            if raise_errors:
+                raise
+            return "", time.time() - start_time, []
+        except Exception as e:
+            log.error(f"❌ 本地转录失败: {e}", provider="Local")
+            if raise_errors:
+                raise
+            return "", time.time() - start_time, []
+    
+    def is_configured(self) -> bool:
+        """本地推理不需要密钥"""
+        return True
+    
+    def warm_up(self):
+        """启动推理子进程并加载模型"""
+        self.worker.start()
+    
+    def get_info(self) -> Dict[str, Any]:
+        """获取提供商信息"""
+        config = self.worker.config
+        return {
+            "name": "Local",
+            "model": f"{config['backend']}:{config['model']}:{config['compute_type']}",
+            "configured": self.is_configured()
+        }
+
+
 class AzureProvider(TranscriptionProvider):
     """Azure 语音服务提供商（预留接口）"""
     
-    def transcribe(self, audio_path: str) -> tuple[str, float]:
+    def transcribe_audio(self, audio: Union[AudioData, EncodedAudio], raise_errors: bool = False) -> tuple[str, float]:
         """使用 Azure API 转录音频"""
         # TODO: 实现 Azure Speech Services API 调用
         raise NotImplementedError("Azure 提供商尚未实现")
@@ -0,0 +1,128 @@
+"""
+启动模块
+记录启动各阶段的耗时，并提供按需初始化的延迟对象：
+重量级导入与预热放到快捷键监听就绪之后的后台线程，或推迟到首次使用时进行
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Any
+
+# 启动计时的起点：本模块由入口最先导入
+IMPORTED_AT = time.perf_counter()
+
+from structured_logging import get_logger  # noqa: E402  在计时起点之后导入
+
+log = get_logger("startup")
+
+
+class StartupProfiler:
+    """启动耗时记录"""
+
+    def __init__(self, budget_ms: float = None):
+        """初始化启动耗时记录
+
+        Args:
+            budget_ms: 从启动到快捷键就绪的耗时预算（毫秒），默认读取 STARTUP_BUDGET_MS
+        """
+        self.origin = IMPORTED_AT
+        self.budget = (budget_ms or float(os.getenv("STARTUP_BUDGET_MS", "500"))) / 1000
+        # (阶段名, 相对起点的开始时间, 耗时, 线程名)
+        self._phases: List[tuple] = []
+        self._marks: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个启动阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._phases.append((name, start - self.origin, end - start, threading.current_thread().name))
+
+    def mark(self, name: str) -> float:
+        """记录一个时间点（相对起点的秒数）"""
+        elapsed = time.perf_counter() - self.origin
+        with self._lock:
+            self._marks[name] = elapsed
+        return elapsed
+
+    def elapsed(self, name: str) -> Optional[float]:
+        with self._lock:
+            return self._marks.get(name)
+
+    def check_budget(self, name: str = "ready") -> bool:
+        """检查某个时间点是否在预算内，超出时给出提示"""
+        elapsed = self.elapsed(name)
+        if elapsed is None or elapsed <= self.budget:
+            return True
+        log.warning(f"⚠️ 启动耗时 {elapsed * 1000:.0f}ms 超出预算 {self.budget * 1000:.0f}ms，"
+                    f"可使用 --startup-profile 查看各阶段耗时", duration=round(elapsed, 4))
+        return False
+
+    def report(self):
+        """输出启动耗时明细（在后台预加载完成时调用，经日志队列写出）"""
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase[1])
+            marks = sorted(self._marks.items(), key=lambda item: item[1])
+        log.info("🚀 启动耗时明细（相对进程入口）:")
+        for name, start, duration, thread in phases:
+            log.info(f"   {name:<22} +{start * 1000:>6.0f}ms  {duration * 1000:>6.0f}ms  [{thread}]",
+                     phase=name, offset=round(start, 4), duration=round(duration, 4))
+        for name, elapsed in marks:
+            log.info(f"   ● {name:<20} +{elapsed * 1000:>6.0f}ms", mark=name, offset=round(elapsed, 4))
+
+
+class Lazy:
+    """首次使用时才创建的对象
+
+    后台预加载与前台首次使用并发时，后到者等待先到者创建完成，工厂函数只执行一次；
+    工厂抛出异常时不缓存结果，下次使用时重试。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], profiler: StartupProfiler = None):
+        self.name = name
+        self._factory = factory
+        self._profiler = profiler
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self) -> Any:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                if self._profiler is not None:
+                    with self._profiler.phase(self.name):
+                        self._value = self._factory()
+                else:
+                    self._value = self._factory()
+                self._ready = True
+        return self._value
+
+
+def preload(items: List[Lazy], on_complete: Callable[[], None] = None) -> threading.Thread:
+    """在后台线程中依次初始化延迟对象，单项失败只打印警告，不影响后续项目"""
+
+    def run():
+        for item in items:
+            try:
+                item.get()
+            except Exception as e:
+                log.warning(f"⚠️ 后台初始化 {item.name} 失败: {e}", item=item.name)
+        if on_complete is not None:
+            on_complete()
+
+    thread = threading.Thread(target=run, name="startup-preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,178 @@
+"""
+流式分段转录模块
+按住快捷键期间在自然停顿处切分录音，分段在后台转录，松开后只需等待最后一段
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List
+
+import numpy as np
+
+from audio_processing import AudioData
+from deadline import Deadline, DeadlineError, current_deadline, deadline_scope
+from structured_logging import get_logger
+
+log = get_logger("streaming")
+
+
+def join_texts(parts: List[str]) -> str:
+    """按顺序拼接分段文本：中英文边界直接相连，两个英文/数字之间补空格"""
+    result = ""
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        if result and result[-1].isascii() and result[-1].isalnum() and part[0].isascii() and part[0].isalnum():
+            result += " "
+        result += part
+    return result
+
+
+class StreamingTranscriber:
+    """流式分段转录会话，每次录音创建一个
+
+    feed() 在音频回调线程中调用，只做分块能量计算和分段判断，切出的分段（块列表的引用）放入队列；
+    拼接音频、写日志和提交线程池都在会话自己的分段线程中完成，不占用音频回调。
+    finish() 时补交尾段，等分段线程把队列处理完后按顺序拼接结果。
+    """
+
+    def __init__(self, manager, sample_rate: int, min_segment: float = None, max_segment: float = None,
+                 pause: float = None, silence_threshold: float = None, max_workers: int = None):
+        """初始化流式会话
+
+        Args:
+            manager: TranscriptionManager 实例
+            sample_rate: 采样率
+            min_segment: 最短分段时长（秒），默认读取 STREAMING_MIN_SEGMENT
+            max_segment: 最长分段时长（秒），超过后在最安静处强制切分，默认读取 STREAMING_MAX_SEGMENT
+            pause: 视为自然停顿的静音时长（秒），默认读取 STREAMING_PAUSE
+            silence_threshold: 静音 RMS 阈值（int16 幅度），默认读取 STREAMING_SILENCE_THRESHOLD
+            max_workers: 后台转录并发数，默认读取 STREAMING_WORKERS
+        """
+        self.manager = manager
+        self.sample_rate = sample_rate
+        self.min_segment = min_segment or float(os.getenv("STREAMING_MIN_SEGMENT", "3.0"))
+        self.max_segment = max_segment or float(os.getenv("STREAMING_MAX_SEGMENT", "15.0"))
+        self.pause = pause or float(os.getenv("STREAMING_PAUSE", "0.4"))
+        self.silence_threshold = silence_threshold or float(os.getenv("STREAMING_SILENCE_THRESHOLD", "300"))
+        max_workers = max_workers or int(os.getenv("STREAMING_WORKERS", "2"))
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="streaming")
+        self._futures: List[Future] = []
+        self._blocks: List[np.ndarray] = []
+        self._block_rms: List[float] = []
+        self._segment_frames = 0
+        self._silent_frames = 0
+        self._finished = False
+        # 音频回调 → 分段线程：(块列表, RMS 列表)，None 表示会话结束
+        self._segments: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._segment_thread = threading.Thread(target=self._segment_loop, name="streaming-cut", daemon=True)
+        self._segment_thread.start()
+        # 录音期间就已开始的分段请求不受录音截止时间约束（还没有松开按键），但可以随录音一起取消；
+        # finish() 时关联到录音的截止时间
+        self.deadline = Deadline(None)
+
+    def feed(self, block: np.ndarray):
+        """接收一个音频块（调用方已复制），必要时切出一个分段"""
+        if self._finished:
+            return
+        rms = float(np.sqrt(np.mean(np.square(block, dtype=np.float32))))
+        self._blocks.append(block)
+        self._block_rms.append(rms)
+        self._segment_frames += len(block)
+
+        if rms < self.silence_threshold:
+            self._silent_frames += len(block)
+        else:
+            self._silent_frames = 0
+
+        segment_seconds = self._segment_frames / self.sample_rate
+        if segment_seconds >= self.min_segment and self._silent_frames / self.sample_rate >= self.pause:
+            self._cut(len(self._blocks))
+        elif segment_seconds >= self.max_segment:
+            # 没等到停顿：在后半段最安静的块之后切分，尽量避免切断字词
+            half = len(self._block_rms) // 2
+            quietest = half + int(np.argmin(self._block_rms[half:]))
+            self._cut(quietest + 1)
+
+    def _cut(self, index: int):
+        """切出前 index 个块作为一个分段，交给分段线程提交后台转录"""
+        blocks, rms = self._blocks[:index], self._block_rms[:index]
+        self._blocks, self._block_rms = self._blocks[index:], self._block_rms[index:]
+        self._segment_frames = sum(len(block) for block in self._blocks)
+        self._silent_frames = min(self._silent_frames, self._segment_frames)
+        self._segments.put((blocks, rms))
+
+    def _segment_loop(self):
+        """分段线程：拼接切出的分段并提交线程池，直到收到结束标记"""
+        while True:
+            item = self._segments.get()
+            if item is None:
+                return
+            if self.deadline.done:
+                continue
+            try:
+                self._submit(*item)
+            except Exception as e:
+                log.error(f"❌ 提交分段异常: {e}")
+
+    def _submit(self, blocks: List[np.ndarray], rms: List[float]):
+        # 整段都是静音时不发请求
+        if not blocks or max(rms) < self.silence_threshold:
+            return
+        audio = AudioData(np.concatenate(blocks, axis=0), self.sample_rate)
+        log.info(f"✂️ 分段 {len(self._futures) + 1}: {audio.duration:.2f}s，后台转录中...")
+        self._futures.append(self._executor.submit(self._transcribe_segment, audio))
+
+    def _transcribe_segment(self, audio: AudioData) -> tuple[str, float]:
+        with deadline_scope(self.deadline):
+            return self.manager.transcribe_audio(audio)
+
+    def cancel(self, reason: str = "录音已取消"):
+        """取消会话：中断进行中的分段请求，尚未开始的分段不再发出"""
+        self._finished = True
+        self.deadline.cancel(reason)
+        self._segments.put(None)
+        self._segment_thread.join()
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def finish(self) -> tuple[str, float]:
+        """提交尾段并等待所有分段完成
+
+        Returns:
+            tuple: (按录音顺序拼接的文本, 从调用 finish 到拿到全部结果的耗时)
+        """
+        start_time = time.time()
+        self._finished = True
+        utterance = current_deadline()
+        unlink = self.deadline.link(utterance) if utterance is not None else None
+        self._segments.put((self._blocks, self._block_rms))
+        self._segments.put(None)
+        self._blocks, self._block_rms = [], []
+        self._segment_thread.join()
+
+        texts = []
+        try:
+            for future in self._futures:
+                try:
+                    text, _ = future.result()
+                except DeadlineError:
+                    for other in self._futures:
+                        other.cancel()
+                    raise
+                except Exception as e:
+                    log.error(f"❌ 分段转录异常: {e}")
+                    text = ""
+                texts.append(text)
+        finally:
+            if unlink is not None:
+                unlink()
+            self._executor.shutdown(wait=False)
+
+        return join_texts(texts), time.time() - start_time
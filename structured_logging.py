@@ -0,0 +1,260 @@
+"""
+结构化日志模块
+热路径（快捷键、录音回调、转录、粘贴线程）只把日志记录放入有界队列，由后台线程格式化并写出，
+终端缓慢或输出被重定向时也不会阻塞调用方；队列满时丢弃并计数。
+每条日志带级别与结构化字段（录音编号、阶段、耗时等），支持人类可读文本与 JSON 两种输出
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any
+
+from tracing import current_trace
+
+# 所有日志记录器的公共前缀，不影响根记录器与第三方库的日志
+ROOT_LOGGER = "whisper_pasts"
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+_context = threading.local()
+
+
+@contextmanager
+def log_context(**fields):
+    """在当前线程内为之后的日志附加字段（如流水线阶段），退出时恢复"""
+    previous = getattr(_context, "fields", None)
+    _context.fields = {**previous, **fields} if previous else fields
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+class _TextFormatter(logging.Formatter):
+    """终端输出：只输出消息本身；debug 级别时在末尾附加结构化字段"""
+
+    def __init__(self, show_fields: bool = False):
+        super().__init__()
+        self.show_fields = show_fields
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        fields = getattr(record, "fields", None)
+        if self.show_fields and fields:
+            message += "  [" + " ".join(f"{key}={value}" for key, value in fields.items()) + "]"
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class _JSONFormatter(logging.Formatter):
+    """日志采集：每条日志一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name[len(ROOT_LOGGER) + 1:] or ROOT_LOGGER,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            for key, value in fields.items():
+                entry.setdefault(key, value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.Handler):
+    """把日志记录放入有界队列，调用方不做格式化与 I/O；队列满时丢弃"""
+
+    def __init__(self, records: queue.Queue):
+        super().__init__()
+        self.records = records
+        self.dropped = 0
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LogWriter:
+    """后台写日志线程"""
+
+    def __init__(self, records: queue.Queue, handler: logging.Handler):
+        self.records = records
+        self.handler = handler
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            if isinstance(record, threading.Event):
+                record.set()
+                continue
+            self.handler.handle(record)
+            self.written += 1
+        self.handler.close()
+
+    def flush(self, timeout: float):
+        marker = threading.Event()
+        try:
+            self.records.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.wait(timeout)
+
+    def stop(self, timeout: float):
+        try:
+            self.records.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+class StructuredLogger:
+    """带结构化字段的日志记录器
+
+    用法：log.info("✅ 已粘贴", copy_ms=12, paste_ms=30)。当前线程有追踪时自动附加录音编号（utterance），
+    log_context 设置的字段（如 stage）也会一并附加。低于当前级别的日志在调用处直接返回。
+    """
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+    def _log(self, level: int, message: str, fields: Dict[str, Any], exc_info=None):
+        _ensure_configured()
+        if not self._logger.isEnabledFor(level):
+            return
+        context = getattr(_context, "fields", None)
+        trace = current_trace()
+        if context or trace is not None:
+            fields = {**(context or {}), **fields}
+            if trace is not None:
+                fields.setdefault("utterance", trace.trace_id)
+        self._logger.log(level, message, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, message: str, **fields):
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message: str, **fields):
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message: str, **fields):
+        self._log(logging.WARNING, message, fields)
+
+    def error(self, message: str, **fields):
+        self._log(logging.ERROR, message, fields)
+
+    def exception(self, message: str, **fields):
+        """记录错误与当前异常的堆栈"""
+        self._log(logging.ERROR, message, fields, exc_info=True)
+
+    def is_enabled(self, level: str) -> bool:
+        _ensure_configured()
+        return self._logger.isEnabledFor(LEVELS[level])
+
+
+_state: Dict[str, Any] = {}
+_state_lock = threading.Lock()
+
+
+def configure_logging(level: str = None, fmt: str = None, quiet: bool = None, file: str = None,
+                      queue_size: int = None):
+    """配置日志输出（重复调用时替换之前的配置）
+
+    Args:
+        level: 日志级别 debug / info / warning / error，默认读取 LOG_LEVEL
+        fmt: 输出格式 text / json，默认读取 LOG_FORMAT
+        quiet: 安静模式，只输出警告与错误，默认读取 LOG_QUIET
+        file: 日志文件路径，默认读取 LOG_FILE，为空时输出到标准输出
+        queue_size: 日志队列容量，写出跟不上时超出的日志被丢弃，默认读取 LOG_QUEUE_SIZE
+    """
+    level = (level or os.getenv("LOG_LEVEL", "info")).lower()
+    if quiet is None:
+        quiet = os.getenv("LOG_QUIET", "false").lower() in ("1", "true", "yes")
+    if quiet:
+        level = "warning" if LEVELS.get(level, logging.INFO) < logging.WARNING else level
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    file = file if file is not None else os.getenv("LOG_FILE", "")
+    queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    if file:
+        path = os.path.expanduser(file)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        output = logging.FileHandler(path, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(_JSONFormatter() if fmt == "json" else _TextFormatter(show_fields=level == "debug"))
+
+    records = queue.Queue(maxsize=queue_size)
+    handler = _QueueHandler(records)
+    root = logging.getLogger(ROOT_LOGGER)
+    with _state_lock:
+        previous = _state.get("writer")
+        # 替换配置时保留之前丢弃的条数
+        dropped = _state["dropped"] + _state["handler"].dropped if previous is not None else 0
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(LEVELS.get(level, logging.INFO))
+        root.propagate = False
+        _state.update(handler=handler, writer=_LogWriter(records, output), level=level, format=fmt,
+                      file=file, dropped=dropped)
+    if previous is not None:
+        previous.stop(timeout=1.0)
+
+
+def _ensure_configured():
+    if "writer" not in _state:
+        with _state_lock:
+            configured = "writer" in _state
+        if not configured:
+            configure_logging()
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """获取模块的日志记录器（配置在首次写日志时按环境变量完成）"""
+    return StructuredLogger(name)
+
+
+def flush_logs(timeout: float = 2.0):
+    """等待队列中已有的日志写出（退出前打印统计、切换到交互输出前调用）"""
+    writer = _state.get("writer")
+    if writer is not None:
+        writer.flush(timeout)
+
+
+def get_log_stats() -> Dict[str, Any]:
+    with _state_lock:
+        handler, writer = _state.get("handler"), _state.get("writer")
+        if writer is None:
+            return {"written": 0, "dropped": 0, "queued": 0}
+        return {"written": writer.written, "dropped": _state["dropped"] + handler.dropped,
+                "queued": handler.records.qsize(), "level": _state["level"], "format": _state["format"]}
+
+
+@atexit.register
+def _stop_logging():
+    writer = _state.get("writer")
+    if writer is not None:
+        writer.stop(timeout=2.0)
+        dropped = get_log_stats()["dropped"]
+        if dropped:
+            sys.stderr.write(f"⚠️ 日志写出跟不上，丢弃了 {dropped} 条日志（可设置 LOG_QUIET=true 或 LOG_FILE）\n")
@@ -0,0 +1,287 @@
+"""
+文本后处理模块
+把词表替换规则（产品名、缩写、中英混排术语等）一次编译为 Aho-Corasick 自动机，
+每条转录结果只需线性扫描一遍即可完成全部替换，耗时不随词表规模增长；
+规则文件变化时在后台重新编译并原子切换，不阻塞正在处理的录音
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+from structured_logging import get_logger
+
+log = get_logger("text")
+
+# 只折叠 ASCII 大小写，保证匹配文本与原文逐字符对齐
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+# 中文语境下半角标点到全角标点的映射
+_CJK_PUNCTUATION = {",": "，", ".": "。", "?": "？", "!": "！", ":": "：", ";": "；"}
+
+
+def _is_word_char(ch: str) -> bool:
+    """英文单词字符：以它开头/结尾的规则需要词边界，避免 api 匹配到 rapid 中间"""
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+def _is_cjk(ch: str) -> bool:
+    return "㐀" <= ch <= "鿿" or "豈" <= ch <= "﫿"
+
+
+def load_rules(path: str) -> Dict[str, str]:
+    """读取规则文件：每行 `原文<Tab>替换` 或 `原文 => 替换`（替换为空表示删除），# 开头为注释"""
+    rules = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            if "\t" in line:
+                source, target = line.split("\t", 1)
+            elif "=>" in line:
+                source, target = line.split("=>", 1)
+                source, target = source.strip(), target.strip()
+            else:
+                log.warning(f"⚠️ 规则文件 {path} 第 {line_number} 行格式无法识别，已跳过")
+                continue
+            if source:
+                rules[source] = target
+    return rules
+
+
+class _PythonAutomaton:
+    """纯 Python 实现的 Aho-Corasick 自动机（未安装 pyahocorasick 时使用）"""
+
+    def __init__(self, patterns: Dict[str, tuple]):
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[Optional[tuple]] = [None]
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                next_node = goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(goto)
+                    goto[node][ch] = next_node
+                    goto.append({})
+                    outputs.append(None)
+                node = next_node
+            outputs[node] = value
+
+        # 失败指针与输出链接（最近的、本身是某条规则结尾的后缀节点）
+        fail = [0] * len(goto)
+        output_link = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(ch, 0)
+                output_link[child] = fail[child] if outputs[fail[child]] is not None else output_link[fail[child]]
+
+        self._goto, self._fail, self._outputs, self._output_link = goto, fail, outputs, output_link
+
+    def iter(self, text: str):
+        """产出 (匹配结尾下标, 规则值)，与 pyahocorasick 的 Automaton.iter 一致"""
+        goto, fail, outputs, output_link = self._goto, self._fail, self._outputs, self._output_link
+        node = 0
+        for index, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            match = node if outputs[node] is not None else output_link[node]
+            while match:
+                yield index, outputs[match]
+                match = output_link[match]
+
+
+def _build_automaton(patterns: Dict[str, tuple]) -> Tuple[Any, str]:
+    """优先使用 pyahocorasick（C 实现），未安装时退回纯 Python 实现"""
+    try:
+        import ahocorasick
+    except ImportError:
+        return _PythonAutomaton(patterns), "python"
+    automaton = ahocorasick.Automaton()
+    for pattern, value in patterns.items():
+        automaton.add_word(pattern, value)
+    if len(automaton):
+        automaton.make_automaton()
+    return automaton, "pyahocorasick"
+
+
+class CompiledRules:
+    """编译后的替换规则"""
+
+    def __init__(self, rules: Dict[str, str], ignore_case: bool = True):
+        start_time = time.perf_counter()
+        self.ignore_case = ignore_case
+        patterns = {}
+        for source, target in rules.items():
+            key = source.translate(_ASCII_LOWER) if ignore_case else source
+            patterns[key] = (len(key), target, _is_word_char(key[0]), _is_word_char(key[-1]))
+        self.size = len(patterns)
+        self._automaton, self.backend = _build_automaton(patterns) if patterns else (None, "none")
+        self.compile_time = time.perf_counter() - start_time
+
+    def apply(self, text: str) -> Tuple[str, int]:
+        """一次扫描完成全部替换：重叠的匹配取最靠左、其次最长的一条，返回 (结果, 替换次数)"""
+        if self._automaton is None or not text:
+            return text, 0
+        match_text = text.translate(_ASCII_LOWER) if self.ignore_case else text
+        matches = []
+        for end_index, (length, target, left_boundary, right_boundary) in self._automaton.iter(match_text):
+            start, end = end_index + 1 - length, end_index + 1
+            if left_boundary and start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if right_boundary and end < len(text) and _is_word_char(text[end]):
+                continue
+            matches.append((start, -length, target))
+        if not matches:
+            return text, 0
+
+        matches.sort()
+        pieces, position, count = [], 0, 0
+        for start, negative_length, target in matches:
+            if start < position:
+                continue
+            pieces.append(text[position:start])
+            pieces.append(target)
+            position = start - negative_length
+            count += 1
+        pieces.append(text[position:])
+        return "".join(pieces), count
+
+
+def normalize_cjk_punctuation(text: str) -> str:
+    """紧跟在中文后面的半角标点转为全角，并去掉其后的空格（数字中的小数点等不受影响）"""
+    pieces = []
+    skip_space = False
+    previous = ""
+    for ch in text:
+        if skip_space and ch == " ":
+            continue
+        skip_space = False
+        full_width = _CJK_PUNCTUATION.get(ch) if _is_cjk(previous) else None
+        if full_width is not None:
+            pieces.append(full_width)
+            skip_space = True
+        else:
+            pieces.append(ch)
+        previous = ch
+    return "".join(pieces)
+
+
+class TextPostProcessor:
+    """转录文本后处理：去除首尾空白 → 词表替换 → 标点规范化"""
+
+    def __init__(self, rules_files: List[str] = None, ignore_case: bool = None, punctuation: str = None,
+                 check_interval: float = None):
+        """初始化后处理器
+
+        Args:
+            rules_files: 规则文件路径列表，后面的文件覆盖前面的同名规则，默认读取 TEXT_RULES_FILE（逗号分隔）
+            ignore_case: 英文规则是否忽略大小写，默认读取 TEXT_RULES_IGNORE_CASE
+            punctuation: 标点规范化方式，cjk 为中文语境下半角转全角，none 为不处理，默认读取 TEXT_PUNCTUATION
+            check_interval: 检查规则文件是否变化的最短间隔（秒），默认读取 TEXT_RULES_CHECK_INTERVAL
+        """
+        if rules_files is None:
+            rules_files = [path.strip() for path in os.getenv("TEXT_RULES_FILE", "").split(",") if path.strip()]
+        self.rules_files = [os.path.expanduser(path) for path in rules_files]
+        if ignore_case is None:
+            ignore_case = os.getenv("TEXT_RULES_IGNORE_CASE", "true").lower() in ("1", "true", "yes")
+        self.ignore_case = ignore_case
+        self.punctuation = (punctuation or os.getenv("TEXT_PUNCTUATION", "none")).lower()
+        self.check_interval = check_interval if check_interval is not None else float(
+            os.getenv("TEXT_RULES_CHECK_INTERVAL", "2"))
+
+        self._rules = CompiledRules({}, ignore_case)
+        self._mtimes: Dict[str, Optional[float]] = {}
+        self._last_check = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+        self._stats = {"processed": 0, "replacements": 0, "total_time": 0.0, "max_time": 0.0, "reloads": 0}
+        if self.rules_files:
+            self.reload()
+
+    def _current_mtimes(self) -> Dict[str, Optional[float]]:
+        mtimes = {}
+        for path in self.rules_files:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def reload(self) -> bool:
+        """重新读取并编译规则文件，编译完成后原子替换；读取失败时保留原有规则"""
+        mtimes = self._current_mtimes()
+        rules = {}
+        try:
+            for path in self.rules_files:
+                if mtimes[path] is not None:
+                    rules.update(load_rules(path))
+        except (OSError, UnicodeDecodeError) as e:
+            log.warning(f"⚠️ 读取后处理规则失败，继续使用原有规则: {e}")
+            return False
+        compiled = CompiledRules(rules, self.ignore_case)
+        with self._lock:
+            self._rules = compiled
+            self._mtimes = mtimes
+            self._stats["reloads"] += 1
+        log.info(f"✏️ 已加载 {compiled.size} 条后处理规则（{compiled.backend}，编译 {compiled.compile_time * 1000:.0f}ms）")
+        return True
+
+    def _check_reload(self):
+        """规则文件变化时在后台线程重新编译，处理中的录音继续使用旧规则"""
+        now = time.time()
+        with self._lock:
+            if self._reloading or now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            mtimes = self._mtimes
+        if self._current_mtimes() == mtimes:
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+
+        def run():
+            try:
+                self.reload()
+            finally:
+                with self._lock:
+                    self._reloading = False
+
+        threading.Thread(target=run, name="text-rules-reload", daemon=True).start()
+
+    def process(self, text: str) -> Tuple[str, int, float]:
+        """处理一条转录结果，返回 (结果, 替换次数, 处理耗时)"""
+        if self.rules_files and self.check_interval >= 0:
+            self._check_reload()
+        start_time = time.perf_counter()
+        text = text.strip()
+        rules = self._rules
+        text, count = rules.apply(text)
+        if self.punctuation == "cjk":
+            text = normalize_cjk_punctuation(text)
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            self._stats["processed"] += 1
+            self._stats["replacements"] += count
+            self._stats["total_time"] += elapsed
+            self._stats["max_time"] = max(self._stats["max_time"], elapsed)
+        return text, count, elapsed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            rules = self._rules
+        stats["rules"] = rules.size
+        stats["backend"] = rules.backend
+        stats["compile_time"] = rules.compile_time
+        stats["avg_time"] = stats["total_time"] / stats["processed"] if stats["processed"] else 0.0
+        return stats
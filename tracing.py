@@ -0,0 +1,363 @@
+"""
+延迟追踪模块
+按录音记录从松开按键到粘贴完成各环节的耗时（span），汇总为延迟直方图，
+并导出为 JSONL 追踪文件与 Prometheus 文本格式
+"""
+
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+
+# Prometheus 直方图桶上限（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 从追踪开始到结束的总耗时在直方图中的名称
+TOTAL_SPAN = "total"
+# 写线程队列中请求导出 Prometheus 文件的标记
+_EXPORT = object()
+
+_local = threading.local()
+
+
+class Trace:
+    """一次录音的追踪记录"""
+
+    def __init__(self, tracer: "Tracer", trace_id: int, attrs: Dict[str, Any] = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.start = time.time()
+        self.attrs = dict(attrs or {})
+        # (名称, 相对追踪开始的偏移, 耗时, 附加属性)
+        self.spans: List[tuple] = []
+        self.finished = False
+
+    def add(self, name: str, start: float, duration: float, **attrs):
+        """记录一个已结束的 span；start 为 time.time() 时间戳"""
+        self.spans.append((name, start - self.start, duration, attrs or None))
+
+    def finish(self):
+        """结束追踪并交给 Tracer 汇总（重复调用无效）"""
+        if not self.finished:
+            self.finished = True
+            self.tracer._finish(self, time.time() - self.start)
+
+    def to_dict(self, total: float) -> Dict[str, Any]:
+        spans = []
+        for name, offset, duration, attrs in self.spans:
+            span = {"name": name, "offset": round(offset, 6), "duration": round(duration, 6)}
+            if attrs:
+                span.update(attrs)
+            spans.append(span)
+        return {"trace_id": self.trace_id, "start": self.start, "total": round(total, 6),
+                "attrs": self.attrs, "spans": spans}
+
+
+def current_trace() -> Optional[Trace]:
+    """当前线程正在记录的追踪"""
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def activate(trace: Optional[Trace]):
+    """在当前线程内把 trace 设为当前追踪，退出时恢复"""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """记录一段代码的耗时到当前追踪；没有当前追踪时不做任何记录"""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.time() - start, **attrs)
+
+
+def record_span(name: str, start: float, duration: float, **attrs):
+    """把已知起止时间的 span 记录到当前追踪"""
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.add(name, start, duration, **attrs)
+
+
+def bind(fn):
+    """让提交到线程池的函数继续记录到当前追踪"""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        with activate(trace):
+            return fn(*args, **kwargs)
+    return bound
+
+
+class _Histogram:
+    """单个 span 的延迟分布：累计分桶计数用于导出，最近样本用于计算百分位"""
+
+    def __init__(self, window: int):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value: float):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+
+class Tracer:
+    """追踪汇总与导出
+
+    每条结束的追踪追加一行到 JSONL 文件；直方图按 TRACE_EXPORT_INTERVAL 节流写入 Prometheus 文本文件，
+    关闭时再写一次。记录 span 只是一次列表追加，可以在生产环境常开；
+    文件写入都在后台写线程中进行（与日志相同，有界队列，满时丢弃），结束追踪的线程不做 I/O。
+    """
+
+    def __init__(self, enabled: bool = None, trace_file: str = None, prometheus_file: str = None,
+                 window: int = None, export_interval: float = None, queue_size: int = None):
+        """初始化 Tracer
+
+        Args:
+            enabled: 是否记录追踪，默认读取 TRACING_ENABLED
+            trace_file: JSONL 追踪文件路径，默认读取 TRACE_FILE，为空时不写文件
+            prometheus_file: Prometheus 文本格式文件路径，默认读取 TRACE_PROMETHEUS_FILE，为空时不导出
+            window: 每个 span 计算百分位时保留的最近样本数，默认读取 TRACE_WINDOW
+            export_interval: Prometheus 文件的最短重写间隔（秒），默认读取 TRACE_EXPORT_INTERVAL
+            queue_size: 待写出追踪的队列容量，写出跟不上时超出的追踪行被丢弃，默认读取 TRACE_QUEUE_SIZE
+        """
+        if enabled is None:
+            enabled = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        trace_file = trace_file if trace_file is not None else os.getenv("TRACE_FILE", "")
+        prometheus_file = prometheus_file if prometheus_file is not None else os.getenv("TRACE_PROMETHEUS_FILE", "")
+        self.trace_file = os.path.expanduser(trace_file) if trace_file else ""
+        self.prometheus_file = os.path.expanduser(prometheus_file) if prometheus_file else ""
+        self.window = window or int(os.getenv("TRACE_WINDOW", "1024"))
+        self.export_interval = export_interval or float(os.getenv("TRACE_EXPORT_INTERVAL", "10"))
+
+        self._ids = itertools.count(1)
+        self._histograms: Dict[str, _Histogram] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_export = 0.0
+        self._dirty = False
+        # 后台写线程：JSONL 行（str）、导出 Prometheus（_EXPORT）、刷新标记（Event）、结束（None）
+        self._pending: "queue.Queue" = queue.Queue(maxsize=queue_size or int(os.getenv("TRACE_QUEUE_SIZE", "1000")))
+        self._writer: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def start_trace(self, **attrs) -> Optional[Trace]:
+        """开始一条追踪；未启用时返回 None，后续 span 调用全部为空操作"""
+        if not self.enabled:
+            return None
+        return Trace(self, next(self._ids), attrs)
+
+    def _finish(self, trace: Trace, total: float):
+        line = json.dumps(trace.to_dict(total), ensure_ascii=False) if self.trace_file else None
+        with self._lock:
+            for name, _, duration, _ in trace.spans:
+                self._observe(name, duration)
+            # 被跳过或失败的录音不计入端到端耗时
+            if not trace.attrs.get("skipped") and not trace.attrs.get("error"):
+                self._observe(TOTAL_SPAN, total)
+            self._dirty = True
+            export = self.prometheus_file and time.time() - self._last_export >= self.export_interval
+            if export:
+                # 在锁内推进导出时间，并发结束的追踪不会重复请求导出
+                self._last_export = time.time()
+        if line is not None:
+            self._enqueue(line)
+        if export:
+            self._enqueue(_EXPORT)
+
+    def _enqueue(self, item):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                    self._writer.start()
+        try:
+            self._pending.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                if self._file is not None:
+                    self._flush_file()
+                item.set()
+            elif item is _EXPORT:
+                self.export_prometheus()
+            else:
+                self._write_line(item)
+                # 积压的行写完后再刷新，突发时合并为一次系统调用
+                if self._pending.empty() and self._file is not None:
+                    self._flush_file()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _observe(self, name: str, value: float):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = _Histogram(self.window)
+        histogram.observe(value)
+
+    def _write_line(self, line: str):
+        try:
+            if self._file is None:
+                directory = os.path.dirname(self.trace_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.trace_file, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+        except OSError as e:
+            # structured_logging 依赖本模块，在出错时才导入
+            from structured_logging import get_logger
+            get_logger("tracing").warning(f"⚠️ 写入追踪文件失败: {e}")
+
+    def _flush_file(self):
+        try:
+            self._file.flush()
+        except OSError as e:
+            from structured_logging import get_logger
+            get_logger("tracing").warning(f"⚠️ 写入追踪文件失败: {e}")
+
+    def flush(self, timeout: float = 2.0):
+        """等待已结束的追踪写入文件"""
+        if self._writer is None:
+            return
+        marker = threading.Event()
+        try:
+            self._pending.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.wait(timeout)
+
+    def get_summary(self) -> Dict[str, Dict[str, float]]:
+        """各 span 的次数、平均值、最大值与 p50/p90/p99（秒）"""
+        with self._lock:
+            snapshot = {name: (histogram.count, histogram.total, histogram.max, list(histogram.samples))
+                        for name, histogram in self._histograms.items()}
+        if not snapshot:
+            return {}
+        # 按需导入：追踪模块在启动关键路径上，不为它提前加载 numpy
+        import numpy as np
+        summary = {}
+        for name, (count, total, maximum, samples) in snapshot.items():
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99]) if samples else (0.0, 0.0, 0.0)
+            summary[name] = {"count": count, "avg": total / count if count else 0.0, "max": maximum,
+                             "p50": float(p50), "p90": float(p90), "p99": float(p99)}
+        return summary
+
+    def render_prometheus(self) -> str:
+        """渲染 Prometheus 文本格式：span 耗时直方图 + 最近样本的分位数"""
+        summary = self.get_summary()
+        with self._lock:
+            histograms = {name: (list(histogram.bucket_counts), histogram.count, histogram.total)
+                          for name, histogram in self._histograms.items()}
+
+        lines = [
+            "# HELP whisper_pasts_span_seconds Latency of each step from key release to paste.",
+            "# TYPE whisper_pasts_span_seconds histogram",
+        ]
+        for name in sorted(histograms):
+            bucket_counts, count, total = histograms[name]
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'whisper_pasts_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'whisper_pasts_span_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+            lines.append(f'whisper_pasts_span_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'whisper_pasts_span_seconds_count{{span="{name}"}} {count}')
+
+        lines.append("# HELP whisper_pasts_span_quantile_seconds Latency quantiles over the most recent samples.")
+        lines.append("# TYPE whisper_pasts_span_quantile_seconds gauge")
+        for name in sorted(summary):
+            for quantile, key in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99")):
+                lines.append(f'whisper_pasts_span_quantile_seconds{{span="{name}",quantile="{quantile}"}} '
+                             f'{summary[name][key]:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path: str = None):
+        """写入 Prometheus 文本文件（先写临时文件再替换，抓取方不会读到半个文件）"""
+        path = path or self.prometheus_file
+        if not path:
+            return
+        with self._lock:
+            self._last_export = time.time()
+            self._dirty = False
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # structured_logging 依赖本模块，在出错时才导入
+            from structured_logging import get_logger
+            get_logger("tracing").warning(f"⚠️ 导出 Prometheus 指标失败: {e}")
+
+    def print_summary(self):
+        """打印各环节的延迟分位数"""
+        summary = self.get_summary()
+        if not summary:
+            return
+        print("⏱️  延迟分布 (p50 / p90 / p99):")
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]["p50"]):
+            print(f"   {name:<22} {stats['p50'] * 1000:>7.0f}ms {stats['p90'] * 1000:>7.0f}ms "
+                  f"{stats['p99'] * 1000:>7.0f}ms  (n={stats['count']})")
+
+    def close(self, timeout: float = 2.0):
+        """写完排队的追踪，导出最后一次指标并关闭追踪文件"""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            try:
+                self._pending.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            writer.join(timeout)
+        if self.prometheus_file and self._dirty:
+            self.export_prometheus()
+
+
+_default_tracer = None
+_default_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """获取进程内共享的 Tracer"""
+    global _default_tracer
+    with _default_tracer_lock:
+        if _default_tracer is None:
+            _default_tracer = Tracer()
+        return _default_tracer
@@ -0,0 +1,186 @@
+"""
+转录缓存模块
+以 PCM 内容哈希 + 提供商配置为键的转录结果缓存：内存 LRU 层 + 可选的磁盘持久层
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Iterable
+
+import numpy as np
+
+from audio_processing import AudioData
+from structured_logging import get_logger
+
+log = get_logger("cache")
+
+
+class TranscriptionCache:
+    """两级转录缓存
+
+    - 内存层：有界 LRU，进程内重放零开销；
+    - 磁盘层：每个条目一个 JSON 文件，总大小超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, max_entries: int = None, cache_dir: str = None, max_disk_mb: float = None):
+        """初始化缓存
+
+        Args:
+            max_entries: 内存层最多保存的条目数，默认读取 TRANSCRIPTION_CACHE_SIZE
+            cache_dir: 磁盘层目录，默认读取 TRANSCRIPTION_CACHE_DIR，为空时不启用磁盘层
+            max_disk_mb: 磁盘层大小上限（MB），默认读取 TRANSCRIPTION_CACHE_DISK_MB
+        """
+        self.max_entries = max_entries or int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "256"))
+        cache_dir = cache_dir if cache_dir is not None else os.getenv("TRANSCRIPTION_CACHE_DIR", "")
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else ""
+        self.max_disk_bytes = int((max_disk_mb or float(os.getenv("TRANSCRIPTION_CACHE_DISK_MB", "50"))) * 1024 * 1024)
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0}
+        self._disk_bytes = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+
+    @staticmethod
+    def make_key(audio: AudioData, config: Iterable[Dict[str, Any]], params: Dict[str, Any] = None) -> str:
+        """计算缓存键：PCM 内容 + 采样率/类型 + 提供商配置 + 请求参数"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{audio.sample_rate}|{audio.dtype.str}|{audio.channels}|".encode())
+        digest.update(memoryview(np.ascontiguousarray(audio.samples)).cast("B"))
+        digest.update(json.dumps([list(config), params or {}], sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存，磁盘命中会回填到内存层"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._memory[key]
+
+        text = self._read_disk(key)
+        with self._lock:
+            if text is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._put_memory(key, text)
+        return text
+
+    def put(self, key: str, text: str):
+        """写入缓存（只缓存非空结果）"""
+        if not text:
+            return
+        with self._lock:
+            self._put_memory(key, text)
+        self._write_disk(key, text)
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def _put_memory(self, key: str, text: str):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f).get("text")
+            # 更新访问时间，淘汰时按最近访问排序
+            os.utime(path, None)
+            return text
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, text: str):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            payload = json.dumps({"text": text, "created": time.time()}, ensure_ascii=False)
+            # 同一个键重复写入时覆盖旧文件，占用按差值计算
+            try:
+                previous = os.path.getsize(path)
+            except OSError:
+                previous = 0
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path) - previous
+                over_limit = self._disk_bytes > self.max_disk_bytes
+            if over_limit:
+                self._evict_disk()
+        except OSError as e:
+            log.warning(f"⚠️ 写入转录缓存失败: {e}")
+
+    def _scan_disk(self):
+        """列出磁盘层所有条目：(路径, 大小, 最近访问时间)"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """按最近访问时间淘汰，直到磁盘层降到上限的 90%"""
+        entries = sorted(self._scan_disk(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_disk_bytes * 0.9)
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+            self._stats["evictions"] += evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """清空内存层与磁盘层"""
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir:
+            for path, _, _ in self._scan_disk():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._disk_bytes = 0
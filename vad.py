@@ -0,0 +1,171 @@
+"""
+语音活动检测模块
+基于帧能量与过零率的向量化 VAD：裁剪首尾静音、压缩过长停顿、跳过无语音的录音
+"""
+
+import os
+import threading
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+from audio_processing import AudioData
+from structured_logging import get_logger
+
+log = get_logger("vad")
+
+
+class VoiceActivityDetector:
+    """向量化语音活动检测器
+
+    判定规则（全部按帧向量化计算）：
+    - 能量超过高阈值的帧确定为语音；
+    - 能量超过低阈值、或能量不太低但过零率高（清辅音）的帧为候选帧；
+    - 迟滞：连续的候选帧中只要包含一个确定语音帧，整段都视为语音。
+
+    底噪估计取录音能量的 10% 分位数，但不超过 energy_low：连续说话的录音里分位数本身就是语音，
+    不能当作底噪抬高阈值。峰值能量远超 energy_high 的录音无论检测结果如何都不会被跳过。
+    """
+
+    def __init__(self, frame_ms: float = 20, energy_low: float = None, energy_high: float = None,
+                 zcr_threshold: float = 0.25, min_speech: float = None, padding: float = None,
+                 max_pause: float = None):
+        """初始化检测器
+
+        Args:
+            frame_ms: 帧长（毫秒）
+            energy_low: 低能量阈值（int16 RMS），默认读取 VAD_ENERGY_LOW
+            energy_high: 高能量阈值（int16 RMS），默认读取 VAD_ENERGY_HIGH
+            zcr_threshold: 清辅音判定的过零率阈值（每个采样的过零比例）
+            min_speech: 语音总时长低于该值（秒）视为无语音，默认读取 VAD_MIN_SPEECH
+            padding: 裁剪时在语音前后保留的时长（秒），默认读取 VAD_PADDING
+            max_pause: 内部停顿压缩到的最大时长（秒），0 表示不压缩，默认读取 VAD_MAX_PAUSE
+        """
+        self.frame_ms = frame_ms
+        self.energy_low = energy_low or float(os.getenv("VAD_ENERGY_LOW", "200"))
+        self.energy_high = energy_high or float(os.getenv("VAD_ENERGY_HIGH", "500"))
+        self.zcr_threshold = zcr_threshold
+        self.min_speech = min_speech if min_speech is not None else float(os.getenv("VAD_MIN_SPEECH", "0.2"))
+        self.padding = padding if padding is not None else float(os.getenv("VAD_PADDING", "0.2"))
+        self.max_pause = max_pause if max_pause is not None else float(os.getenv("VAD_MAX_PAUSE", "0"))
+
+        self._lock = threading.Lock()
+        self._stats = {"clips": 0, "skipped_calls": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def _features(self, samples: np.ndarray, sample_rate: int):
+        """逐帧计算 (RMS 能量, 过零率)，能量按 int16 幅度计"""
+        frame_len = max(1, int(sample_rate * self.frame_ms / 1000))
+        mono = samples.reshape(len(samples), -1)[:, 0]
+        n_frames = len(mono) // frame_len
+        if n_frames == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        frames = mono[:n_frames * frame_len].reshape(n_frames, frame_len).astype(np.float32)
+        if samples.dtype.kind == "f":
+            frames *= 32768.0
+
+        energy = np.sqrt(np.mean(np.square(frames), axis=1))
+        zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        return energy, zcr
+
+    def detect(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """逐帧判定语音，返回每帧的布尔掩码"""
+        return self._classify(*self._features(samples, sample_rate))
+
+    def _classify(self, energy: np.ndarray, zcr: np.ndarray) -> np.ndarray:
+        if len(energy) == 0:
+            return np.zeros(0, dtype=bool)
+
+        # 阈值随底噪自适应，嘈杂环境下不会把背景音当成语音；底噪估计不超过低阈值，
+        # 否则连续说话时分位数落在语音上，阈值被抬高到整段都判为静音
+        noise_floor = min(float(np.percentile(energy, 10)), self.energy_low)
+        high = max(self.energy_high, noise_floor * 4)
+        low = max(self.energy_low, noise_floor * 2)
+
+        strong = energy >= high
+        candidate = (energy >= low) | ((energy >= low * 0.5) & (zcr >= self.zcr_threshold))
+
+        # 迟滞：给每段连续候选帧编号，保留包含确定语音帧的段
+        run_start = candidate & ~np.concatenate(([False], candidate[:-1]))
+        run_id = np.cumsum(run_start) * candidate
+        keep_ids = np.unique(run_id[strong & candidate])
+        return candidate & np.isin(run_id, keep_ids)
+
+    def process(self, audio: AudioData) -> Optional[AudioData]:
+        """裁剪静音并压缩停顿
+
+        Returns:
+            AudioData: 处理后的音频（仅裁剪时为原缓冲的视图，不复制）；没有语音时返回 None
+        """
+        frame_len = max(1, int(audio.sample_rate * self.frame_ms / 1000))
+        energy, zcr = self._features(audio.samples, audio.sample_rate)
+        speech = self._classify(energy, zcr)
+        speech_frames = int(np.count_nonzero(speech))
+
+        if speech_frames * frame_len < self.min_speech * audio.sample_rate:
+            # 峰值远超高阈值说明录音里肯定有声音，宁可原样转录也不丢弃
+            if len(energy) and float(energy.max()) >= self.energy_high * 2:
+                log.info("⚠️ VAD 未判定出语音，但录音峰值较高，原样转录")
+                self._record(audio.nbytes, audio.nbytes, skipped=False)
+                return audio
+            self._record(audio.nbytes, 0, skipped=True)
+            log.info("🔇 未检测到语音，跳过转录")
+            return None
+
+        indices = np.flatnonzero(speech)
+        pad = int(round(self.padding * 1000 / self.frame_ms))
+        first = max(0, indices[0] - pad)
+        last = min(len(speech), indices[-1] + 1 + pad)
+
+        keep = None
+        if self.max_pause > 0:
+            # 首尾保留的 padding 不属于内部停顿
+            region = speech[first:last].copy()
+            region[:indices[0] - first] = True
+            region[indices[-1] + 1 - first:] = True
+            keep = self._compress_pauses(region)
+
+        start = first * frame_len
+        end = audio.num_frames if last == len(speech) else last * frame_len
+        samples = audio.samples[start:end]
+        if keep is not None and not keep.all():
+            sample_keep = np.repeat(keep, frame_len)
+            tail = len(samples) - len(sample_keep)
+            if tail > 0:
+                sample_keep = np.concatenate((sample_keep, np.ones(tail, dtype=bool)))
+            samples = samples[sample_keep[:len(samples)]]
+
+        result = AudioData(samples, audio.sample_rate)
+        self._record(audio.nbytes, result.nbytes, skipped=False)
+        saved = audio.duration - result.duration
+        if saved > 0:
+            log.info(f"✂️ VAD 去除静音 {saved:.2f}s，节省 {(audio.nbytes - result.nbytes) / 1024:.1f}KB")
+        return result
+
+    def _compress_pauses(self, speech: np.ndarray) -> np.ndarray:
+        """把超过 max_pause 的内部静音段压缩为 max_pause，保留静音段首尾各一半"""
+        keep = np.ones(len(speech), dtype=bool)
+        max_frames = int(self.max_pause * 1000 / self.frame_ms)
+        edges = np.diff(np.concatenate(([1], speech.astype(np.int8), [1])))
+        starts = np.flatnonzero(edges == -1)
+        ends = np.flatnonzero(edges == 1)
+        for start, end in zip(starts, ends):
+            if end - start > max_frames:
+                half = max_frames // 2
+                keep[start + half:end - (max_frames - half)] = False
+        return keep
+
+    def _record(self, bytes_in: int, bytes_out: int, skipped: bool):
+        with self._lock:
+            self._stats["clips"] += 1
+            self._stats["bytes_in"] += bytes_in
+            self._stats["bytes_out"] += bytes_out
+            if skipped:
+                self._stats["skipped_calls"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计：处理录音数、跳过的 API 调用数、节省字节数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+        return stats